@@ -6,12 +6,10 @@ Add a new appointment with date picker widget.
 import tkinter as tk
 from tkinter import ttk, messagebox
 import database
+import audit
+from database import APPOINTMENT_TYPES, HOURS, MINUTES
 from date_picker import DatePicker
 
-APPOINTMENT_TYPES = ["Assessment", "Treatment", "Follow-up", "Review", "Discharge"]
-HOURS   = [f"{h:02d}" for h in range(8, 19)]
-MINUTES = ["00", "15", "30", "45"]
-
 
 class AddAppointment:
 
@@ -20,9 +18,10 @@ class AddAppointment:
         self.user_id  = user_id
         self.on_close = on_close
         self.window.title("New Appointment")
-        self.window.geometry("440x480")
+        self.window.geometry("440x520")
         self.window.resizable(False, False)
         self.patients = database.get_all_patients()
+        self.practitioners = database.get_practitioners()
         self.create_widgets()
 
     def create_widgets(self):
@@ -36,7 +35,7 @@ class AddAppointment:
         tk.Label(form, text="Patient:", anchor="w").grid(
             row=0, column=0, sticky="w", pady=8)
         self.patient_var = tk.StringVar()
-        patient_names = [f"{p[0]} - {p[1]}" for p in self.patients]
+        patient_names = [f"{p.patient_id} - {p.name}" for p in self.patients]
         self.patient_cb = ttk.Combobox(form, textvariable=self.patient_var,
                                        values=patient_names, width=28, state="readonly")
         self.patient_cb.grid(row=0, column=1, pady=8, padx=(10, 0))
@@ -70,11 +69,21 @@ class AddAppointment:
                      width=28, state="readonly").grid(
             row=3, column=1, pady=8, padx=(10, 0))
 
+        # Practitioner
+        tk.Label(form, text="Practitioner:", anchor="w").grid(
+            row=4, column=0, sticky="w", pady=8)
+        self.practitioner_var = tk.StringVar(
+            value=self.practitioners[0] if self.practitioners else "Unassigned")
+        ttk.Combobox(form, textvariable=self.practitioner_var,
+                     values=self.practitioners + ["Unassigned"],
+                     width=28, state="readonly").grid(
+            row=4, column=1, pady=8, padx=(10, 0))
+
         # Notes
         tk.Label(form, text="Notes:", anchor="w").grid(
-            row=4, column=0, sticky="nw", pady=8)
+            row=5, column=0, sticky="nw", pady=8)
         self.notes_text = tk.Text(form, width=22, height=4)
-        self.notes_text.grid(row=4, column=1, pady=8, padx=(10, 0))
+        self.notes_text.grid(row=5, column=1, pady=8, padx=(10, 0))
 
         # Buttons
         btn_frame = tk.Frame(self.window)
@@ -91,19 +100,52 @@ class AddAppointment:
         appt_time   = f"{self.hour_var.get()}:{self.min_var.get()}"
         appt_type   = self.type_var.get()
         notes       = self.notes_text.get("1.0", tk.END).strip()
+        practitioner = self.practitioner_var.get()
 
         if not patient_str:
             messagebox.showerror("Error", "Please select a patient.")
             return
 
         patient_id = int(patient_str.split(" - ")[0])
-        success = database.add_appointment(
-            patient_id, appt_date, appt_time, appt_type, notes, self.user_id
+        booking = database.book_appointment(
+            patient_id, appt_date, appt_time, appt_type, notes, self.user_id,
+            practitioner_id=None if practitioner == "Unassigned" else practitioner
         )
-        if success:
+        if booking.appointment_id is not None:
+            audit.record(audit.CREATE, "appointment", booking.appointment_id,
+                         f"patient {patient_id} on {appt_date} at {appt_time}")
             messagebox.showinfo("Booked!", f"Appointment booked for {appt_date} at {appt_time}.")
             if self.on_close:
                 self.on_close()
             self.window.destroy()
+        elif booking.conflicts:
+            offer_alternative(self, practitioner, booking)
         else:
             messagebox.showerror("Error", "Could not save appointment.")
+
+
+def offer_alternative(form, practitioner, booking):
+    """
+    Shows a Booking's clash and offers the practitioner's next free slot:
+    if taken, the form's date and time are set to it and it saves again.
+    """
+    clashes = "\n".join(f"  {c.appointment_date} {c.appointment_time} "
+                         f"({c.duration_minutes} min, {c.appointment_type})"
+                         for c in booking.conflicts)
+    message = f"{practitioner} is already booked:\n{clashes}"
+    if not booking.alternatives:
+        messagebox.showwarning("Practitioner busy",
+                               message + "\n\nNo free slots in the next two weeks.")
+        return
+    free = "\n".join(f"  {s.appointment_date} {s.appointment_time}"
+                      for s in booking.alternatives)
+    first = booking.alternatives[0]
+    if messagebox.askyesno(
+            "Practitioner busy",
+            f"{message}\n\nFree slots:\n{free}\n\n"
+            f"Book {first.appointment_date} at {first.appointment_time} instead?"):
+        form.date_picker.set(first.appointment_date)
+        hour, minute = first.appointment_time.split(":")
+        form.hour_var.set(hour)
+        form.min_var.set(minute)
+        form.save()
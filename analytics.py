@@ -0,0 +1,190 @@
+"""
+analytics.py - Fixit Physio Enhanced System
+Weekday x time-slot utilisation heat maps built with NumPy.
+
+Appointment rows are pulled straight from the cursor into columnar
+arrays (day number, minute of day, duration, status code), and every matrix is
+computed with vectorised bincount/reshape operations - no Python loop
+runs over the appointments themselves.
+"""
+
+import csv
+import html
+import sqlite3
+from datetime import date
+import numpy as np
+import database
+
+WEEKDAYS    = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+SLOT_LABELS = [f"{h}:{m}" for h in database.HOURS for m in database.MINUTES]
+SLOT_MINUTES = database.SLOT_MINUTES
+FIRST_MINUTE = int(database.HOURS[0]) * 60
+
+STATUS_CODES = {status: code for code, status in enumerate(database.APPOINTMENT_STATUSES)}
+CANCELLED = STATUS_CODES["Cancelled"]
+COMPLETED = STATUS_CODES["Completed"]
+NO_SHOW   = STATUS_CODES["No Show"]
+
+ROW_DTYPE = np.dtype([("day", np.int32), ("minute", np.int16), ("duration", np.int16),
+                      ("status", np.int8)])
+
+
+# ─────────────────────────────────────────────────────────
+# LOADING
+# ─────────────────────────────────────────────────────────
+
+def load_appointment_columns(start_date="", end_date=""):
+    """
+    Returns a structured array with one record per appointment:
+    day (days since 1970-01-01), minute (minute of day), duration in
+    minutes and status code.
+    Optional start/end dates (YYYY-MM-DD, inclusive) limit the range.
+    """
+    status_case = " ".join(
+        f"WHEN '{status}' THEN {code}" for status, code in STATUS_CODES.items()
+    )
+    query = f'''
+        SELECT CAST(julianday(appointment_date) - 2440587.5 AS INTEGER),
+               CAST(substr(appointment_time, 1, 2) AS INTEGER) * 60
+                 + CAST(substr(appointment_time, 4, 2) AS INTEGER),
+               duration_minutes,
+               CASE status {status_case} ELSE -1 END
+        FROM appointments
+        WHERE appointment_date BETWEEN ? AND ?
+          AND julianday(appointment_date) IS NOT NULL
+    '''
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, (start_date or "0000-00-00", end_date or "9999-99-99"))
+        columns = np.fromiter(cursor, dtype=ROW_DTYPE)
+        conn.close()
+        return columns
+    except sqlite3.Error as e:
+        database.log_error("Load appointment columns", e)
+        return np.zeros(0, dtype=ROW_DTYPE)
+
+
+# ─────────────────────────────────────────────────────────
+# MATRICES
+# ─────────────────────────────────────────────────────────
+
+def _cell_index(columns):
+    """Flat weekday * slot index for each row, and a mask of rows on the grid."""
+    weekday = (columns["day"] + 3) % 7          # 1970-01-01 was a Thursday
+    offset  = columns["minute"].astype(np.int32) - FIRST_MINUTE
+    slot    = offset // SLOT_MINUTES
+    on_grid = (offset >= 0) & (slot < database.SLOTS_PER_DAY)
+    return weekday * database.SLOTS_PER_DAY + slot, on_grid
+
+
+def _count_matrix(cells, mask):
+    counts = np.bincount(cells[mask], minlength=7 * database.SLOTS_PER_DAY)
+    return counts.reshape(7, database.SLOTS_PER_DAY)
+
+
+def _day_number(iso_date):
+    return (date.fromisoformat(iso_date) - date(1970, 1, 1)).days
+
+
+def weekday_occurrences(columns, start_date="", end_date=""):
+    """
+    How many times each weekday falls inside the requested date range
+    (as given to load_appointment_columns); an open end of the range
+    stops at the first or last loaded appointment.
+    """
+    if len(columns) == 0 and not (start_date and end_date):
+        return np.zeros(7, dtype=np.int64)
+    first = _day_number(start_date) if start_date else columns["day"].min()
+    last  = _day_number(end_date) if end_date else columns["day"].max()
+    days = np.arange(first, last + 1)
+    return np.bincount((days + 3) % 7, minlength=7)
+
+
+def _held_slots(columns):
+    """
+    One row per quarter-hour slot each appointment holds: a 45-minute
+    booking becomes three rows, each starting a slot later.
+    """
+    held = np.maximum(-(-columns["duration"].astype(np.int32) // SLOT_MINUTES), 1)
+    spread = np.repeat(columns, held)
+    # Position of each row within its appointment: 0, 1, ... held - 1
+    step = np.arange(len(spread)) - np.repeat(np.cumsum(held) - held, held)
+    spread["minute"] += (step * SLOT_MINUTES).astype(np.int16)
+    return spread
+
+
+def occupancy_matrix(columns, start_date="", end_date=""):
+    """
+    Average number of non-cancelled bookings holding each weekday x slot,
+    i.e. slots held divided by how many times that weekday occurred in
+    the requested range. A booking holds every slot its duration covers.
+    """
+    spread = _held_slots(columns)
+    cells, on_grid = _cell_index(spread)
+    booked = _count_matrix(cells, on_grid & (spread["status"] != CANCELLED))
+    weeks = weekday_occurrences(columns, start_date, end_date)[:, None]
+    return np.divide(booked, weeks, out=np.zeros(booked.shape), where=weeks > 0)
+
+
+def no_show_matrix(columns):
+    """
+    No-show rate per weekday x slot: no-shows over completed + no-shows.
+    Cells with no attended or missed appointments are NaN.
+    """
+    cells, on_grid = _cell_index(columns)
+    no_show = _count_matrix(cells, on_grid & (columns["status"] == NO_SHOW))
+    completed = _count_matrix(cells, on_grid & (columns["status"] == COMPLETED))
+    seen = no_show + completed
+    return np.divide(no_show, seen, out=np.full(seen.shape, np.nan), where=seen > 0)
+
+
+# ─────────────────────────────────────────────────────────
+# EXPORT
+# ─────────────────────────────────────────────────────────
+
+def export_csv(matrix, path):
+    """Writes a weekday x slot matrix as CSV (weekdays as rows)."""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Weekday"] + SLOT_LABELS)
+        for day, row in zip(WEEKDAYS, matrix):
+            writer.writerow([day] + ["" if np.isnan(v) else f"{v:.3f}" for v in row])
+
+
+def _cell_colour(value, top):
+    """White -> clinic blue, scaled against the matrix maximum."""
+    if np.isnan(value) or top <= 0:
+        return "#ffffff"
+    t = min(value / top, 1.0)
+    r, g, b = (int(255 + (c - 255) * t) for c in (0x2E, 0x75, 0xB6))
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def export_html(matrix, path, title="Utilisation heat map", percent=False):
+    """
+    Writes a self-contained HTML heat map (slots as rows, weekdays as
+    columns) that can be opened in any browser or printed.
+    """
+    top = np.nanmax(matrix) if np.any(~np.isnan(matrix)) else 0.0
+    lines = [
+        "<!DOCTYPE html><html><head><meta charset='utf-8'>",
+        f"<title>{html.escape(title)}</title>",
+        "<style>body{font-family:Arial} td,th{padding:3px 8px;text-align:center;"
+        "font-size:12px;border:1px solid #ddd} table{border-collapse:collapse}</style>",
+        f"</head><body><h2>{html.escape(title)}</h2><table>",
+        "<tr><th>Time</th>" + "".join(f"<th>{d}</th>" for d in WEEKDAYS) + "</tr>",
+    ]
+    for slot, label in enumerate(SLOT_LABELS):
+        cells = []
+        for day in range(7):
+            value = matrix[day, slot]
+            if np.isnan(value):
+                text = "-"
+            else:
+                text = f"{value:.0%}" if percent else f"{value:.2f}"
+            cells.append(f"<td style='background:{_cell_colour(value, top)}'>{text}</td>")
+        lines.append(f"<tr><th>{label}</th>{''.join(cells)}</tr>")
+    lines.append("</table></body></html>")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
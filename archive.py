@@ -0,0 +1,123 @@
+"""
+archive.py - Fixit Physio Enhanced System
+Moves finished appointments (and their paid invoices) out of the live
+database into a separate archive database file.
+
+Rows are copied with INSERT OR IGNORE, so archiving the same period twice
+is harmless. With delete=True the copied rows are then removed from the
+live database in small batches, each in its own short transaction.
+"""
+
+import sqlite3
+import time
+import database
+
+BATCH_SIZE = 500
+
+ARCHIVE_TABLES = {
+    "patients": '''
+        CREATE TABLE IF NOT EXISTS archive.patients (
+            patient_id INTEGER PRIMARY KEY,
+            name TEXT, phone TEXT, email TEXT, date_of_birth TEXT,
+            notes TEXT, created_date TEXT
+        )''',
+    "appointments": '''
+        CREATE TABLE IF NOT EXISTS archive.appointments (
+            appointment_id INTEGER PRIMARY KEY,
+            patient_id INTEGER, appointment_date TEXT, appointment_time TEXT,
+            appointment_type TEXT, status TEXT, notes TEXT, created_by TEXT,
+            created_at TEXT, duration_minutes INTEGER, practitioner_id TEXT
+        )''',
+    "invoices": '''
+        CREATE TABLE IF NOT EXISTS archive.invoices (
+            invoice_id INTEGER PRIMARY KEY,
+            patient_id INTEGER, appointment_id INTEGER, amount REAL,
+            description TEXT, status TEXT, created_by TEXT, created_at TEXT
+        )''',
+}
+
+# Appointments eligible for archiving: finished, before the cutoff, and
+# with no unpaid invoice still pointing at them
+ELIGIBLE = '''
+    SELECT a.appointment_id FROM main.appointments a
+    WHERE a.start_min < ?
+      AND a.status IN ('Completed', 'Cancelled', 'No Show')
+      AND NOT EXISTS (SELECT 1 FROM main.invoices i
+                      WHERE i.appointment_id = a.appointment_id AND i.status != 'Paid')
+'''
+
+
+def archive_before(before_date, archive_path, delete=False, pause=0.02):
+    """
+    Copies appointments that finished before before_date (YYYY-MM-DD),
+    their paid invoices and their patients into archive_path.
+    Returns {"appointments", "invoices", "deleted"} counts.
+    """
+    cutoff = database.to_epoch_minutes(before_date)
+    totals = {"appointments": 0, "invoices": 0, "deleted": 0}
+    try:
+        conn = database.get_connection()
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        cursor.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+        for ddl in ARCHIVE_TABLES.values():
+            cursor.execute(ddl)
+
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("CREATE TEMP TABLE archive_ids AS " + ELIGIBLE, (cutoff,))
+        cursor.execute('''
+            INSERT OR REPLACE INTO archive.patients
+            SELECT patient_id, name, phone, email, date_of_birth, notes, created_date
+            FROM main.patients WHERE patient_id IN
+                (SELECT patient_id FROM main.appointments
+                 WHERE appointment_id IN (SELECT appointment_id FROM archive_ids))
+        ''')
+        cursor.execute('''
+            INSERT OR IGNORE INTO archive.appointments
+            SELECT appointment_id, patient_id, appointment_date, appointment_time,
+                   appointment_type, status, notes, created_by, created_at,
+                   duration_minutes, practitioner_id
+            FROM main.appointments
+            WHERE appointment_id IN (SELECT appointment_id FROM archive_ids)
+        ''')
+        totals["appointments"] = cursor.rowcount
+        cursor.execute('''
+            INSERT OR IGNORE INTO archive.invoices
+            SELECT invoice_id, patient_id, appointment_id, amount, description,
+                   status, created_by, created_at
+            FROM main.invoices
+            WHERE appointment_id IN (SELECT appointment_id FROM archive_ids)
+        ''')
+        totals["invoices"] = cursor.rowcount
+        cursor.execute("COMMIT")
+
+        if delete:
+            totals["deleted"] = _delete_archived(cursor, pause)
+        cursor.execute("DROP TABLE temp.archive_ids")
+        cursor.execute("DETACH DATABASE archive")
+        conn.close()
+    except sqlite3.Error as e:
+        database.log_error("Archive", e)
+    return totals
+
+
+def _delete_archived(cursor, pause):
+    """Removes archived invoices and appointments, a batch per transaction."""
+    deleted = 0
+    for table, key in (("invoices", "appointment_id"), ("appointments", "appointment_id")):
+        while True:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(
+                f'''DELETE FROM main.{table} WHERE rowid IN
+                    (SELECT rowid FROM main.{table}
+                     WHERE {key} IN (SELECT appointment_id FROM archive_ids) LIMIT ?)''',
+                (BATCH_SIZE,)
+            )
+            count = cursor.rowcount
+            cursor.execute("COMMIT")
+            if table == "appointments":
+                deleted += count
+            if count < BATCH_SIZE:
+                break
+            time.sleep(pause)
+    return deleted
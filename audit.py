@@ -0,0 +1,206 @@
+"""
+audit.py - Fixit Physio Enhanced System
+Clinical-governance audit trail: who viewed or changed which record.
+
+record() only timestamps the event and puts it on an in-memory queue,
+so screens can call it on every action without touching the database.
+A background writer thread drains the queue and appends events to the
+audit_log table of the site they happened at, one executemany()
+transaction per batch. Pending events are flushed at interpreter exit;
+call shutdown() to flush explicitly (e.g. on logout).
+"""
+
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+import database
+import records
+
+BATCH_SIZE     = 500
+FLUSH_INTERVAL = 0.5       # seconds the writer waits to fill a batch
+QUERY_LIMIT    = 1000
+
+# Actions used by the screens
+VIEW         = "view"
+CREATE       = "create"
+UPDATE       = "update"
+DELETE       = "delete"
+LOGIN        = "login"
+LOGIN_FAILED = "login_failed"
+LOGOUT       = "logout"
+EXPORT       = "export"
+
+_queue   = queue.SimpleQueue()
+_lock    = threading.Lock()
+_writer  = None
+_staff_id = None            # signed-in user, used when record() isn't given one
+
+_STOP = object()
+
+
+def set_user(staff_id):
+    """Sets the staff member events are attributed to by default."""
+    global _staff_id
+    _staff_id = staff_id
+
+
+# ─────────────────────────────────────────────────────────
+# RECORDING
+# ─────────────────────────────────────────────────────────
+
+def record(action, entity, entity_id=None, detail="", staff_id=None):
+    """
+    Queues an audit event. Never blocks on the database; the event is
+    bound to the current site's database file at call time.
+    """
+    _queue.put((
+        database.current_db_path(),
+        datetime.now().isoformat(sep=" ", timespec="microseconds"),
+        staff_id or _staff_id,
+        action,
+        entity,
+        None if entity_id is None else str(entity_id),
+        detail or None,
+    ))
+    if _writer is None:
+        _start_writer()
+
+
+def _start_writer():
+    global _writer
+    with _lock:
+        if _writer is None:
+            thread = threading.Thread(target=_write_loop, name="audit-writer", daemon=True)
+            thread.start()
+            _writer = thread
+
+
+def _write_batch(events):
+    """Appends events to each site's audit_log. Returns the number written."""
+    by_db = {}
+    for db_path, *row in events:
+        by_db.setdefault(db_path, []).append(row)
+    written = 0
+    for db_path, rows in by_db.items():
+        for attempt in range(3):
+            try:
+                with closing(database.connect(db_path, timeout=10)) as conn, conn:
+                    conn.executemany(
+                        '''INSERT INTO audit_log
+                           (logged_at, staff_id, action, entity, entity_id, detail)
+                           VALUES (?,?,?,?,?,?)''',
+                        rows
+                    )
+                written += len(rows)
+                break
+            except sqlite3.Error as e:
+                if attempt == 2:
+                    database.log_error(f"Audit write ({len(rows)} events lost)", e)
+                else:
+                    time.sleep(0.2)
+    return written
+
+
+def _write_loop():
+    stopping = False
+    while not stopping:
+        events, waiters = [], []
+        try:
+            item = _queue.get(timeout=FLUSH_INTERVAL)
+        except queue.Empty:
+            continue
+        # Drain whatever else is already queued, up to one batch
+        while True:
+            if item is _STOP:
+                stopping = True
+            elif isinstance(item, threading.Event):
+                waiters.append(item)
+            else:
+                events.append(item)
+            if len(events) >= BATCH_SIZE:
+                break
+            try:
+                item = _queue.get_nowait()
+            except queue.Empty:
+                break
+        if events:
+            _write_batch(events)
+        for waiter in waiters:
+            waiter.set()
+
+
+def flush(timeout=5.0):
+    """Blocks until every event queued before this call is written."""
+    if _writer is None:
+        return True
+    done = threading.Event()
+    _queue.put(done)
+    return done.wait(timeout)
+
+
+def shutdown(timeout=5.0):
+    """Writes all pending events and stops the writer thread."""
+    global _writer
+    with _lock:
+        thread, _writer = _writer, None
+    if thread is None:
+        return
+    _queue.put(_STOP)
+    thread.join(timeout)
+
+
+atexit.register(shutdown)
+
+
+# ─────────────────────────────────────────────────────────
+# INVESTIGATION
+# ─────────────────────────────────────────────────────────
+
+def query(entity=None, entity_id=None, staff_id=None, action=None,
+          since="", until="", limit=QUERY_LIMIT):
+    """
+    Returns AuditRow records for the current site, newest first.
+    since/until are "YYYY-MM-DD[ HH:MM:SS]" bounds on logged_at
+    (until is exclusive). Pending events are flushed first.
+    """
+    flush()
+    clauses, params = [], []
+    for column, value in (("entity", entity), ("staff_id", staff_id), ("action", action)):
+        if value:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    if entity_id is not None:
+        clauses.append("entity_id = ?")
+        params.append(str(entity_id))
+    if since:
+        clauses.append("logged_at >= ?")
+        params.append(since)
+    if until:
+        clauses.append("logged_at < ?")
+        params.append(until)
+    sql = ("SELECT audit_id, logged_at, staff_id, action, entity, entity_id, detail"
+           " FROM audit_log")
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY logged_at DESC, audit_id DESC LIMIT ?"
+    params.append(limit)
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = records.factory(records.AuditRow)
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+    except sqlite3.Error as e:
+        database.log_error("Audit query", e)
+        return []
+
+
+def patient_history(patient_id, limit=QUERY_LIMIT):
+    """Every recorded access to one patient's record, newest first."""
+    return query(entity="patient", entity_id=patient_id, limit=limit)
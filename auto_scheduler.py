@@ -0,0 +1,243 @@
+"""
+auto_scheduler.py - Fixit Physio Enhanced System
+Batch scheduler placing whole treatment plans into free capacity.
+
+A TreatmentPlan asks for a number of sessions of one appointment type,
+spacing_days apart, starting on or after start_date, on preferred
+weekdays (digits 1-5, Monday = 1) within a daily time window, optionally
+with a fixed practitioner. solve() reads the current occupancy in one
+query, keeps it as a bitmask of 15-minute cells per practitioner and day,
+and places plans greedily, most constrained first. Each session goes on
+the day closest to its target (previous session + spacing, within
+SPACING_SLACK days), preferring the practitioner who saw the first
+session, then the least loaded one. Sessions that cannot be placed are
+reported rather than guessed at.
+
+schedule() books everything placed in one transaction:
+
+    python cli.py schedule plans.csv --placements placed.csv
+"""
+
+import csv
+import json
+from datetime import date, datetime
+import database
+import records
+
+CELL_MINUTES       = 15
+FIRST_SESSION_DAYS = 14     # days after start_date searched for the first session
+SPACING_SLACK      = 2      # days a later session may move from its target
+
+PLAN_DEFAULTS = {
+    "sessions":         1,
+    "spacing_days":     7,
+    "start_date":       "",
+    "preferred_days":   "12345",
+    "earliest_time":    "08:00",
+    "latest_time":      "19:00",
+    "practitioner_id":  None,
+    "duration_minutes": database.DEFAULT_DURATION,
+}
+
+UNPLACED_NO_SLOT = "no free slot in window"
+UNPLACED_TAKEN   = "slot booked meanwhile"
+
+
+# ─────────────────────────────────────────────────────────
+# PLANS
+# ─────────────────────────────────────────────────────────
+
+def make_plan(values):
+    """
+    Builds a TreatmentPlan from a dict (a CSV row or JSON object); missing
+    or blank fields take PLAN_DEFAULTS. Raises ValueError on bad values.
+    """
+    fields = dict(PLAN_DEFAULTS)
+    fields.update({k: v for k, v in values.items() if v not in (None, "")})
+    if "patient_id" not in fields or "appointment_type" not in fields:
+        raise ValueError("a plan needs patient_id and appointment_type")
+    if fields["appointment_type"] not in database.APPOINTMENT_TYPES:
+        raise ValueError(f"unknown appointment type {fields['appointment_type']!r}")
+    plan = records.TreatmentPlan(
+        int(fields["patient_id"]), fields["appointment_type"], int(fields["sessions"]),
+        int(fields["spacing_days"]), fields["start_date"] or date.today().isoformat(),
+        str(fields["preferred_days"]), fields["earliest_time"], fields["latest_time"],
+        fields["practitioner_id"] or None, int(fields["duration_minutes"])
+    )
+    datetime.strptime(plan.start_date, "%Y-%m-%d")
+    if plan.sessions < 1 or plan.spacing_days < 1:
+        raise ValueError("sessions and spacing_days must be at least 1")
+    database.check_duration(plan.duration_minutes)
+    return plan
+
+
+def read_plans(stream, fmt="csv"):
+    """Reads plans from CSV (header row) or JSON lines."""
+    if fmt == "json":
+        entries = (json.loads(line) for line in stream if line.strip())
+    else:
+        entries = csv.DictReader(stream)
+    return [make_plan(entry) for entry in entries]
+
+
+# ─────────────────────────────────────────────────────────
+# OCCUPANCY
+# ─────────────────────────────────────────────────────────
+
+def _cells(start, end):
+    """Bitmask of the 15-minute cells of the day that [start, end) touches."""
+    first, last = start // CELL_MINUTES, (min(end, 1440) - 1) // CELL_MINUTES
+    return ((1 << (last - first + 1)) - 1) << first
+
+
+class Occupancy:
+    """
+    Who is busy when over the planning horizon: a cell bitmask per
+    (practitioner, day), the days each patient already attends, and how
+    many sessions each practitioner has been given (for balancing).
+    """
+
+    def __init__(self, practitioners, from_min, until_min):
+        self.busy          = {}
+        self.patient_days  = set()
+        self.load          = dict.fromkeys(practitioners, 0)
+        for practitioner, patient, start, end in database.get_busy_intervals(from_min,
+                                                                             until_min):
+            day, minute = divmod(start, 1440)
+            self.patient_days.add((patient, day))
+            if practitioner:
+                self.load[practitioner] = self.load.get(practitioner, 0) + 1
+                self.take(practitioner, day, minute, minute + (end - start))
+
+    def is_free(self, practitioner, day, mask):
+        return not self.busy.get((practitioner, day), 0) & mask
+
+    def take(self, practitioner, day, start, end):
+        key = (practitioner, day)
+        self.busy[key] = self.busy.get(key, 0) | _cells(start, end)
+
+
+# ─────────────────────────────────────────────────────────
+# SOLVING
+# ─────────────────────────────────────────────────────────
+
+def _minute_of_day(hhmm):
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def _starts(plan):
+    """Candidate start minutes of the day inside the plan's time window."""
+    earliest, latest = _minute_of_day(plan.earliest_time), _minute_of_day(plan.latest_time)
+    return [minute
+            for minute in (_minute_of_day(f"{h}:{m}")
+                           for h in database.HOURS for m in database.MINUTES)
+            if minute >= earliest and minute + plan.duration_minutes <= latest]
+
+
+def _days(plan, first, last, target):
+    """Working preferred days in [first, last], closest to target first (later wins ties)."""
+    days = [d for d in range(first, last + 1)
+            if str((d + 3) % 7 + 1) in plan.preferred_days and (d + 3) % 7 < 5]
+    return sorted(days, key=lambda d: (abs(d - target), d < target))
+
+
+def _difficulty(item):
+    """Sort key placing the most constrained plans first."""
+    _, plan = item
+    return (plan.practitioner_id is None, -plan.sessions,
+            len(plan.preferred_days) * len(_starts(plan)), -plan.duration_minutes)
+
+
+def solve(plans, practitioners=None, occupancy=None):
+    """
+    Places the sessions of every plan. Returns (placed, unplaced): lists
+    of PlannedSession (appointment_id None) and UnplacedSession.
+    """
+    practitioners = practitioners or database.get_practitioners()
+    now = database.now_epoch_minutes()
+    today = now // 1440
+    if occupancy is None:
+        horizon = max((database.to_epoch_minutes(p.start_date) // 1440 + FIRST_SESSION_DAYS
+                       + p.sessions * (p.spacing_days + SPACING_SLACK) for p in plans),
+                      default=today)
+        occupancy = Occupancy(practitioners, now, (horizon + 1) * 1440)
+
+    placed, unplaced = [], []
+    for _, plan in sorted(enumerate(plans), key=_difficulty):
+        starts = _starts(plan)
+        candidates = [plan.practitioner_id] if plan.practitioner_id else practitioners
+        primary = plan.practitioner_id
+        target = max(database.to_epoch_minutes(plan.start_date) // 1440, today)
+        first, last = target, target + FIRST_SESSION_DAYS
+        for session in range(1, plan.sessions + 1):
+            slot = None
+            ordered = sorted(candidates,
+                             key=lambda p: (p != primary, occupancy.load.get(p, 0)))
+            # With a primary practitioner every day is tried with them
+            # before anyone else, so patients keep the same physio
+            for group in ([ordered[:1], ordered[1:]] if primary else [ordered]):
+                for day in _days(plan, first, last, target):
+                    if (plan.patient_id, day) in occupancy.patient_days:
+                        continue
+                    slot = _first_free(occupancy, group, day, starts, plan.duration_minutes,
+                                       now)
+                    if slot:
+                        break
+                if slot:
+                    break
+            target_date = database.from_epoch_minutes(target * 1440)[0]
+            if slot is None:
+                unplaced.append(records.UnplacedSession(plan.patient_id, session,
+                                                        plan.appointment_type, target_date,
+                                                        UNPLACED_NO_SLOT))
+                day = target
+            else:
+                practitioner, day, minute = slot
+                occupancy.take(practitioner, day, minute, minute + plan.duration_minutes)
+                occupancy.patient_days.add((plan.patient_id, day))
+                occupancy.load[practitioner] = occupancy.load.get(practitioner, 0) + 1
+                primary = primary or practitioner
+                appt_date, appt_time = database.from_epoch_minutes(day * 1440 + minute)
+                placed.append(records.PlannedSession(plan.patient_id, session, practitioner,
+                                                     appt_date, appt_time,
+                                                     plan.duration_minutes,
+                                                     plan.appointment_type, None))
+            target = day + plan.spacing_days
+            first, last = max(day + 1, target - SPACING_SLACK), target + SPACING_SLACK
+    placed.sort(key=lambda s: (s.appointment_date, s.appointment_time, s.practitioner_id))
+    unplaced.sort(key=lambda u: (u.patient_id, u.session))
+    return placed, unplaced
+
+
+def _first_free(occupancy, practitioners, day, starts, duration, now):
+    """(practitioner, day, minute) of the earliest free start, trying practitioners in order."""
+    for practitioner in practitioners:
+        for minute in starts:
+            if day * 1440 + minute <= now:
+                continue
+            if occupancy.is_free(practitioner, day, _cells(minute, minute + duration)):
+                return practitioner, day, minute
+    return None
+
+
+def schedule(plans, created_by, practitioners=None, dry_run=False):
+    """
+    Solves the plans and books every placed session in one transaction.
+    Returns (booked, unplaced); sessions whose slot was taken between the
+    solve and the commit move to unplaced. Raises RuntimeError if the
+    booking transaction failed (nothing is booked then).
+    """
+    placed, unplaced = solve(plans, practitioners)
+    if dry_run or not placed:
+        return placed, unplaced
+    booked = database.book_appointments(placed, created_by)
+    if booked is None:
+        raise RuntimeError("Booking transaction failed; nothing was booked")
+    for s in booked:
+        if s.appointment_id is None:
+            unplaced.append(records.UnplacedSession(s.patient_id, s.session,
+                                                    s.appointment_type, s.appointment_date,
+                                                    UNPLACED_TAKEN))
+    unplaced.sort(key=lambda u: (u.patient_id, u.session))
+    return [s for s in booked if s.appointment_id is not None], unplaced
@@ -0,0 +1,47 @@
+"""
+background.py - Fixit Physio Enhanced System
+Runs long jobs (reminders, document batches, patient erasure) off the
+Tk thread so the screens stay responsive.
+
+Tk must only be touched from its own thread, so run_for_screen() has the
+worker thread just store the job's result, and a widget.after() poll on
+the Tk thread picks it up and calls back.
+"""
+
+import threading
+
+POLL_MS = 500
+
+
+def run_in_background(job, *args, name=None, on_done=None, **kwargs):
+    """
+    Runs job(*args, **kwargs) on a daemon thread and returns the thread.
+    on_done(result) is called from that thread when the job finishes.
+    """
+    def worker():
+        result = job(*args, **kwargs)
+        if on_done:
+            on_done(result)
+
+    thread = threading.Thread(target=worker, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+def run_for_screen(widget, job, *args, on_done, name=None, **kwargs):
+    """
+    Like run_in_background(), but on_done(result) is called on the Tk
+    thread, from a poll scheduled with widget.after().
+    """
+    results = []
+
+    def check_done():
+        if not results:
+            widget.after(POLL_MS, check_done)
+            return
+        on_done(results[0])
+
+    # The worker thread only appends; Tk is touched from check_done
+    thread = run_in_background(job, *args, name=name, on_done=results.append, **kwargs)
+    widget.after(POLL_MS, check_done)
+    return thread
@@ -0,0 +1,74 @@
+"""
+batches.py - Fixit Physio Enhanced System
+Renders large runs of documents (invoices, statements) to disk.
+
+A run is a stream of (chunk, skipped) pairs from pending_chunks(): items
+in chunks of CHUNK_SIZE, less those whose files already exist, so an
+interrupted run simply resumes. render_chunks() renders small runs inline
+and hands large ones to a process pool, with a bounded number of chunks
+in flight so memory stays flat however long the run. Files are written
+atomically, so a half-written document is never taken as done.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import chain, islice
+
+CHUNK_SIZE   = 50
+MAX_PENDING  = 8               # chunks in flight per worker process
+INLINE_LIMIT = 2 * CHUNK_SIZE  # smaller runs skip the process pool
+
+
+def write_atomic(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def pending_chunks(items, is_done):
+    """Yields (chunk, skipped) for the items is_done(item) says aren't on disk yet."""
+    chunk, skipped = [], 0
+    for item in items:
+        if is_done(item):
+            skipped += 1
+            continue
+        chunk.append(item)
+        if len(chunk) == CHUNK_SIZE:
+            yield chunk, skipped
+            chunk, skipped = [], 0
+    if chunk or skipped:
+        yield chunk, skipped
+
+
+def render_chunks(chunks, render_chunk, *args, processes=None):
+    """
+    Renders each chunk of a pending_chunks() stream with
+    render_chunk(chunk, *args), which returns the number of items done.
+    render_chunk must be a module-level function so worker processes can
+    import it. Returns {"rendered": n, "skipped": n}.
+    """
+    totals = {"rendered": 0, "skipped": 0}
+    chunks = iter(chunks)
+    first = list(islice(chunks, INLINE_LIMIT // CHUNK_SIZE))
+    if sum(len(chunk) for chunk, _ in first) < INLINE_LIMIT:
+        # Small run: not worth starting worker processes
+        for chunk, skipped in first:
+            totals["skipped"]  += skipped
+            totals["rendered"] += render_chunk(chunk, *args)
+        return totals
+
+    workers = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for chunk, skipped in chain(first, chunks):
+            totals["skipped"] += skipped
+            if not chunk:
+                continue
+            pending.add(pool.submit(render_chunk, chunk, *args))
+            # Bound the chunks in flight so memory stays flat on huge runs
+            if len(pending) >= MAX_PENDING * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                totals["rendered"] += sum(f.result() for f in done)
+        totals["rendered"] += sum(f.result() for f in pending)
+    return totals
@@ -4,8 +4,31 @@ Create, view and manage invoices.
 """
 
 import tkinter as tk
-from tkinter import ttk, messagebox
+from datetime import date
+from tkinter import ttk, messagebox, filedialog
 import database
+import audit
+import background
+import change_feed
+import sortable
+import statements
+
+PAGE_SIZE = 200
+
+# Sortable columns -> database.INVOICE_SORTS keys
+HEADINGS = {"ID": "id", "Patient": "patient", "Amount (£)": "amount",
+            "Status": "status", "Date": "date"}
+
+# The same orders over a row's tree values, for placing live updates.
+# Past the shown columns the values carry the full created_at (v[6]) and
+# patient_id (v[7]), so these match the database's keyset order exactly
+TREE_ORDER = {
+    "id":      lambda v: int(v[0]),
+    "patient": lambda v: (str(v[1]), int(v[7]), int(v[0])),
+    "amount":  lambda v: (float(str(v[2]).lstrip("£")), int(v[0])),
+    "status":  lambda v: (str(v[4]), str(v[6]), int(v[0])),
+    "date":    lambda v: (str(v[6]), int(v[0])),
+}
 
 
 class BillingScreen:
@@ -14,8 +37,11 @@ class BillingScreen:
         self.parent    = parent
         self.user_id   = user_id
         self.user_role = user_role
+        self.versions  = {}         # invoice_id -> row version shown in the list
+        self.pager     = sortable.KeysetPager(PAGE_SIZE)
         self.create_widgets()
         self.refresh()
+        change_feed.subscribe("invoices", self.on_invoices_changed, owner=self.tree)
 
     def create_widgets(self):
         # Title bar
@@ -35,13 +61,23 @@ class BillingScreen:
         for label in ["All", "Paid", "Unpaid"]:
             tk.Radiobutton(ff, text=label, variable=self.filter_var,
                            value=label, bg="#f0f0f0",
-                           command=self.refresh).pack(side=tk.LEFT, padx=5)
+                           command=self.first_page).pack(side=tk.LEFT, padx=5)
+        tk.Button(ff, text="Next ▶", command=lambda: self.change_page(1),
+                  width=8, relief=tk.FLAT).pack(side=tk.RIGHT, padx=5)
+        self.page_label = tk.Label(ff, text="", bg="#f0f0f0")
+        self.page_label.pack(side=tk.RIGHT, padx=5)
+        tk.Button(ff, text="◀ Prev", command=lambda: self.change_page(-1),
+                  width=8, relief=tk.FLAT).pack(side=tk.RIGHT, padx=5)
 
         # Outstanding total
         self.total_label = tk.Label(self.parent,
                                     text="", font=("Arial", 11, "bold"),
                                     fg="#e74c3c", bg="#f0f0f0")
         self.total_label.pack(anchor="e", padx=15)
+        # Aged debt: what is owed, by age of the invoice
+        self.aged_label = tk.Label(self.parent, text="", font=("Arial", 9),
+                                   fg="#555", bg="#f0f0f0")
+        self.aged_label.pack(anchor="e", padx=15)
 
         # Table
         tf = tk.Frame(self.parent)
@@ -56,6 +92,10 @@ class BillingScreen:
             self.tree.heading(col, text=col)
             self.tree.column(col, width=w)
         self.tree.pack(fill=tk.BOTH, expand=True)
+        # Newest first until a column is chosen
+        self.sorting = sortable.SortableHeadings(self.tree, HEADINGS, database.INVOICE_SORTS,
+                                                 "billing", self.user_id, self.first_page,
+                                                 descending=True)
 
         # Buttons
         bf = tk.Frame(self.parent, bg="#f0f0f0")
@@ -66,19 +106,63 @@ class BillingScreen:
                   bg="#f39c12", fg="white", width=14, relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
         tk.Button(bf, text="Delete Invoice", command=self.delete_invoice,
                   bg="#e74c3c", fg="white", width=14, relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+        self.export_btn = tk.Button(bf, text="Export Documents", command=self.export_documents,
+                                    bg="#8e44ad", fg="white", width=16, relief=tk.FLAT)
+        self.export_btn.pack(side=tk.RIGHT, padx=5)
+        self.statements_btn = tk.Button(bf, text="Statements", command=self.export_statements,
+                                        bg="#2E75B6", fg="white", width=12, relief=tk.FLAT)
+        self.statements_btn.pack(side=tk.RIGHT, padx=5)
+
+    def first_page(self):
+        self.pager.reset()
+        self.refresh()
+
+    def change_page(self, step):
+        if self.pager.turn(step, self.sorting.cursor):
+            self.refresh()
 
     def refresh(self):
         for row in self.tree.get_children():
             self.tree.delete(row)
-        f = self.filter_var.get() if hasattr(self, "filter_var") else "All"
+        f = self.filter_var.get()
         status = "" if f == "All" else f
-        for inv in database.get_all_invoices(status):
-            # inv: invoice_id, patient_name, amount, description, status, created_at
-            self.tree.insert("", tk.END, values=(
-                inv[0], inv[1], f"£{inv[2]:.2f}", inv[3], inv[4], inv[5][:10]
-            ))
+        self.versions = {}
+        for inv in self.pager.take(database.iter_invoices(
+                status, self.sorting.key, self.sorting.descending,
+                self.pager.after, self.pager.limit)):
+            self.versions[inv.invoice_id] = inv.version
+            self.tree.insert("", tk.END, iid=str(inv.invoice_id), values=self.format_row(inv))
+        self.page_label.config(text=f"Page {self.pager.number + 1}")
+        self.update_total()
+
+    def format_row(self, inv):
+        return (inv.invoice_id, inv.patient_name, f"£{inv.amount:.2f}",
+                inv.description, inv.status, inv.created_at[:10],
+                inv.created_at, inv.patient_id)
+
+    def update_total(self):
         outstanding = database.get_total_outstanding()
         self.total_label.config(text=f"Total Outstanding: £{outstanding:.2f}")
+        aged = statements.aged_debt()
+        buckets = "   ".join(f"{name}: £{value:.2f}" for name, value
+                               in zip(statements.BUCKET_NAMES, aged[:4]))
+        self.aged_label.config(text=f"{buckets}   ({aged.debtors} patients owing)")
+
+    def on_invoices_changed(self, changes):
+        """Updates only the invoices changed at other workstations."""
+        if changes is None:
+            self.refresh()
+            return
+        f = self.filter_var.get()
+        invoices = database.get_invoices_by_ids(changes)
+        self.versions.update((inv.invoice_id, inv.version) for inv in invoices)
+        rows = [self.format_row(inv) for inv in invoices if f == "All" or inv.status == f]
+        change_feed.apply_to_tree(self.tree, changes, rows,
+                                  sort_key=TREE_ORDER[self.sorting.key],
+                                  reverse=self.sorting.descending,
+                                  first_page=self.pager.number == 0,
+                                  last_page=not self.pager.has_next)
+        self.update_total()
 
     def get_selected_id(self):
         sel = self.tree.selection()
@@ -88,13 +172,30 @@ class BillingScreen:
         return self.tree.item(sel[0])["values"][0]
 
     def mark_paid(self):
-        inv_id = self.get_selected_id()
-        if inv_id and database.update_invoice_status(inv_id, "Paid"):
-            self.refresh()
+        self.set_status("Paid")
 
     def mark_unpaid(self):
+        self.set_status("Unpaid")
+
+    def set_status(self, status):
+        """Changes the selected invoice's status unless another desk changed it first."""
         inv_id = self.get_selected_id()
-        if inv_id and database.update_invoice_status(inv_id, "Unpaid"):
+        if not inv_id:
+            return
+        try:
+            updated = database.update_invoice_status(inv_id, status,
+                                                     expected_version=self.versions.get(inv_id))
+        except database.ConcurrentUpdateError as e:
+            state = "deleted" if e.current is None else f"now {e.current.status}"
+            messagebox.showwarning(
+                "Changed at another desk",
+                f"Invoice {inv_id} was changed at another desk ({state}).\n"
+                "The list has been reloaded; check it and try again if needed."
+            )
+            self.refresh()
+            return
+        if updated:
+            audit.record(audit.UPDATE, "invoice", inv_id, status)
             self.refresh()
 
     def delete_invoice(self):
@@ -103,9 +204,50 @@ class BillingScreen:
             return
         if messagebox.askyesno("Confirm", "Delete this invoice?"):
             if database.delete_invoice(inv_id):
+                audit.record(audit.DELETE, "invoice", inv_id)
                 messagebox.showinfo("Deleted", "Invoice removed.")
                 self.refresh()
 
+    def export_documents(self):
+        """Renders HTML/PDF documents for the listed invoices on a background thread."""
+        out_dir = filedialog.askdirectory(title="Save invoice documents to")
+        if not out_dir:
+            return
+        import invoice_documents
+        f = self.filter_var.get()
+        self.export_btn.config(state=tk.DISABLED, text="Exporting...")
+        audit.record(audit.EXPORT, "invoice", None, f"{f} invoices to {out_dir}")
+
+        def done(totals):
+            self.export_btn.config(state=tk.NORMAL, text="Export Documents")
+            messagebox.showinfo(
+                "Invoice Documents",
+                f"Rendered {totals['rendered']} invoices, "
+                f"skipped {totals['skipped']} already exported.")
+
+        background.run_for_screen(self.parent, invoice_documents.render_batch, out_dir,
+                                  status_filter="" if f == "All" else f,
+                                  on_done=done, name="invoice-documents")
+
+    def export_statements(self):
+        """Renders this month's statement for every patient owing or charged, in the background."""
+        out_dir = filedialog.askdirectory(title="Save statements to")
+        if not out_dir:
+            return
+        period_start = date.today().replace(day=1).isoformat()
+        self.statements_btn.config(state=tk.DISABLED, text="Rendering...")
+        audit.record(audit.EXPORT, "statement", None, f"from {period_start} to {out_dir}")
+
+        def done(totals):
+            self.statements_btn.config(state=tk.NORMAL, text="Statements")
+            messagebox.showinfo(
+                "Statements",
+                f"Rendered {totals['rendered']} statements, "
+                f"skipped {totals['skipped']} already rendered.")
+
+        background.run_for_screen(self.parent, statements.render_statements, out_dir,
+                                  period_start, on_done=done, name="statements")
+
     def open_add_invoice(self):
         win = tk.Toplevel()
         win.grab_set()
@@ -134,7 +276,7 @@ class AddInvoice:
         # Patient
         tk.Label(form, text="Patient:", anchor="w").grid(row=0, column=0, sticky="w", pady=6)
         self.patient_var = tk.StringVar()
-        patient_names = [f"{p[0]} - {p[1]}" for p in self.patients]
+        patient_names = [f"{p.patient_id} - {p.name}" for p in self.patients]
         ttk.Combobox(form, textvariable=self.patient_var, values=patient_names,
                      width=26, state="readonly").grid(row=0, column=1, pady=6, padx=(10, 0))
         if patient_names:
@@ -180,6 +322,7 @@ class AddInvoice:
         patient_id = int(patient_str.split(" - ")[0])
         result = database.create_invoice(patient_id, None, amount, description, self.user_id)
         if result:
+            audit.record(audit.CREATE, "invoice", result, f"patient {patient_id}")
             messagebox.showinfo("Success", f"Invoice #{result} created.")
             if self.on_close:
                 self.on_close()
@@ -0,0 +1,195 @@
+"""
+change_feed.py - Fixit Physio Enhanced System
+Pushes row changes made at other workstations to open screens.
+
+Triggers in database.py append a compact record (table, row id, op) to
+change_log for every insert, update and delete. The watcher keeps one
+long-lived connection and polls PRAGMA data_version, which only moves
+when another connection commits, so an idle poll costs a single pragma.
+When it moves, only change_log rows newer than the last seq seen are
+read and handed to the subscribers of each table.
+"""
+
+import sqlite3
+import database
+
+POLL_INTERVAL_MS = 1000
+
+
+class ChangeWatcher:
+
+    def __init__(self):
+        self.conn         = None
+        self.last_version = None
+        self.last_seq     = 0
+        self.subscribers  = {}      # table -> [callback]
+        self.after_id     = None
+        self.widget       = None
+
+    # ── Subscriptions ──
+
+    def subscribe(self, table, callback):
+        """
+        Registers callback(changes) for a table. changes is a dict
+        {row_id: op} with op 'I', 'U' or 'D' (latest op per row), or
+        None when the watcher fell too far behind and the screen should
+        reload everything.
+        """
+        self.subscribers.setdefault(table, []).append(callback)
+
+    def unsubscribe(self, table, callback):
+        callbacks = self.subscribers.get(table, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    # ── Polling ──
+
+    def open(self):
+        if self.conn is None:
+            self.conn = database.connect(database.current_db_path())
+            self.last_seq = self.conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+            self.last_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self):
+        self.stop()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def poll(self):
+        """
+        Checks for commits from other connections and dispatches any new
+        change records. Returns the number of records dispatched.
+        """
+        self.open()
+        try:
+            version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == self.last_version:
+                return 0
+            self.last_version = version
+
+            oldest = self.conn.execute("SELECT MIN(seq) FROM change_log").fetchone()[0]
+            rows = self.conn.execute(
+                "SELECT seq, table_name, row_id, op FROM change_log WHERE seq > ? ORDER BY seq",
+                (self.last_seq,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            database.log_error("Change feed poll", e)
+            return 0
+
+        # Records we never saw were pruned: tell everyone to reload
+        gap = oldest is not None and self.last_seq and oldest > self.last_seq + 1
+        changes = {}
+        for seq, table, row_id, op in rows:
+            self.last_seq = seq
+            table_changes = changes.setdefault(table, {})
+            # An insert followed by updates is still new to the screen
+            if op == "U" and table_changes.get(row_id) == "I":
+                continue
+            table_changes[row_id] = op
+
+        for table, callbacks in self.subscribers.items():
+            if gap:
+                payload = None
+            elif table in changes:
+                payload = changes[table]
+            else:
+                continue
+            for callback in list(callbacks):
+                callback(payload)
+        return len(rows)
+
+    def start(self, widget, interval_ms=POLL_INTERVAL_MS):
+        """Polls on the Tk event loop of the given widget."""
+        self.widget = widget
+        self.open()
+
+        def tick():
+            self.poll()
+            self.after_id = widget.after(interval_ms, tick)
+
+        self.after_id = widget.after(interval_ms, tick)
+
+    def stop(self):
+        if self.after_id is not None and self.widget is not None:
+            try:
+                self.widget.after_cancel(self.after_id)
+            except Exception:
+                pass
+        self.after_id = None
+
+
+# Process-wide watcher shared by all open screens
+_watcher = ChangeWatcher()
+
+
+def get_watcher():
+    return _watcher
+
+
+def subscribe(table, callback, owner=None):
+    """
+    Subscribes callback to a table's changes. If owner (a Tk widget) is
+    given, the subscription is dropped automatically when it's destroyed.
+    """
+    _watcher.subscribe(table, callback)
+    if owner is not None:
+        owner.bind("<Destroy>", lambda e: _watcher.unsubscribe(table, callback), add="+")
+
+
+def apply_to_tree(tree, changes, rows, sort_key=None, reverse=False,
+                  first_page=True, last_page=True):
+    """
+    Applies a change set to a Treeview whose item ids are the row ids.
+    rows holds the current, filter-matching rows for the changed ids
+    (first value is the id). Deleted or no-longer-matching rows are
+    removed, existing ones updated in place and new ones inserted at
+    the position given by sort_key(values) (descending if reverse), or
+    appended.
+
+    For one page of a keyset-paged list, first_page and last_page say
+    whether pages come before and after it: a row sorting before the
+    page's first row or after its last belongs to another page, so it is
+    left out rather than shown twice.
+    """
+    current = {str(row[0]): row for row in rows}
+    bounds = None
+    if sort_key is not None:
+        children = tree.get_children()
+        bounds = [sort_key(tree.item(children[i])["values"]) for i in (0, -1)] if children else []
+
+    def on_page(key):
+        if bounds is None:
+            return True
+        if not bounds:
+            return first_page and last_page
+        first, last = bounds
+        if reverse:
+            first, last = last, first
+        return (first_page or key >= first) and (last_page or key <= last)
+
+    for row_id in changes:
+        iid = str(row_id)
+        if iid not in current:
+            if tree.exists(iid):
+                tree.delete(iid)
+            continue
+        values = current[iid]
+        if tree.exists(iid):
+            old_values = tree.item(iid)["values"]
+            if sort_key is None or sort_key(old_values) == sort_key(values):
+                tree.item(iid, values=values)
+                continue
+            tree.delete(iid)      # sort position changed: re-insert below
+        if not on_page(sort_key(values) if sort_key is not None else None):
+            continue
+        index = "end"
+        if sort_key is not None:
+            key = sort_key(values)
+            for i, child in enumerate(tree.get_children()):
+                child_key = sort_key(tree.item(child)["values"])
+                if (child_key < key) if reverse else (child_key > key):
+                    index = i
+                    break
+        tree.insert("", index, iid=iid, values=values)
@@ -0,0 +1,515 @@
+"""
+cli.py - Fixit Physio Enhanced System
+Headless command-line interface for batch jobs (cron, admin scripts).
+
+    python cli.py [--db PATH] [--site CODE] [--json] COMMAND ...
+
+Never imports tkinter; each command imports only the modules it needs.
+Results go to stdout (CSV/JSON lines are streamed row by row), while
+diagnostics printed by the database layer are sent to stderr so stdout
+stays machine-readable. Exit status: 0 success, 1 the operation failed,
+2 bad usage.
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import sqlite3
+import sys
+import threading
+from datetime import date, datetime
+import database
+
+EXIT_OK    = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+
+IMPORT_COLUMNS = ("name", "phone", "email", "date_of_birth", "notes")
+
+
+class CommandError(Exception):
+    """Raised by a command to fail with a message and exit status 1."""
+
+
+def iso_date(text):
+    """argparse type for a YYYY-MM-DD date; an empty default stays empty."""
+    if text:
+        try:
+            datetime.strptime(text, "%Y-%m-%d")
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"not a YYYY-MM-DD date: {text!r}")
+    return text
+
+
+# ─────────────────────────────────────────────────────────
+# OUTPUT
+# ─────────────────────────────────────────────────────────
+
+class Output:
+    """Writes results to the real stdout as text, CSV or JSON lines."""
+
+    def __init__(self, stream, as_json):
+        self.stream  = stream
+        self.as_json = as_json
+
+    def result(self, data):
+        """A single result: a dict of counts/values."""
+        if self.as_json:
+            self.stream.write(json.dumps(data) + "\n")
+        else:
+            for key, value in data.items():
+                self.stream.write(f"{key}: {value}\n")
+
+    def rows(self, header, rows, fmt=None):
+        """Streams rows as CSV (default) or JSON lines. Returns the row count."""
+        fmt = fmt or ("json" if self.as_json else "csv")
+        count = 0
+        if fmt == "json":
+            for row in rows:
+                self.stream.write(json.dumps(dict(zip(header, row))) + "\n")
+                count += 1
+        else:
+            writer = csv.writer(self.stream)
+            writer.writerow(header)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        self.stream.flush()
+        return count
+
+
+# ─────────────────────────────────────────────────────────
+# COMMANDS
+# ─────────────────────────────────────────────────────────
+
+def cmd_init(args, out):
+    database.initialize_database()
+    if args.sample:
+        database.add_sample_data()
+    out.result({"database": database.current_db_path(), "sample": args.sample})
+
+
+def _json_entries(stream):
+    """Yields one dict per non-blank JSON line; CommandError names a bad line."""
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError as e:
+            raise CommandError(f"Import failed, nothing imported: line {number}: {e}")
+        if not isinstance(entry, dict):
+            raise CommandError(f"Import failed, nothing imported: line {number}: "
+                               f"expected a JSON object, got {type(entry).__name__}")
+        yield entry
+
+
+def cmd_import(args, out):
+    """Imports patients from CSV (header row) or JSON lines, in one transaction."""
+    stream = sys.stdin if args.file == "-" else open(args.file, newline="", encoding="utf-8")
+    with stream:
+        if args.format == "json":
+            entries = _json_entries(stream)
+        else:
+            entries = csv.DictReader(stream)
+        rows = ([(entry.get(col) or "") for col in IMPORT_COLUMNS] for entry in entries)
+        try:
+            with contextlib.closing(database.get_connection()) as conn:
+                cursor = conn.cursor()
+                cursor.executemany(database.INSERT_PATIENT,
+                                   (database.patient_values(*row) for row in rows))
+                count = cursor.rowcount
+                conn.commit()
+        except (sqlite3.Error, ValueError) as e:
+            raise CommandError(f"Import failed, nothing imported: {e}")
+    out.result({"imported": count})
+
+
+EXPORTS = {
+    "patients": (("patient_id", "name", "phone", "email", "date_of_birth"),
+                 lambda args: database.iter_patients()),
+    "appointments": (("appointment_id", "patient_name", "appointment_date",
+                      "appointment_time", "appointment_type", "status", "notes", "patient_id"),
+                     lambda args: database.iter_appointments(
+                         database.AppointmentFilter().between(args.start, args.end))),
+    "invoices": (("invoice_id", "patient_name", "amount", "description",
+                  "status", "created_at", "version", "patient_id"),
+                 lambda args: database.iter_invoices(args.status)),
+}
+
+
+def cmd_export(args, out):
+    header, rows = EXPORTS[args.table]
+    fmt = args.format or ("json" if out.as_json else "csv")
+    if args.output:
+        with open(args.output, "w", newline="", encoding="utf-8") as f:
+            count = Output(f, out.as_json).rows(header, rows(args), fmt)
+        out.result({"exported": count, "output": args.output})
+    else:
+        Output(out.stream, out.as_json).rows(header, rows(args), fmt)
+
+
+REPORTS = {
+    "revenue-month": (("month", "invoices", "invoiced", "paid", "outstanding"),
+                      "revenue_by_month"),
+    "revenue-type":  (("appointment_type", "invoices", "invoiced", "paid", "outstanding"),
+                      "revenue_by_type"),
+    "revenue-staff": (("created_by", "invoices", "invoiced", "paid", "outstanding"),
+                      "revenue_by_staff"),
+    "utilisation":   (("month", "booked", "capacity", "utilisation", "no_show_rate"),
+                      "utilisation_by_month"),
+}
+
+
+def cmd_report(args, out):
+    import reports
+    header, func = REPORTS[args.name]
+    out.rows(header, getattr(reports, func)())
+
+
+def cmd_backup(args, out):
+    try:
+        database.save_snapshot(args.path)
+    except sqlite3.Error as e:
+        raise CommandError(f"Backup failed: {e}")
+    out.result({"backup": args.path})
+
+
+def cmd_archive(args, out):
+    import archive
+    out.result(archive.archive_before(args.before, args.archive, delete=args.delete))
+
+
+def cmd_maintenance(args, out):
+    import maintenance
+    if args.log:
+        out.rows(("run_id", "task", "started_at", "duration_ms", "size_before",
+                  "size_after", "outcome", "detail"), maintenance.get_maintenance_log())
+        return
+    if args.convert_vacuum:
+        results = maintenance.convert_to_incremental()
+    elif args.when_idle:
+        results = maintenance.run_if_idle(args.idle_minutes, args.min_hours,
+                                          tasks=args.task, budget=args.budget)
+        if results is None:
+            out.result({"skipped": "database busy or maintenance not due"})
+            return
+    else:
+        results = maintenance.run_maintenance(tasks=args.task, budget=args.budget)
+    out.rows(("task", "outcome", "duration_ms", "size_before", "size_after", "detail"), results)
+    if any(outcome == "failed" for _, outcome, *_ in results):
+        raise CommandError("A maintenance task failed")
+
+
+def cmd_reminders(args, out):
+    import reminders
+    out.result(reminders.run_reminders())
+
+
+def cmd_day_sheets(args, out):
+    import day_sheets
+    written = day_sheets.write_day_sheets(args.date, args.output)
+    out.result({"date": args.date, "files": len(written)})
+
+
+def cmd_invoices(args, out):
+    import invoice_documents
+    totals = invoice_documents.render_batch(args.output, status_filter=args.status,
+                                            mail_dir=args.mail_dir, processes=args.processes)
+    out.result(totals)
+
+
+def cmd_statements(args, out):
+    import statements
+    period_start = args.period_start or date.today().replace(day=1).isoformat()
+    totals = statements.render_statements(args.output, period_start, as_of=args.as_of,
+                                          processes=args.processes,
+                                          min_balance=args.min_balance)
+    out.result(totals)
+
+
+def cmd_aged_debt(args, out):
+    import statements
+    if args.totals:
+        out.result(statements.aged_debt(args.as_of)._asdict())
+        return
+    out.rows(("patient_id", "name", "phone", "email", "0_30", "31_60", "61_90", "over_90",
+              "balance"), statements.aged_balances(args.as_of))
+
+
+def cmd_purge(args, out):
+    import purge
+    queued = purge.enqueue_retention_purge(args.years) if args.retention else 0
+    totals = purge.run_purge(max_seconds=args.max_seconds)
+    totals["queued"] = queued
+    out.result(totals)
+
+
+def cmd_audit(args, out):
+    import audit
+    rows = audit.query(entity=args.entity, entity_id=args.id, staff_id=args.staff,
+                       action=args.action, since=args.since, until=args.until,
+                       limit=args.limit)
+    out.rows(("audit_id", "logged_at", "staff_id", "action", "entity", "entity_id", "detail"),
+             rows)
+
+
+def cmd_load_test(args, out):
+    import loadtest
+    db_path = args.db or database.current_db_path()
+    try:
+        loadtest.prepare(db_path, args.patients, args.appointments, fresh=args.fresh)
+    except ValueError as e:
+        raise CommandError(str(e))
+    mix = dict(loadtest.DEFAULT_MIX)
+    for item in args.mix or []:
+        name, _, weight = item.partition("=")
+        if name not in mix or not weight.isdigit():
+            raise CommandError(f"Bad --mix entry {item!r}; use OPERATION=WEIGHT")
+        mix[name] = int(weight)
+    result = loadtest.run_load(db_path, args.processes, args.threads, args.seconds, mix,
+                               args.retries, args.think_ms, args.busy_timeout,
+                               args.journal_mode, args.seed)
+    out.result(result["summary"])
+    out.rows(("operation", "calls", "ok", "busy", "failed", "retries",
+              "p50_ms", "p95_ms", "p99_ms", "max_ms"), result["operations"])
+
+
+def cmd_schedule(args, out):
+    """Places treatment plans (CSV or JSON lines) and books them in one transaction."""
+    import auto_scheduler
+    import records
+    stream = sys.stdin if args.file == "-" else open(args.file, newline="", encoding="utf-8")
+    with stream:
+        try:
+            plans = auto_scheduler.read_plans(stream, args.format)
+        except (ValueError, KeyError) as e:
+            raise CommandError(f"Bad plan: {e}")
+    try:
+        placed, unplaced = auto_scheduler.schedule(plans, args.staff, dry_run=args.dry_run)
+    except RuntimeError as e:
+        raise CommandError(str(e))
+    if args.placements:
+        with open(args.placements, "w", newline="", encoding="utf-8") as f:
+            Output(f, out.as_json).rows(records.PlannedSession._fields, placed)
+    out.result({"plans": len(plans), "sessions": sum(p.sessions for p in plans),
+                "placed" if args.dry_run else "booked": len(placed),
+                "unplaced": len(unplaced)})
+    out.rows(records.UnplacedSession._fields, unplaced)
+
+
+def cmd_dedupe(args, out):
+    import dedupe
+    if args.merge:
+        survivor, duplicate = args.merge
+        moved = dedupe.merge_patients(survivor, duplicate, merged_by=args.staff)
+        if moved is None:
+            raise CommandError(f"Could not merge patient {duplicate} into {survivor}")
+        out.result({"survivor": survivor, "merged": duplicate, **moved})
+        return
+    pairs, stats = dedupe.find_duplicates(args.min_score)
+    out.result(stats)
+    out.rows(("patient_id", "other_id", "score", "reasons"), pairs)
+
+
+def cmd_plan_check(args, out):
+    """Builds its own in-memory database; --db and --site are ignored."""
+    import querycheck
+    failures, report, count = querycheck.run_check(update=args.update,
+                                                   baseline_path=args.baseline,
+                                                   appointments=args.appointments,
+                                                   patients=args.patients)
+    for line in report:
+        out.stream.write(line + "\n")
+    out.result({"statements": count, "failures": failures})
+    if failures:
+        raise CommandError(f"{failures} query plan(s) regressed")
+
+
+# ─────────────────────────────────────────────────────────
+# ARGUMENTS
+# ─────────────────────────────────────────────────────────
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Fixit Physio batch operations")
+    parser.add_argument("--db", help="database file, or :memory: (default: FIXIT_DB_PATH)")
+    parser.add_argument("--site", help="company code of the site to work on")
+    parser.add_argument("--json", action="store_true", help="machine-readable JSON output")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("init", help="create tables and indexes")
+    p.add_argument("--sample", action="store_true", help="also add sample data")
+    p.set_defaults(func=cmd_init)
+
+    p = sub.add_parser("import", help="import patients")
+    p.add_argument("file", help="CSV/JSON-lines file, or - for stdin")
+    p.add_argument("--format", choices=("csv", "json"), default="csv")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("export", help="stream a table as CSV or JSON lines")
+    p.add_argument("table", choices=sorted(EXPORTS))
+    p.add_argument("--format", choices=("csv", "json"))
+    p.add_argument("--output", help="file to write instead of stdout")
+    p.add_argument("--start", default="", type=iso_date, help="appointments from YYYY-MM-DD")
+    p.add_argument("--end", default="", type=iso_date, help="appointments to YYYY-MM-DD")
+    p.add_argument("--status", default="", help="invoice status (Paid/Unpaid)")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("report", help="print a report")
+    p.add_argument("name", choices=sorted(REPORTS))
+    p.set_defaults(func=cmd_report)
+
+    p = sub.add_parser("backup", help="online backup to a database file")
+    p.add_argument("path")
+    p.set_defaults(func=cmd_backup)
+
+    p = sub.add_parser("archive", help="move finished appointments to an archive database")
+    p.add_argument("--before", required=True, type=iso_date, help="YYYY-MM-DD cutoff")
+    p.add_argument("--archive", default="fixit_archive.db", help="archive database file")
+    p.add_argument("--delete", action="store_true", help="remove archived rows from the live db")
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser("maintenance", help="optimize, vacuum, checkpoint and check the database")
+    p.add_argument("--task", action="append",
+                   choices=("optimize", "incremental_vacuum", "wal_checkpoint", "quick_check"),
+                   help="run only this task (repeatable)")
+    p.add_argument("--budget", type=float, default=10.0, help="seconds allowed per task")
+    p.add_argument("--when-idle", action="store_true",
+                   help="only run if no desk has written recently and a run is due")
+    p.add_argument("--idle-minutes", type=float, default=10)
+    p.add_argument("--min-hours", type=float, default=20)
+    p.add_argument("--log", action="store_true", help="show recent maintenance runs")
+    p.add_argument("--convert-vacuum", action="store_true",
+                   help="one-off full VACUUM to switch an older database to incremental "
+                        "auto_vacuum (run while nobody is working)")
+    p.set_defaults(func=cmd_maintenance)
+
+    p = sub.add_parser("reminders", help="queue and send appointment reminders")
+    p.set_defaults(func=cmd_reminders)
+
+    p = sub.add_parser("day-sheets", help="write practitioner day sheets")
+    p.add_argument("date", type=iso_date, help="YYYY-MM-DD")
+    p.add_argument("--output", default="day_sheets")
+    p.set_defaults(func=cmd_day_sheets)
+
+    p = sub.add_parser("invoices", help="render invoice documents")
+    p.add_argument("--output", default="invoices")
+    p.add_argument("--status", default="")
+    p.add_argument("--mail-dir", help="also write .eml copies here")
+    p.add_argument("--processes", type=int)
+    p.set_defaults(func=cmd_invoices)
+
+    p = sub.add_parser("statements", help="render account statements for all patients")
+    p.add_argument("--output", default="statements")
+    p.add_argument("--period-start", type=iso_date, help="YYYY-MM-DD (default: first of this month)")
+    p.add_argument("--as-of", type=iso_date,
+                   help="statement date YYYY-MM-DD (default: today); dates the ageing "
+                        "only, paid/unpaid is always the current status")
+    p.add_argument("--min-balance", type=float, default=0.0)
+    p.add_argument("--processes", type=int)
+    p.set_defaults(func=cmd_statements)
+
+    p = sub.add_parser("aged-debt", help="aged debtors: balances in 30/60/90-day buckets")
+    p.add_argument("--as-of", type=iso_date, help="YYYY-MM-DD (default: today)")
+    p.add_argument("--totals", action="store_true", help="only the clinic-wide totals")
+    p.set_defaults(func=cmd_aged_debt)
+
+    p = sub.add_parser("purge", help="run queued patient erasures")
+    p.add_argument("--retention", action="store_true", help="first queue retention-policy purges")
+    p.add_argument("--years", type=int, default=8)
+    p.add_argument("--max-seconds", type=float)
+    p.set_defaults(func=cmd_purge)
+
+    p = sub.add_parser("audit", help="query the audit log")
+    p.add_argument("--entity", choices=("patient", "appointment", "invoice", "user"))
+    p.add_argument("--id")
+    p.add_argument("--staff")
+    p.add_argument("--action")
+    p.add_argument("--since", default="")
+    p.add_argument("--until", default="")
+    p.add_argument("--limit", type=int, default=1000)
+    p.set_defaults(func=cmd_audit)
+
+    p = sub.add_parser("load-test", help="simulate concurrent desks and measure lock contention")
+    p.add_argument("--processes", type=int, default=2)
+    p.add_argument("--threads", type=int, default=4, help="sessions per process")
+    p.add_argument("--seconds", type=float, default=30)
+    p.add_argument("--retries", type=int, default=3, help="retries of a locked call")
+    p.add_argument("--think-ms", type=float, default=0, help="mean pause between calls")
+    p.add_argument("--busy-timeout", type=float, help="seconds (default: FIXIT_BUSY_TIMEOUT)")
+    p.add_argument("--journal-mode", choices=("delete", "truncate", "persist", "wal"))
+    p.add_argument("--mix", action="append", help="OPERATION=WEIGHT, e.g. book=40 (repeatable)")
+    p.add_argument("--patients", type=int, default=8000)
+    p.add_argument("--appointments", type=int, default=100000)
+    p.add_argument("--fresh", action="store_true", help="regenerate the database first")
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=cmd_load_test)
+
+    p = sub.add_parser("schedule", help="book a batch of treatment plans into free slots")
+    p.add_argument("file", help="plans file, or - for stdin")
+    p.add_argument("--format", choices=("csv", "json"), default="csv")
+    p.add_argument("--staff", help="staff_id recorded as the bookings' creator")
+    p.add_argument("--placements", help="also write the placed sessions to this file")
+    p.add_argument("--dry-run", action="store_true", help="solve and report without booking")
+    p.set_defaults(func=cmd_schedule)
+
+    p = sub.add_parser("dedupe", help="find likely duplicate patients, or merge two")
+    p.add_argument("--min-score", type=float, default=0.75)
+    p.add_argument("--merge", nargs=2, type=int, metavar=("SURVIVOR", "DUPLICATE"),
+                   help="move DUPLICATE's records to SURVIVOR and delete DUPLICATE")
+    p.add_argument("--staff", help="staff_id recorded in the audit log")
+    p.set_defaults(func=cmd_dedupe)
+
+    p = sub.add_parser("plan-check", help="check query plans against query_plans.json")
+    p.add_argument("--update", action="store_true", help="rewrite the baseline from this tree")
+    p.add_argument("--baseline", default=None, help="baseline file (default: query_plans.json)")
+    p.add_argument("--appointments", type=int, default=100000)
+    p.add_argument("--patients", type=int, default=8000)
+    p.set_defaults(func=cmd_plan_check)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    out = Output(sys.stdout, args.json)
+    try:
+        if args.db:
+            database.configure(args.db)
+        if args.site:
+            database.set_active_tenant(args.site)
+    except KeyError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    database.clear_last_error()
+    database.clear_thread_errors()
+    try:
+        # Library diagnostics go to stderr; results are written to out
+        with contextlib.redirect_stdout(sys.stderr):
+            args.func(args, out)
+    except BrokenPipeError:
+        return EXIT_OK      # e.g. piped into head
+    except (CommandError, OSError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_ERROR
+    finally:
+        # Audit events are written by a background thread: flush them now so
+        # a failed write is seen below rather than at interpreter exit
+        if "audit" in sys.modules:
+            with contextlib.redirect_stdout(sys.stderr):
+                sys.modules["audit"].shutdown()
+    # Database functions report a failure and return an empty result, so
+    # a command can "succeed" on nothing; the recorded errors say it didn't.
+    # last_error() is per thread, so worker threads' errors are checked too
+    errors = database.thread_errors()
+    if errors:
+        for thread, error in errors.items():
+            print(f"error: {error}" if thread == threading.current_thread().name
+                  else f"error ({thread}): {error}", file=sys.stderr)
+        return EXIT_ERROR
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
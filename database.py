@@ -2,13 +2,83 @@
 database.py - Fixit Physio Enhanced System
 Handles all database operations for the full system.
 Tables: users, patients, appointments, invoices
+Reporting: rollup_daily_revenue, rollup_daily_appointments, rollup_dirty_days
+Change feed: change_log
+Messaging: reminders
+Erasure: purge_queue
+Scheduling: waitlist
+Governance: audit_log
+Upkeep: maintenance_log
+Rows come back as the namedtuple records in records.py; iter_* getters stream them.
 """
 
 import sqlite3
 import hashlib
+import json
 import os
-
-DB_NAME = "fixit_physio.db"
+import re
+import itertools
+import threading
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta, timezone
+import records
+
+# Default database location. FIXIT_DB_PATH overrides it; the value
+# ":memory:" selects a shared in-memory database (see configure()), which
+# FIXIT_DB_SNAPSHOT can preload from a database file.
+DB_NAME = os.environ.get("FIXIT_DB_PATH", "fixit_physio.db")
+MEMORY  = ":memory:"
+
+# Multi-site routing: each company code maps to its own database file.
+# The mapping is read from tenants.json (or the file named by the
+# FIXIT_TENANTS environment variable); without one, a single site
+# "12345" uses DB_NAME.
+TENANTS_FILE   = os.environ.get("FIXIT_TENANTS", "tenants.json")
+DEFAULT_TENANT = "12345"
+
+# Tables whose row changes are written to change_log, with their key column
+CHANGE_FEED_TABLES = {
+    "patients":     "patient_id",
+    "appointments": "appointment_id",
+    "invoices":     "invoice_id",
+    "users":        "id",
+}
+CHANGE_LOG_KEEP  = 5000     # newest change records kept after pruning
+CHANGE_LOG_PRUNE = 500      # prune every this many inserts
+
+# Shared booking vocabulary (used by the screens and the reporting modules)
+APPOINTMENT_TYPES    = ["Assessment", "Treatment", "Follow-up", "Review", "Discharge"]
+APPOINTMENT_STATUSES = ["Scheduled", "Completed", "Cancelled", "No Show"]
+ACTIVE_STATUSES      = ("Scheduled", "Completed", "No Show")    # hold their slot
+HOURS   = [f"{h:02d}" for h in range(8, 19)]
+MINUTES = ["00", "15", "30", "45"]
+SLOTS_PER_DAY = len(HOURS) * len(MINUTES)
+SLOT_MINUTES  = 60 // len(MINUTES)
+
+# Shortest digit string normalize_phone() treats as a phone number
+PHONE_MIN_DIGITS = 7
+_NON_DIGITS = re.compile(r"\D")
+SUFFIX_MIN_DIGITS = 4       # fewest trailing digits lookup_phone() searches by
+
+# Every patient insert goes through this, so the contact keys are always set
+INSERT_PATIENT = '''INSERT INTO patients
+    (name, phone, email, date_of_birth, notes, phone_norm, phone_rev, email_norm)
+    VALUES (?,?,?,?,?,?,?,?)'''
+
+# Appointment start times are also kept as integer "epoch minutes": minutes
+# since 1970-01-01 00:00 of clinic wall-clock time (no timezone shift).
+DEFAULT_DURATION = 30
+MAX_DURATION     = 240
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Rows fetched per round trip by the iter_* getters
+ITER_BATCH = 200
+
+# Connection tuning: seconds a connection waits on a locked database before
+# failing with "database is locked", and an optional journal mode (e.g.
+# "wal") applied to every connection. Used to compare settings under load.
+BUSY_TIMEOUT = float(os.environ.get("FIXIT_BUSY_TIMEOUT", "5.0"))
+JOURNAL_MODE = os.environ.get("FIXIT_JOURNAL_MODE", "")
 
 
 # ─────────────────────────────────────────────────────────
@@ -23,91 +93,891 @@ def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
 
+def to_epoch_minutes(appt_date, appt_time="00:00"):
+    """Converts 'YYYY-MM-DD' and 'HH:MM' strings to epoch minutes."""
+    dt = datetime.strptime(f"{appt_date} {appt_time}", "%Y-%m-%d %H:%M")
+    return int((dt.replace(tzinfo=timezone.utc) - EPOCH).total_seconds()) // 60
+
+
+def from_epoch_minutes(minutes):
+    """Converts epoch minutes back to ('YYYY-MM-DD', 'HH:MM') strings."""
+    dt = EPOCH + timedelta(minutes=minutes)
+    return dt.strftime("%Y-%m-%d"), dt.strftime("%H:%M")
+
+
+def check_duration(duration_minutes):
+    """
+    Raises ValueError unless 0 < duration_minutes <= MAX_DURATION. The
+    overlap queries only look back MAX_DURATION minutes for appointments
+    still running, so a longer one would hide the time it occupies.
+    """
+    if not 0 < duration_minutes <= MAX_DURATION:
+        raise ValueError(f"duration_minutes must be 1-{MAX_DURATION}")
+
+
+def now_epoch_minutes():
+    """Current clinic wall-clock time in epoch minutes."""
+    now = datetime.now()
+    return to_epoch_minutes(now.strftime("%Y-%m-%d"), now.strftime("%H:%M"))
+
+
+def normalize_phone(phone):
+    """
+    Digits of a phone number in national form ("+44 7700 900123" and
+    "07700-900123" both give "07700900123"). Returns "" for anything
+    too short to identify a caller.
+    """
+    digits = _NON_DIGITS.sub("", phone or "")
+    if digits.startswith("0044"):
+        digits = "0" + digits[4:]
+    elif digits.startswith("44") and len(digits) > 10:
+        digits = "0" + digits[2:]
+    return digits if len(digits) >= PHONE_MIN_DIGITS else ""
+
+
+def normalize_email(email):
+    """Lower-cased address with any "+tag" dropped from the local part."""
+    email = (email or "").strip().lower()
+    local, at, domain = email.partition("@")
+    if not at or not local or not domain:
+        return ""
+    return local.split("+", 1)[0] + "@" + domain
+
+
+def contact_keys(phone, email):
+    """
+    (phone_norm, phone_rev, email_norm) stored alongside a patient's phone
+    and email. phone_rev is phone_norm reversed, so "number ends with"
+    becomes an indexed prefix range. "" means nothing usable.
+    """
+    phone_norm = normalize_phone(phone)
+    return phone_norm, phone_norm[::-1], normalize_email(email)
+
+
+def patient_values(name, phone, email, dob, notes):
+    """Parameters for INSERT_PATIENT, contact keys included."""
+    return (name, phone, email, dob, notes) + contact_keys(phone, email)
+
+
+# ─────────────────────────────────────────────────────────
+# STORAGE
+# ─────────────────────────────────────────────────────────
+
+_memory_anchor = None           # keeps the shared in-memory database alive
+_memory_ids = itertools.count(1)
+
+
+def connect(path, timeout=None):
+    """Opens a path or a "file:" URI (used for in-memory databases)."""
+    if timeout is None:
+        timeout = BUSY_TIMEOUT
+    return sqlite3.connect(path, timeout=timeout, uri=path.startswith("file:"))
+
+
+def configure(db_path=None, snapshot=None):
+    """
+    Sets where the default site's database lives and returns the path
+    or URI now in use.
+
+    db_path=":memory:" creates a fresh in-memory database shared by every
+    connection in this process (shared cache), so tests and benchmarks
+    never touch the disk or each other's files. If snapshot names a
+    database file, its contents are copied into the in-memory database
+    first. Shared-cache connections lock whole tables, so concurrent
+    writers fail fast with "database table is locked" instead of waiting.
+    """
+    global DB_NAME, _tenants, _memory_anchor
+    previous_anchor = _memory_anchor
+    _memory_anchor = None
+    if db_path == MEMORY:
+        DB_NAME = f"file:fixit_{os.getpid()}_{next(_memory_ids)}?mode=memory&cache=shared"
+        _memory_anchor = connect(DB_NAME)
+        if snapshot:
+            source = sqlite3.connect(snapshot)
+            source.backup(_memory_anchor)
+            source.close()
+    elif snapshot:
+        raise ValueError("A snapshot can only be preloaded into the in-memory database")
+    elif db_path:
+        DB_NAME = db_path
+    if previous_anchor is not None:
+        previous_anchor.close()
+    _tenants = None
+    return DB_NAME
+
+
+def save_snapshot(path):
+    """Copies the current database (file or in-memory) to a database file."""
+    source = get_connection()
+    target = sqlite3.connect(path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+if DB_NAME == MEMORY:
+    configure(MEMORY, os.environ.get("FIXIT_DB_SNAPSHOT"))
+
+
+# ─────────────────────────────────────────────────────────
+# TENANT ROUTING
+# ─────────────────────────────────────────────────────────
+
+_tenants = None                 # cached {company_code: path}
+_active_tenant = None           # company code chosen at login (process-wide)
+_route = threading.local()      # per-thread override used by fan-out queries
+
+
+def load_tenants(reload=False):
+    """Returns {company_code: database_path} for every configured site."""
+    global _tenants
+    if _tenants is None or reload:
+        _tenants = {DEFAULT_TENANT: DB_NAME}
+        if os.path.exists(TENANTS_FILE):
+            try:
+                with open(TENANTS_FILE) as f:
+                    _tenants = {str(code): path for code, path in json.load(f).items()}
+            except (OSError, ValueError) as e:
+                log_error("Tenant config", e)
+    return dict(_tenants)
+
+
+def tenant_db_path(company_code):
+    """Returns the database file for a company code, or None if unknown."""
+    return load_tenants().get(company_code)
+
+
+def set_active_tenant(company_code):
+    """Routes this process's connections to the given site's database."""
+    global _active_tenant
+    if tenant_db_path(company_code) is None:
+        raise KeyError(f"Unknown company code: {company_code}")
+    _active_tenant = company_code
+
+
+def get_active_tenant():
+    return _active_tenant or DEFAULT_TENANT
+
+
+@contextmanager
+def use_tenant(company_code):
+    """
+    Routes connections opened by the current thread to another site's
+    database for the duration of the block.
+    """
+    path = tenant_db_path(company_code)
+    if path is None:
+        raise KeyError(f"Unknown company code: {company_code}")
+    previous = getattr(_route, "db_path", None)
+    _route.db_path = path
+    try:
+        yield
+    finally:
+        _route.db_path = previous
+
+
+def current_db_path():
+    """Database file that get_connection() will open for this thread."""
+    routed = getattr(_route, "db_path", None)
+    if routed:
+        return routed
+    if _active_tenant:
+        return tenant_db_path(_active_tenant) or DB_NAME
+    return DB_NAME
+
+
+_trace_callback = None          # set by tools that record the SQL issued
+_errors = threading.local()     # last error and busy count per thread
+_thread_errors = {}             # thread name -> last error, seen from any thread
+
+
+def set_trace_callback(callback):
+    """
+    Passes every SQL statement run on connections from get_connection()
+    to callback(sql), or stops tracing if callback is None.
+    """
+    global _trace_callback
+    _trace_callback = callback
+
+
+class ConcurrentUpdateError(Exception):
+    """
+    Raised when an edit was based on a row version that another desk has
+    since changed. current is the row as it is now (the same record type
+    its getter returns), or None if the row was deleted.
+    """
+
+    def __init__(self, entity, entity_id, current):
+        state = "deleted" if current is None else f"now at version {current.version}"
+        super().__init__(f"{entity} {entity_id} was changed by someone else ({state})")
+        self.entity    = entity
+        self.entity_id = entity_id
+        self.current   = current
+
+
+def merge_changes(base, mine, theirs):
+    """
+    Three-way merge of field dicts for an edit that hit a conflict.
+    base is what the form loaded, mine what the user entered, theirs the
+    row as saved by the other desk. Returns (merged, conflicts): fields
+    only one side changed take that side's value; conflicts lists fields
+    both sides changed to different values (merged keeps mine for those).
+    """
+    merged, conflicts = {}, []
+    for field, value in mine.items():
+        if value == base[field] or value == theirs[field]:
+            merged[field] = theirs[field]
+        elif theirs[field] == base[field]:
+            merged[field] = value
+        else:
+            merged[field] = value
+            conflicts.append(field)
+    return merged, conflicts
+
+
+def log_error(label, error):
+    """
+    Reports an error caught by a database function (here or in the modules
+    built on this one) and remembers it for the calling thread, counting
+    "database is locked" (SQLITE_BUSY) and "table is locked" failures
+    separately.
+    """
+    print(f"{label} error: {error}")
+    # A copy without the traceback: the original's frames would keep the
+    # failing call's connection, and any lock its transaction holds, alive
+    _errors.last = type(error)(*error.args)
+    _thread_errors[threading.current_thread().name] = _errors.last
+    if is_busy_error(error):
+        _errors.busy = getattr(_errors, "busy", 0) + 1
+
+
+def is_busy_error(error):
+    return isinstance(error, sqlite3.OperationalError) and "locked" in str(error)
+
+
+def last_error():
+    """The last error a database function swallowed on this thread, or None."""
+    return getattr(_errors, "last", None)
+
+
+def clear_last_error():
+    _errors.last = None
+
+
+def thread_errors():
+    """
+    {thread name: last error} for every thread that swallowed one since
+    clear_thread_errors(), so a caller can see its workers' failures.
+    """
+    return dict(_thread_errors)
+
+
+def clear_thread_errors():
+    _thread_errors.clear()
+
+
+def busy_error_count():
+    """How many lock-contention errors this thread's calls have hit."""
+    return getattr(_errors, "busy", 0)
+
+
 def get_connection():
     """
-    Returns a database connection with foreign keys enabled.
+    Returns a database connection with foreign keys enabled,
+    routed to the current tenant's database.
     """
-    conn = sqlite3.connect(DB_NAME)
+    conn = connect(current_db_path())
     conn.execute("PRAGMA foreign_keys = ON")
+    if JOURNAL_MODE:
+        conn.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+    if _trace_callback is not None:
+        conn.set_trace_callback(_trace_callback)
     return conn
 
 
+def _iterate(query, params, record, label):
+    """
+    Yields query rows as records, fetched ITER_BATCH at a time, so large
+    results are never held in memory at once. The connection stays open
+    until the generator is exhausted or closed.
+    """
+    try:
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = records.factory(record)
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(ITER_BATCH)
+                if not rows:
+                    break
+                yield from rows
+    except sqlite3.Error as e:
+        log_error(label, e)
+
+
+_PLAIN_COLUMN = re.compile(r"[\w.]+$")
+
+
+class SortOrder:
+    """
+    The whitelisted sorts of one listing. Each sort key maps to the
+    columns to order by, ending in the row's unique id so the order is
+    total, and to a function giving a row's values in those columns:
+    its keyset cursor. The page after a row is the rows whose columns
+    compare greater than its cursor, which an index on the columns
+    seeks to directly, where an OFFSET reads and discards every earlier
+    row. Sort keys come from the screen, never SQL from the user.
+    """
+
+    def __init__(self, default, **sorts):
+        self.default = default
+        self.sorts   = sorts        # key -> (columns, row -> cursor values)
+
+    def __contains__(self, key):
+        return key in self.sorts
+
+    def _columns(self, key):
+        if key not in self.sorts:
+            raise ValueError(f"Unknown sort key: {key}")
+        return self.sorts[key][0]
+
+    def cursor(self, key, row):
+        """The keyset cursor of a row: its values in the sort's columns."""
+        self._columns(key)
+        return tuple(self.sorts[key][1](row))
+
+    def compile(self, select, clauses=(), params=(), key=None, descending=False,
+                after=None, limit=None):
+        """
+        Completes a listing query: select, the WHERE clauses ANDed together,
+        the keyset condition for rows after the cursor `after`, ORDER BY
+        and LIMIT. Returns (sql, params).
+        """
+        columns = self._columns(key or self.default)
+        clauses, params = list(clauses), list(params)
+        if after is not None:
+            # Row values compare column by column, as ORDER BY does. The
+            # planner won't seek an expression index on a row value, so an
+            # expression's bound is also stated on its own
+            op = "<" if descending else ">"
+            marks = ", ".join("?" * len(columns))
+            if not _PLAIN_COLUMN.match(columns[0]):
+                clauses.append(f"{columns[0]} {op}= ?")
+                params.append(after[0])
+            clauses.append(f"({', '.join(columns)}) {op} ({marks})")
+            params.extend(after)
+        direction = "DESC" if descending else "ASC"
+        sql = select
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY " + ", ".join(f"{column} {direction}" for column in columns)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return sql, params
+
+
 # ─────────────────────────────────────────────────────────
 # SETUP
 # ─────────────────────────────────────────────────────────
 
+def _mark_dirty(kind, day_expr):
+    """
+    Trigger statement recording a dirty rollup day.
+    NOT EXISTS is used rather than INSERT OR IGNORE because a foreign-key
+    action (ON DELETE SET NULL) firing the trigger overrides OR IGNORE.
+    """
+    return f'''
+        INSERT INTO rollup_dirty_days (kind, day)
+        SELECT '{kind}', {day_expr}
+        WHERE {day_expr} IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM rollup_dirty_days
+                          WHERE kind = '{kind}' AND day = {day_expr});
+    '''
+
+
+# The CHECK on appointments.duration_minutes, for databases whose column
+# was added before it existed: the overlap queries rely on no appointment
+# lasting longer than MAX_DURATION
+_BAD_DURATION = (f"WHEN NEW.duration_minutes NOT BETWEEN 1 AND {MAX_DURATION} "
+                 f"BEGIN SELECT RAISE(ABORT, 'duration_minutes must be 1-{MAX_DURATION}'); END")
+DURATION_TRIGGERS = [
+    ("trg_appt_duration_insert", "INSERT ON appointments"),
+    ("trg_appt_duration_update", "UPDATE OF duration_minutes ON appointments"),
+]
+
+ROLLUP_TRIGGERS = [
+    ("trg_rollup_appt_insert", "INSERT ON appointments",
+     _mark_dirty("appointments", "NEW.appointment_date")),
+    ("trg_rollup_appt_update", "UPDATE ON appointments",
+     _mark_dirty("appointments", "OLD.appointment_date")
+     + _mark_dirty("appointments", "NEW.appointment_date")
+     + '''
+        INSERT INTO rollup_dirty_days (kind, day)
+        SELECT DISTINCT 'revenue', date(i.created_at) FROM invoices i
+        WHERE i.appointment_id = NEW.appointment_id
+          AND OLD.appointment_type IS NOT NEW.appointment_type
+          AND date(i.created_at) IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM rollup_dirty_days d
+                          WHERE d.kind = 'revenue' AND d.day = date(i.created_at));
+     '''),
+    ("trg_rollup_appt_delete", "DELETE ON appointments",
+     _mark_dirty("appointments", "OLD.appointment_date")),
+    ("trg_rollup_inv_insert", "INSERT ON invoices",
+     _mark_dirty("revenue", "date(NEW.created_at)")),
+    ("trg_rollup_inv_update", "UPDATE ON invoices",
+     _mark_dirty("revenue", "date(OLD.created_at)")
+     + _mark_dirty("revenue", "date(NEW.created_at)")),
+    ("trg_rollup_inv_delete", "DELETE ON invoices",
+     _mark_dirty("revenue", "date(OLD.created_at)")),
+]
+
+
+def _ensure_column(cursor, table, column, declaration):
+    """
+    Adds a column to an existing table if it isn't there yet.
+    Used for schema migrations on databases created by older versions.
+    Returns True if the column was added.
+    """
+    cursor.execute(f"PRAGMA table_xinfo({table})")
+    if column in [row[1] for row in cursor.fetchall()]:
+        return False
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    return True
+
+
+def _backfill_contact_keys(cursor):
+    """Sets the contact keys of patients that have none yet."""
+    cursor.execute(
+        "SELECT patient_id, phone, email FROM patients WHERE phone_norm IS NULL"
+    )
+    rows = cursor.fetchall()
+    cursor.executemany(
+        "UPDATE patients SET phone_norm = ?, phone_rev = ?, email_norm = ? WHERE patient_id = ?",
+        [contact_keys(phone, email) + (patient_id,) for patient_id, phone, email in rows]
+    )
+
+
 def initialize_database():
     """
     Creates all tables if they don't already exist.
     Called once on startup.
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        # Users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                staff_id TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                role TEXT CHECK(role IN ("Receptionist","Physiotherapist","Admin")) NOT NULL,
-                created_date TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # Patients table (new - normalized)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS patients (
-                patient_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                phone TEXT,
-                email TEXT,
-                date_of_birth TEXT,
-                notes TEXT,
-                created_date TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # Appointments table (uses patient_id instead of patient_name)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS appointments (
-                appointment_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                patient_id INTEGER NOT NULL,
-                appointment_date TEXT NOT NULL,
-                appointment_time TEXT NOT NULL,
-                appointment_type TEXT DEFAULT "General",
-                status TEXT DEFAULT "Scheduled",
-                notes TEXT,
-                created_by TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (patient_id) REFERENCES patients(patient_id) ON DELETE CASCADE,
-                FOREIGN KEY (created_by) REFERENCES users(staff_id) ON DELETE SET NULL
-            )
-        ''')
-
-        # Invoices table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS invoices (
-                invoice_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                patient_id INTEGER NOT NULL,
-                appointment_id INTEGER,
-                amount REAL NOT NULL,
-                description TEXT,
-                status TEXT DEFAULT "Unpaid",
-                created_by TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (patient_id) REFERENCES patients(patient_id) ON DELETE CASCADE,
-                FOREIGN KEY (appointment_id) REFERENCES appointments(appointment_id) ON DELETE SET NULL
-            )
-        ''')
-
-        conn.commit()
-        conn.close()
-        print("Database initialized.")
-
-    except sqlite3.Error as e:
-        print(f"Database initialization error: {e}")
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+
+            # New databases free deleted pages lazily (maintenance.py runs
+            # incremental_vacuum); has no effect once tables exist
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+            # Users table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    staff_id TEXT UNIQUE NOT NULL,
+                    password_hash TEXT NOT NULL,
+                    role TEXT CHECK(role IN ("Receptionist","Physiotherapist","Admin")) NOT NULL,
+                    created_date TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Staff list sorts (USER_SORTS)
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_users_role ON users(role, staff_id)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_date, staff_id)"
+            )
+
+            # Patients table (new - normalized)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS patients (
+                    patient_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    phone TEXT,
+                    email TEXT,
+                    date_of_birth TEXT,
+                    notes TEXT,
+                    created_date TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Appointments table (uses patient_id instead of patient_name)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS appointments (
+                    appointment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    patient_id INTEGER NOT NULL,
+                    appointment_date TEXT NOT NULL,
+                    appointment_time TEXT NOT NULL,
+                    appointment_type TEXT DEFAULT "General",
+                    status TEXT DEFAULT "Scheduled",
+                    notes TEXT,
+                    created_by TEXT,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (patient_id) REFERENCES patients(patient_id) ON DELETE CASCADE,
+                    FOREIGN KEY (created_by) REFERENCES users(staff_id) ON DELETE SET NULL
+                )
+            ''')
+
+            # Invoices table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS invoices (
+                    invoice_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    patient_id INTEGER NOT NULL,
+                    appointment_id INTEGER,
+                    amount REAL NOT NULL,
+                    description TEXT,
+                    status TEXT DEFAULT "Unpaid",
+                    created_by TEXT,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (patient_id) REFERENCES patients(patient_id) ON DELETE CASCADE,
+                    FOREIGN KEY (appointment_id) REFERENCES appointments(appointment_id) ON DELETE SET NULL
+                )
+            ''')
+
+            # Integer start time derived from the date/time strings. A VIRTUAL
+            # generated column can't drift from them and needs no backfill.
+            _ensure_column(cursor, "appointments", "start_min",
+                           "INTEGER GENERATED ALWAYS AS "
+                           "(CAST(strftime('%s', appointment_date || ' ' || appointment_time)"
+                           " AS INTEGER) / 60) VIRTUAL")
+            _ensure_column(cursor, "appointments", "duration_minutes",
+                           f"INTEGER NOT NULL DEFAULT {DEFAULT_DURATION} "
+                           f"CHECK (duration_minutes BETWEEN 1 AND {MAX_DURATION})")
+
+            # Treating physiotherapist (staff_id); NULL means unassigned
+            _ensure_column(cursor, "appointments", "practitioner_id",
+                           "TEXT REFERENCES users(staff_id) ON DELETE SET NULL")
+
+            # Row versions for optimistic concurrency: every edit through this
+            # module bumps the version, and an edit made from a stale copy of
+            # the row (expected_version no longer matches) is refused
+            for table in ("patients", "appointments", "invoices"):
+                _ensure_column(cursor, table, "version", "INTEGER NOT NULL DEFAULT 1")
+
+            # Normalised contact keys for caller lookup (see contact_keys()).
+            # Set by every write here; NULL marks rows written by an older
+            # version or another tool, filled in below
+            for column in ("phone_norm", "phone_rev", "email_norm"):
+                _ensure_column(cursor, "patients", column, "TEXT")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_patients_phone_norm ON patients(phone_norm)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_patients_phone_rev ON patients(phone_rev)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_patients_email_norm ON patients(email_norm)"
+            )
+            _backfill_contact_keys(cursor)
+
+            # Sortable patient list columns (PATIENT_SORTS). Nullable ones are
+            # sorted, and so indexed, with NULL read as ''
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_patients_name ON patients(name)")
+            for column in ("phone", "email", "date_of_birth"):
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_patients_sort_{column} "
+                    f"ON patients(COALESCE({column}, ''))"
+                )
+
+            # Indexes for date-based lookups and reporting refreshes
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_appointments_date ON appointments(appointment_date)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_appointments_start ON appointments(start_min)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_appointments_status_start "
+                "ON appointments(status, start_min)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_appointments_patient_start "
+                "ON appointments(patient_id, start_min)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_appointments_created_by_start "
+                "ON appointments(created_by, start_min)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_appointments_practitioner_start "
+                "ON appointments(practitioner_id, start_min)"
+            )
+            # The appointment list sorted by type (AppointmentFilter.SORTS)
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_appointments_type_start "
+                "ON appointments(appointment_type, start_min)"
+            )
+            # One active appointment per practitioner per start time. Created
+            # separately so that an older database which already holds double
+            # bookings still opens (book_appointment's overlap check still applies)
+            try:
+                cursor.execute(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS uq_appointments_practitioner_slot "
+                    "ON appointments(practitioner_id, start_min) "
+                    "WHERE practitioner_id IS NOT NULL "
+                    "AND status IN ('Scheduled', 'Completed', 'No Show')"
+                )
+            except sqlite3.IntegrityError as e:
+                print(f"Double bookings found, slot uniqueness not enforced: {e}")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_invoices_created_at ON invoices(created_at)"
+            )
+            # Foreign-key lookups: cascades and patient purges search by these.
+            # Its (patient_id, invoice_id) order also serves the invoice list
+            # sorted by patient and statements
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_invoices_patient ON invoices(patient_id)"
+            )
+            # A patient's invoices, newest first (get_invoices_by_patient)
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_invoices_patient_created "
+                "ON invoices(patient_id, created_at)"
+            )
+            # Aged debt: unpaid invoices grouped by patient, read from the index alone
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_invoices_status_patient "
+                "ON invoices(status, patient_id, created_at, amount)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_invoices_appointment ON invoices(appointment_id)"
+            )
+            # The invoice list sorted by amount or status (INVOICE_SORTS)
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_invoices_amount ON invoices(amount)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_invoices_status_created "
+                "ON invoices(status, created_at)"
+            )
+
+            # Reporting rollups (filled in by reports.refresh_rollups)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS rollup_daily_revenue (
+                    day TEXT NOT NULL,
+                    appointment_type TEXT NOT NULL,
+                    created_by TEXT NOT NULL,
+                    invoice_count INTEGER NOT NULL,
+                    invoiced REAL NOT NULL,
+                    paid REAL NOT NULL,
+                    PRIMARY KEY (day, appointment_type, created_by)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS rollup_daily_appointments (
+                    day TEXT NOT NULL,
+                    appointment_type TEXT NOT NULL,
+                    created_by TEXT NOT NULL,
+                    booked INTEGER NOT NULL,
+                    scheduled INTEGER NOT NULL,
+                    completed INTEGER NOT NULL,
+                    cancelled INTEGER NOT NULL,
+                    no_show INTEGER NOT NULL,
+                    booked_slots INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, appointment_type, created_by)
+                ) WITHOUT ROWID
+            ''')
+
+            # Days touched since the last refresh, per rollup ("revenue" / "appointments")
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS rollup_dirty_days (
+                    kind TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    PRIMARY KEY (kind, day)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS report_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            ''')
+            # Quarter-hour slots held by the day's appointments. Rollups built
+            # before the column existed are rebuilt on the next refresh
+            if _ensure_column(cursor, "rollup_daily_appointments", "booked_slots",
+                              "INTEGER NOT NULL DEFAULT 0"):
+                cursor.execute("DELETE FROM report_meta WHERE key = 'rollups_built'")
+
+            # Dirty-day triggers. They are recreated on every start so existing
+            # databases pick up changes to their bodies.
+            for name, event, body in ROLLUP_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+                cursor.execute(f"CREATE TRIGGER {name} AFTER {event} BEGIN {body} END")
+            for name, event in DURATION_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+                cursor.execute(f"CREATE TRIGGER {name} BEFORE {event} {_BAD_DURATION}")
+
+            # Reminder queue: one row per appointment and channel
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS reminders (
+                    reminder_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    appointment_id INTEGER NOT NULL,
+                    channel TEXT CHECK(channel IN ('email','sms')) NOT NULL,
+                    recipient TEXT NOT NULL,
+                    status TEXT CHECK(status IN ('Pending','Sending','Sent','Failed','Skipped'))
+                        NOT NULL DEFAULT 'Pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    queued_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    sent_at TEXT,
+                    UNIQUE (appointment_id, channel),
+                    FOREIGN KEY (appointment_id) REFERENCES appointments(appointment_id) ON DELETE CASCADE
+                )
+            ''')
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_reminders_status ON reminders(status, reminder_id)"
+            )
+
+            # Waitlist: patients wanting an earlier slot (matched by waitlist.py)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS waitlist (
+                    waitlist_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    patient_id INTEGER NOT NULL,
+                    appointment_type TEXT NOT NULL,
+                    practitioner_id TEXT,
+                    preferred_days TEXT NOT NULL DEFAULT '12345',
+                    earliest_time TEXT NOT NULL DEFAULT '08:00',
+                    latest_time TEXT NOT NULL DEFAULT '19:00',
+                    duration_minutes INTEGER NOT NULL DEFAULT 30,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    status TEXT CHECK(status IN ('Waiting','Booked','Removed'))
+                        NOT NULL DEFAULT 'Waiting',
+                    notes TEXT,
+                    added_by TEXT,
+                    added_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    appointment_id INTEGER,
+                    FOREIGN KEY (patient_id) REFERENCES patients(patient_id) ON DELETE CASCADE,
+                    FOREIGN KEY (practitioner_id) REFERENCES users(staff_id) ON DELETE SET NULL,
+                    FOREIGN KEY (appointment_id) REFERENCES appointments(appointment_id)
+                        ON DELETE SET NULL
+                )
+            ''')
+            # Matching reads waiting entries by their time window; the others
+            # serve foreign-key cascades
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_waitlist_match "
+                "ON waitlist(status, earliest_time)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_waitlist_patient ON waitlist(patient_id)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_waitlist_appointment ON waitlist(appointment_id)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_waitlist_practitioner ON waitlist(practitioner_id)"
+            )
+
+            # Patient erasure queue (worked through by purge.py in small batches)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS purge_queue (
+                    patient_id INTEGER PRIMARY KEY,
+                    requested_by TEXT,
+                    reason TEXT,
+                    requested_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    status TEXT CHECK(status IN ('Pending','Done','Failed'))
+                        NOT NULL DEFAULT 'Pending',
+                    invoices_deleted INTEGER NOT NULL DEFAULT 0,
+                    appointments_deleted INTEGER NOT NULL DEFAULT 0,
+                    completed_at TEXT,
+                    last_error TEXT
+                )
+            ''')
+
+            # One row per maintenance task run (see maintenance.py)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS maintenance_log (
+                    log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    run_id TEXT NOT NULL,
+                    task TEXT NOT NULL,
+                    started_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    duration_ms INTEGER NOT NULL,
+                    size_before INTEGER,
+                    size_after INTEGER,
+                    outcome TEXT CHECK(outcome IN ('ok','skipped','interrupted','failed')) NOT NULL,
+                    detail TEXT
+                )
+            ''')
+
+            # Audit trail (written by audit.py): append-only, so the triggers
+            # below reject any UPDATE or DELETE of existing entries
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS audit_log (
+                    audit_id INTEGER PRIMARY KEY,
+                    logged_at TEXT NOT NULL,
+                    staff_id TEXT,
+                    action TEXT NOT NULL,
+                    entity TEXT NOT NULL,
+                    entity_id TEXT,
+                    detail TEXT
+                )
+            ''')
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_audit_entity ON audit_log(entity, entity_id, logged_at)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_audit_staff ON audit_log(staff_id, logged_at)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_audit_logged_at ON audit_log(logged_at)"
+            )
+            for event in ("UPDATE", "DELETE"):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_audit_no_{event.lower()}
+                    BEFORE {event} ON audit_log
+                    BEGIN
+                        SELECT RAISE(ABORT, 'audit_log is append-only');
+                    END
+                ''')
+
+            # Change feed: one compact record per row change, in seq order
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS change_log (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    table_name TEXT NOT NULL,
+                    row_id INTEGER NOT NULL,
+                    op TEXT NOT NULL CHECK(op IN ('I','U','D')),
+                    changed_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            for table, key in CHANGE_FEED_TABLES.items():
+                for op, event, ref in (("I", "INSERT", "NEW"), ("U", "UPDATE", "NEW"),
+                                       ("D", "DELETE", "OLD")):
+                    cursor.execute(f'''
+                        CREATE TRIGGER IF NOT EXISTS trg_feed_{table}_{event.lower()}
+                        AFTER {event} ON {table}
+                        BEGIN
+                            INSERT INTO change_log (table_name, row_id, op)
+                            VALUES ('{table}', {ref}.{key}, '{op}');
+                        END
+                    ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_feed_prune AFTER INSERT ON change_log
+                WHEN NEW.seq % {CHANGE_LOG_PRUNE} = 0
+                BEGIN
+                    DELETE FROM change_log WHERE seq <= NEW.seq - {CHANGE_LOG_KEEP};
+                END
+            ''')
+
+            # The list sort each staff member last chose, per screen
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sort_preferences (
+                    staff_id TEXT NOT NULL,
+                    screen TEXT NOT NULL,
+                    sort_key TEXT NOT NULL,
+                    descending INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (staff_id, screen)
+                ) WITHOUT ROWID
+            ''')
+
+            conn.commit()
+            print("Database initialized.")
+
+    except sqlite3.Error as e:
+        log_error("Database initialization", e)
 
 
 def add_sample_data():
@@ -116,75 +986,71 @@ def add_sample_data():
     Only runs if tables are empty.
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        # Sample users
-        cursor.execute("SELECT COUNT(*) FROM users")
-        if cursor.fetchone()[0] == 0:
-            users = [
-                ("10001", hash_password("password1"), "Receptionist"),
-                ("10002", hash_password("password2"), "Physiotherapist"),
-                ("10003", hash_password("password3"), "Admin"),
-            ]
-            cursor.executemany(
-                "INSERT INTO users (staff_id, password_hash, role) VALUES (?,?,?)", users
-            )
-
-        # Sample patients
-        cursor.execute("SELECT COUNT(*) FROM patients")
-        if cursor.fetchone()[0] == 0:
-            patients = [
-                ("Sarah Johnson",  "07700 900123", "sarah.j@email.com",  "1990-05-14", "Knee rehab"),
-                ("Michael Chen",   "07700 900456", "m.chen@email.com",   "1985-08-22", "Lower back pain"),
-                ("Emma Williams",  "07700 900789", "e.williams@email.com","1978-03-01", "Shoulder injury"),
-                ("James O'Neill",  "07700 900321", "j.oneill@email.com", "2000-11-17", "Sports injury"),
-                ("Patricia Martinez","07700 900654","p.martinez@email.com","1965-07-30","Post-op recovery"),
-            ]
-            cursor.executemany(
-                "INSERT INTO patients (name, phone, email, date_of_birth, notes) VALUES (?,?,?,?,?)",
-                patients
-            )
-
-        # Sample appointments
-        cursor.execute("SELECT COUNT(*) FROM appointments")
-        if cursor.fetchone()[0] == 0:
-            appointments = [
-                (1, "2026-02-18", "09:00", "Assessment",  "Scheduled", "", "10001"),
-                (2, "2026-02-18", "10:30", "Treatment",   "Scheduled", "", "10001"),
-                (3, "2026-02-19", "14:00", "Follow-up",   "Scheduled", "", "10002"),
-                (4, "2026-02-20", "09:30", "Assessment",  "Scheduled", "", "10001"),
-                (5, "2026-02-20", "11:00", "Treatment",   "Scheduled", "", "10002"),
-            ]
-            cursor.executemany(
-                '''INSERT INTO appointments
-                   (patient_id, appointment_date, appointment_time,
-                    appointment_type, status, notes, created_by)
-                   VALUES (?,?,?,?,?,?,?)''',
-                appointments
-            )
-
-        # Sample invoices
-        cursor.execute("SELECT COUNT(*) FROM invoices")
-        if cursor.fetchone()[0] == 0:
-            invoices = [
-                (1, 1, 45.00, "Initial Assessment", "Paid",   "10001"),
-                (2, 2, 60.00, "Treatment Session",  "Unpaid", "10001"),
-                (3, 3, 60.00, "Follow-up Session",  "Unpaid", "10002"),
-            ]
-            cursor.executemany(
-                '''INSERT INTO invoices
-                   (patient_id, appointment_id, amount, description, status, created_by)
-                   VALUES (?,?,?,?,?,?)''',
-                invoices
-            )
-
-        conn.commit()
-        conn.close()
-        print("Sample data added.")
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+
+            # Sample users
+            cursor.execute("SELECT COUNT(*) FROM users")
+            if cursor.fetchone()[0] == 0:
+                users = [
+                    ("10001", hash_password("password1"), "Receptionist"),
+                    ("10002", hash_password("password2"), "Physiotherapist"),
+                    ("10003", hash_password("password3"), "Admin"),
+                ]
+                cursor.executemany(
+                    "INSERT INTO users (staff_id, password_hash, role) VALUES (?,?,?)", users
+                )
+
+            # Sample patients
+            cursor.execute("SELECT COUNT(*) FROM patients")
+            if cursor.fetchone()[0] == 0:
+                patients = [
+                    ("Sarah Johnson",  "07700 900123", "sarah.j@email.com",  "1990-05-14", "Knee rehab"),
+                    ("Michael Chen",   "07700 900456", "m.chen@email.com",   "1985-08-22", "Lower back pain"),
+                    ("Emma Williams",  "07700 900789", "e.williams@email.com","1978-03-01", "Shoulder injury"),
+                    ("James O'Neill",  "07700 900321", "j.oneill@email.com", "2000-11-17", "Sports injury"),
+                    ("Patricia Martinez","07700 900654","p.martinez@email.com","1965-07-30","Post-op recovery"),
+                ]
+                cursor.executemany(INSERT_PATIENT, (patient_values(*p) for p in patients))
+
+            # Sample appointments
+            cursor.execute("SELECT COUNT(*) FROM appointments")
+            if cursor.fetchone()[0] == 0:
+                appointments = [
+                    (1, "2026-02-18", "09:00", "Assessment",  "Scheduled", "", "10001", "10002"),
+                    (2, "2026-02-18", "10:30", "Treatment",   "Scheduled", "", "10001", "10002"),
+                    (3, "2026-02-19", "14:00", "Follow-up",   "Scheduled", "", "10002", "10002"),
+                    (4, "2026-02-20", "09:30", "Assessment",  "Scheduled", "", "10001", "10002"),
+                    (5, "2026-02-20", "11:00", "Treatment",   "Scheduled", "", "10002", "10002"),
+                ]
+                cursor.executemany(
+                    '''INSERT INTO appointments
+                       (patient_id, appointment_date, appointment_time,
+                        appointment_type, status, notes, created_by, practitioner_id)
+                       VALUES (?,?,?,?,?,?,?,?)''',
+                    appointments
+                )
+
+            # Sample invoices
+            cursor.execute("SELECT COUNT(*) FROM invoices")
+            if cursor.fetchone()[0] == 0:
+                invoices = [
+                    (1, 1, 45.00, "Initial Assessment", "Paid",   "10001"),
+                    (2, 2, 60.00, "Treatment Session",  "Unpaid", "10001"),
+                    (3, 3, 60.00, "Follow-up Session",  "Unpaid", "10002"),
+                ]
+                cursor.executemany(
+                    '''INSERT INTO invoices
+                       (patient_id, appointment_id, amount, description, status, created_by)
+                       VALUES (?,?,?,?,?,?)''',
+                    invoices
+                )
+
+            conn.commit()
+            print("Sample data added.")
 
     except sqlite3.Error as e:
-        print(f"Sample data error: {e}")
+        log_error("Sample data", e)
 
 
 # ─────────────────────────────────────────────────────────
@@ -193,20 +1059,21 @@ def add_sample_data():
 
 def authenticate_user(staff_id, password, company_code):
     """
-    Three-factor login check.
+    Three-factor login check against the company's own database.
     Returns role string if successful, None if failed.
     """
-    if company_code != "12345":
+    if tenant_db_path(company_code) is None:
         return None
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT password_hash, role FROM users WHERE staff_id = ?",
-            (staff_id,)
-        )
-        result = cursor.fetchone()
-        conn.close()
+        with use_tenant(company_code):
+            conn = get_connection()
+        with closing(conn):
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT password_hash, role FROM users WHERE staff_id = ?",
+                (staff_id,)
+            )
+            result = cursor.fetchone()
 
         if not result:
             return None
@@ -217,21 +1084,46 @@ def authenticate_user(staff_id, password, company_code):
         return None
 
     except sqlite3.Error as e:
-        print(f"Auth error: {e}")
+        log_error("Auth", e)
         return None
 
 
+# Staff list sorts; staff_id is unique, so it ends every order
+USER_SORTS = SortOrder(
+    "role",
+    id=(("id",), lambda r: (r.id,)),
+    staff_id=(("staff_id",), lambda r: (r.staff_id,)),
+    role=(("role", "staff_id"), lambda r: (r.role, r.staff_id)),
+    created=(("created_date", "staff_id"), lambda r: (r.created_date, r.staff_id)),
+)
+
+
+def iter_users(sort="role", descending=False):
+    """Yields a UserRow for every staff user, in a USER_SORTS order."""
+    return _iterate(
+        *USER_SORTS.compile("SELECT id, staff_id, role, created_date FROM users",
+                            key=sort, descending=descending),
+        records.UserRow, "Fetch users"
+    )
+
+
 def get_all_users():
     """Returns list of all staff users."""
+    return list(iter_users())
+
+
+def get_practitioners():
+    """Returns the staff_ids of all physiotherapists, in order."""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, staff_id, role, created_date FROM users ORDER BY role, staff_id")
-        users = cursor.fetchall()
-        conn.close()
-        return users
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT staff_id FROM users WHERE role = 'Physiotherapist' ORDER BY staff_id"
+            )
+            practitioners = [row[0] for row in cursor.fetchall()]
+            return practitioners
     except sqlite3.Error as e:
-        print(f"Error fetching users: {e}")
+        log_error("Fetch practitioners", e)
         return []
 
 
@@ -241,50 +1133,82 @@ def add_user(staff_id, password, role):
     Returns True if successful, False if staff_id already exists.
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO users (staff_id, password_hash, role) VALUES (?,?,?)",
-            (staff_id, hash_password(password), role)
-        )
-        conn.commit()
-        conn.close()
-        return True
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO users (staff_id, password_hash, role) VALUES (?,?,?)",
+                (staff_id, hash_password(password), role)
+            )
+            conn.commit()
+            return True
     except sqlite3.IntegrityError:
         return False
     except sqlite3.Error as e:
-        print(f"Add user error: {e}")
+        log_error("Add user", e)
         return False
 
 
 def delete_user(staff_id):
     """Deletes a user by staff_id."""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM users WHERE staff_id = ?", (staff_id,))
-        conn.commit()
-        conn.close()
-        return True
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM users WHERE staff_id = ?", (staff_id,))
+            conn.commit()
+            return True
     except sqlite3.Error as e:
-        print(f"Delete user error: {e}")
+        log_error("Delete user", e)
         return False
 
 
 def change_password(staff_id, new_password):
     """Updates a user's password."""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE users SET password_hash = ? WHERE staff_id = ?",
-            (hash_password(new_password), staff_id)
-        )
-        conn.commit()
-        conn.close()
-        return True
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE users SET password_hash = ? WHERE staff_id = ?",
+                (hash_password(new_password), staff_id)
+            )
+            conn.commit()
+            return True
+    except sqlite3.Error as e:
+        log_error("Change password", e)
+        return False
+
+
+def get_sort_preference(staff_id, screen):
+    """The (sort_key, descending) a staff member last chose on a screen, or None."""
+    try:
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT sort_key, descending FROM sort_preferences WHERE staff_id = ? AND screen = ?",
+                (staff_id, screen)
+            )
+            row = cursor.fetchone()
+            return (row[0], bool(row[1])) if row else None
+    except sqlite3.Error as e:
+        log_error("Fetch sort preference", e)
+        return None
+
+
+def save_sort_preference(staff_id, screen, sort_key, descending):
+    """Remembers a staff member's sort for a screen."""
+    try:
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''INSERT INTO sort_preferences (staff_id, screen, sort_key, descending)
+                   VALUES (?,?,?,?)
+                   ON CONFLICT (staff_id, screen)
+                   DO UPDATE SET sort_key = excluded.sort_key, descending = excluded.descending''',
+                (staff_id, screen, sort_key, int(descending))
+            )
+            conn.commit()
+            return True
     except sqlite3.Error as e:
-        print(f"Change password error: {e}")
+        log_error("Save sort preference", e)
         return False
 
 
@@ -298,70 +1222,141 @@ def add_patient(name, phone, email, dob, notes):
     Returns new patient_id or None on failure.
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            '''INSERT INTO patients (name, phone, email, date_of_birth, notes)
-               VALUES (?,?,?,?,?)''',
-            (name, phone, email, dob, notes)
-        )
-        patient_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return patient_id
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute(INSERT_PATIENT, patient_values(name, phone, email, dob, notes))
+            patient_id = cursor.lastrowid
+            conn.commit()
+            return patient_id
     except sqlite3.Error as e:
-        print(f"Add patient error: {e}")
+        log_error("Add patient", e)
         return None
 
 
+# Patient list sorts, each backed by an index on its first column
+PATIENT_SORTS = SortOrder(
+    "name",
+    id=(("patient_id",), lambda r: (r.patient_id,)),
+    name=(("name", "patient_id"), lambda r: (r.name, r.patient_id)),
+    phone=(("COALESCE(phone, '')", "patient_id"), lambda r: (r.phone or "", r.patient_id)),
+    email=(("COALESCE(email, '')", "patient_id"), lambda r: (r.email or "", r.patient_id)),
+    dob=(("COALESCE(date_of_birth, '')", "patient_id"),
+         lambda r: (r.date_of_birth or "", r.patient_id)),
+)
+
+
+def iter_patients(search_term="", sort="name", descending=False, after=None, limit=None,
+                  hide_erasing=False):
+    """
+    Yields a PatientRow for every patient (whose name matches search_term,
+    if given), in a PATIENT_SORTS order. after and limit page through the
+    list: after is the PATIENT_SORTS cursor of the last row already shown.
+    hide_erasing leaves out patients queued for erasure (purge_queue),
+    in the query itself so that every page is full.
+    """
+    clauses, params = [], []
+    if search_term:
+        clauses.append("name LIKE ?")
+        params.append(f"%{search_term}%")
+    if hide_erasing:
+        clauses.append(
+            "NOT EXISTS (SELECT 1 FROM purge_queue q "
+            "WHERE q.patient_id = patients.patient_id AND q.status = 'Pending')"
+        )
+    return _iterate(
+        *PATIENT_SORTS.compile(
+            "SELECT patient_id, name, phone, email, date_of_birth FROM patients",
+            clauses, params, sort, descending, after, limit
+        ),
+        records.PatientRow, "Fetch patients"
+    )
+
+
 def get_all_patients():
     """
     Returns all patients ordered alphabetically.
     """
+    return list(iter_patients())
+
+
+def count_patients():
+    """Returns how many patients there are."""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT patient_id, name, phone, email, date_of_birth FROM patients ORDER BY name"
-        )
-        patients = cursor.fetchall()
-        conn.close()
-        return patients
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM patients")
+            return cursor.fetchone()[0]
+    except sqlite3.Error as e:
+        log_error("Count patients", e)
+        return 0
+
+
+def get_patients_by_ids(patient_ids):
+    """Returns get_all_patients()-shaped rows for the given patient_ids."""
+    patient_ids = list(patient_ids)
+    if not patient_ids:
+        return []
+    try:
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = records.factory(records.PatientRow)
+            marks = ",".join("?" * len(patient_ids))
+            cursor.execute(
+                f'''SELECT patient_id, name, phone, email, date_of_birth FROM patients
+                    WHERE patient_id IN ({marks}) ORDER BY name''',
+                patient_ids
+            )
+            patients = cursor.fetchall()
+            return patients
     except sqlite3.Error as e:
-        print(f"Fetch patients error: {e}")
+        log_error("Fetch patients by id", e)
         return []
 
 
 def get_patient_by_id(patient_id):
-    """Returns full details for a single patient."""
+    """Returns full details for a single patient as a PatientDetail."""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM patients WHERE patient_id = ?", (patient_id,))
-        patient = cursor.fetchone()
-        conn.close()
-        return patient
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = records.factory(records.PatientDetail)
+            cursor.execute(
+                '''SELECT patient_id, name, phone, email, date_of_birth, notes, created_date,
+                          version
+                   FROM patients WHERE patient_id = ?''',
+                (patient_id,)
+            )
+            patient = cursor.fetchone()
+            return patient
     except sqlite3.Error as e:
-        print(f"Get patient error: {e}")
+        log_error("Get patient", e)
         return None
 
 
-def update_patient(patient_id, name, phone, email, dob, notes):
-    """Updates an existing patient's details."""
+def update_patient(patient_id, name, phone, email, dob, notes, expected_version=None):
+    """
+    Updates an existing patient's details.
+    With expected_version, the update only applies if the row is still at
+    that version; otherwise ConcurrentUpdateError is raised.
+    """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            '''UPDATE patients SET name=?, phone=?, email=?, date_of_birth=?, notes=?
-               WHERE patient_id=?''',
-            (name, phone, email, dob, notes, patient_id)
-        )
-        conn.commit()
-        conn.close()
-        return True
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''UPDATE patients SET name=?, phone=?, email=?, date_of_birth=?, notes=?,
+                                       phone_norm=?, phone_rev=?, email_norm=?,
+                                       version = version + 1
+                   WHERE patient_id=? AND (? IS NULL OR version = ?)''',
+                (name, phone, email, dob, notes, *contact_keys(phone, email),
+                 patient_id, expected_version, expected_version)
+            )
+            updated = cursor.rowcount
+            conn.commit()
     except sqlite3.Error as e:
-        print(f"Update patient error: {e}")
+        log_error("Update patient", e)
         return False
+    if not updated and expected_version is not None:
+        raise ConcurrentUpdateError("patient", patient_id, get_patient_by_id(patient_id))
+    return True
 
 
 def delete_patient(patient_id):
@@ -369,164 +1364,709 @@ def delete_patient(patient_id):
     Deletes a patient and all their linked appointments (CASCADE).
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM patients WHERE patient_id = ?", (patient_id,))
-        conn.commit()
-        conn.close()
-        return True
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM patients WHERE patient_id = ?", (patient_id,))
+            conn.commit()
+            return True
     except sqlite3.Error as e:
-        print(f"Delete patient error: {e}")
+        log_error("Delete patient", e)
         return False
 
 
+def iter_search_patients(search_term):
+    """Yields a PatientMatch for each patient whose name matches the search term."""
+    return _iterate(
+        "SELECT patient_id, name, phone, email FROM patients WHERE name LIKE ? ORDER BY name",
+        (f"%{search_term}%",), records.PatientMatch, "Search patients"
+    )
+
+
 def search_patients(search_term):
     """Returns patients whose name matches the search term."""
+    return list(iter_search_patients(search_term))
+
+
+def search_kind(term):
+    """What a search box entry looks like: "email", "phone" or "name"."""
+    term = term.strip()
+    if "@" in term:
+        return "email"
+    digits = _NON_DIGITS.sub("", term)
+    if len(digits) >= SUFFIX_MIN_DIGITS and not term.strip("+()- 0123456789"):
+        return "phone"
+    return "name"
+
+
+def lookup_phone(phone, limit=20):
+    """
+    Patients whose normalised phone equals the given number, or failing
+    that ends with its digits (at least SUFFIX_MIN_DIGITS of them).
+    Returns PatientMatch rows; both lookups are single index probes.
+    """
+    digits = normalize_phone(phone) or _NON_DIGITS.sub("", phone or "")
+    if len(digits) < SUFFIX_MIN_DIGITS:
+        return []
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT patient_id, name, phone, email FROM patients WHERE name LIKE ? ORDER BY name",
-            (f"%{search_term}%",)
-        )
-        results = cursor.fetchall()
-        conn.close()
-        return results
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = records.factory(records.PatientMatch)
+            cursor.execute(
+                '''SELECT patient_id, name, phone, email FROM patients
+                   WHERE phone_norm = ? ORDER BY name LIMIT ?''',
+                (digits, limit)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                # ':' sorts straight after '9', closing the prefix range
+                cursor.execute(
+                    '''SELECT patient_id, name, phone, email FROM patients
+                       WHERE phone_rev >= ? AND phone_rev < ? ORDER BY name LIMIT ?''',
+                    (digits[::-1], digits[::-1] + ":", limit)
+                )
+                rows = cursor.fetchall()
+            return rows
+    except sqlite3.Error as e:
+        log_error("Phone lookup", e)
+        return []
+
+
+def lookup_email(email, limit=20):
+    """Patients whose normalised email equals the given address, as PatientMatch rows."""
+    email = normalize_email(email)
+    if not email:
+        return []
+    try:
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = records.factory(records.PatientMatch)
+            cursor.execute(
+                '''SELECT patient_id, name, phone, email FROM patients
+                   WHERE email_norm = ? ORDER BY name LIMIT ?''',
+                (email, limit)
+            )
+            rows = cursor.fetchall()
+            return rows
     except sqlite3.Error as e:
-        print(f"Search patients error: {e}")
+        log_error("Email lookup", e)
         return []
 
 
+def find_patients(term):
+    """
+    The search box: a phone number or email address is looked up on the
+    contact keys, anything else searched by name. Returns PatientMatch rows.
+    """
+    kind = search_kind(term)
+    if kind == "phone":
+        return lookup_phone(term)
+    if kind == "email":
+        return lookup_email(term)
+    return search_patients(term)
+
+
 # ─────────────────────────────────────────────────────────
 # APPOINTMENTS
 # ─────────────────────────────────────────────────────────
 
-def add_appointment(patient_id, appt_date, appt_time, appt_type, notes, created_by):
+def add_appointment(patient_id, appt_date, appt_time, appt_type, notes, created_by,
+                    duration_minutes=DEFAULT_DURATION, practitioner_id=None):
     """
     Creates a new appointment linked to a patient.
-    Returns True if successful.
+    Returns True if successful; False if it failed or the practitioner is
+    already booked then (use book_appointment() to see the conflict).
+    """
+    result = book_appointment(patient_id, appt_date, appt_time, appt_type, notes, created_by,
+                              duration_minutes, practitioner_id, alternatives=0)
+    return result.appointment_id is not None
+
+
+def book_appointment(patient_id, appt_date, appt_time, appt_type, notes, created_by,
+                     duration_minutes=DEFAULT_DURATION, practitioner_id=None, alternatives=3):
     """
+    Books an appointment unless it overlaps another active appointment of
+    the same practitioner. The overlap check and the insert run in one
+    IMMEDIATE transaction, so two desks booking at once are serialised
+    rather than both passing the check; the unique slot index backs this
+    up against writers that skip the check.
+
+    Returns a Booking: appointment_id is set on success. On a clash it is
+    None, conflicts holds the clashing appointments and alternatives up
+    to `alternatives` free slots for the same practitioner. Both lists
+    are empty if the booking failed for another reason. Raises
+    ValueError for a duration outside 1-MAX_DURATION minutes.
+    """
+    check_duration(duration_minutes)
+    practitioner_id = practitioner_id or None
+    start = to_epoch_minutes(appt_date, appt_time)
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            '''INSERT INTO appointments
-               (patient_id, appointment_date, appointment_time, appointment_type, notes, created_by)
-               VALUES (?,?,?,?,?,?)''',
-            (patient_id, appt_date, appt_time, appt_type, notes, created_by)
-        )
-        conn.commit()
-        conn.close()
-        return True
+        with closing(get_connection()) as conn:
+            conn.isolation_level = None
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                conflicts = []
+                if practitioner_id:
+                    conflicts = _practitioner_overlaps(cursor, practitioner_id, start,
+                                                       start + duration_minutes)
+                appointment_id = None
+                if not conflicts:
+                    cursor.execute(
+                        '''INSERT INTO appointments
+                           (patient_id, appointment_date, appointment_time, appointment_type,
+                            notes, created_by, duration_minutes, practitioner_id)
+                           VALUES (?,?,?,?,?,?,?,?)''',
+                        (patient_id, appt_date, appt_time, appt_type, notes, created_by,
+                         duration_minutes, practitioner_id)
+                    )
+                    appointment_id = cursor.lastrowid
+                cursor.execute("COMMIT")
+            except sqlite3.IntegrityError:
+                # Lost a race with a writer that bypassed the check
+                cursor.execute("ROLLBACK")
+                conflicts = _practitioner_overlaps(cursor, practitioner_id, start,
+                                                   start + duration_minutes)
+                appointment_id = None
+                if not conflicts:
+                    raise
+            except sqlite3.Error:
+                if conn.in_transaction:
+                    cursor.execute("ROLLBACK")
+                raise
     except sqlite3.Error as e:
-        print(f"Add appointment error: {e}")
-        return False
+        log_error("Book appointment", e)
+        return records.Booking(None, [], [])
+    free = []
+    if conflicts and alternatives:
+        free = find_free_slots(practitioner_id, start, duration_minutes, alternatives)
+    return records.Booking(appointment_id, conflicts, free)
 
 
-def get_all_appointments(search_term="", date_filter=""):
+def _practitioner_overlaps(cursor, practitioner_id, start_min, end_min, exclude_id=None):
     """
-    Returns all appointments joined with patient names.
-    Supports optional search by patient name and date filter.
+    Active appointments of one practitioner overlapping [start_min, end_min),
+    other than exclude_id (the appointment being moved). Like
+    get_overlapping_appointments(), it looks back MAX_DURATION minutes.
+    """
+    cursor.row_factory = records.factory(records.OverlapRow)
+    cursor.execute(
+        '''SELECT appointment_id, patient_id, appointment_date, appointment_time,
+                  duration_minutes, appointment_type, status
+           FROM appointments
+           WHERE practitioner_id = ?
+             AND start_min > ? AND start_min < ?
+             AND start_min + duration_minutes > ?
+             AND status != 'Cancelled'
+             AND appointment_id IS NOT ?
+           ORDER BY start_min''',
+        (practitioner_id, start_min - MAX_DURATION, end_min, start_min, exclude_id)
+    )
+    overlaps = cursor.fetchall()
+    cursor.row_factory = None
+    return overlaps
+
+
+def find_free_slots(practitioner_id, from_min, duration_minutes=DEFAULT_DURATION,
+                    count=3, days=14):
+    """
+    Returns up to `count` FreeSlot records: the practitioner's first free
+    weekday slots (on the HOURS x MINUTES grid) starting at or after
+    from_min, looking at most `days` ahead.
+    """
+    from_min = max(from_min, now_epoch_minutes())
+    until = from_min + days * 1440
+    # Appointments still running at from_min started at most MAX_DURATION
+    # earlier: check_duration() and the schema hold every duration to that
+    try:
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''SELECT start_min, start_min + duration_minutes
+                   FROM appointments
+                   WHERE practitioner_id = ? AND start_min > ? AND start_min < ?
+                     AND status != 'Cancelled'
+                   ORDER BY start_min''',
+                (practitioner_id, from_min - MAX_DURATION, until)
+            )
+            busy = cursor.fetchall()
+    except sqlite3.Error as e:
+        log_error("Find free slots", e)
+        return []
+
+    slots = []
+    first_day = datetime.strptime(from_epoch_minutes(from_min)[0], "%Y-%m-%d").date()
+    for offset in range(days + 1):
+        day = first_day + timedelta(days=offset)
+        if day.weekday() >= 5:
+            continue
+        for hour in HOURS:
+            for minute in MINUTES:
+                start = to_epoch_minutes(day.isoformat(), f"{hour}:{minute}")
+                end = start + duration_minutes
+                if start < from_min or start >= until:
+                    continue
+                if any(b_start < end and b_end > start for b_start, b_end in busy):
+                    continue
+                slots.append(records.FreeSlot(day.isoformat(), f"{hour}:{minute}"))
+                if len(slots) >= count:
+                    return slots
+    return slots
+
+
+def get_busy_intervals(from_min, until_min):
+    """
+    Active appointments starting in [from_min, until_min) (plus any still
+    running at from_min), as (practitioner_id, patient_id, start_min,
+    end_min) tuples. The occupancy read by the batch scheduler. As in
+    find_free_slots(), running appointments are found by looking back
+    MAX_DURATION minutes, the longest the schema allows.
+    """
+    try:
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''SELECT practitioner_id, patient_id, start_min, start_min + duration_minutes
+                   FROM appointments
+                   WHERE start_min > ? AND start_min < ? AND status != 'Cancelled'
+                   ORDER BY start_min''',
+                (from_min - MAX_DURATION, until_min)
+            )
+            rows = cursor.fetchall()
+            return rows
+    except sqlite3.Error as e:
+        log_error("Fetch busy intervals", e)
+        return []
+
+
+def book_appointments(sessions, created_by):
     """
+    Books many PlannedSession records in one IMMEDIATE transaction, each
+    with the same practitioner overlap check as book_appointment. Returns
+    the sessions with appointment_id filled in, or left None for those
+    that clashed with an appointment booked since they were planned.
+    On a database error nothing is booked and None is returned.
+    Raises ValueError, booking nothing, if a session's duration is
+    outside 1-MAX_DURATION minutes.
+    """
+    sessions = list(sessions)
+    for s in sessions:
+        check_duration(s.duration_minutes)
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with closing(get_connection()) as conn:
+            conn.isolation_level = None
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                booked = []
+                for s in sessions:
+                    start = to_epoch_minutes(s.appointment_date, s.appointment_time)
+                    if s.practitioner_id and _practitioner_overlaps(
+                            cursor, s.practitioner_id, start, start + s.duration_minutes):
+                        booked.append(s._replace(appointment_id=None))
+                        continue
+                    cursor.execute(
+                        '''INSERT INTO appointments
+                           (patient_id, appointment_date, appointment_time, appointment_type,
+                            notes, created_by, duration_minutes, practitioner_id)
+                           VALUES (?,?,?,?,?,?,?,?)''',
+                        (s.patient_id, s.appointment_date, s.appointment_time,
+                         s.appointment_type, f"Treatment plan session {s.session}", created_by,
+                         s.duration_minutes, s.practitioner_id)
+                    )
+                    booked.append(s._replace(appointment_id=cursor.lastrowid))
+                cursor.execute("COMMIT")
+            except sqlite3.Error:
+                if conn.in_transaction:
+                    cursor.execute("ROLLBACK")
+                raise
+            return booked
+    except sqlite3.Error as e:
+        log_error("Book treatment plans", e)
+        return None
+
+
+class AppointmentFilter:
+    """
+    Composable appointment query. Each method narrows the filter and
+    returns self, so conditions can be chained:
+
+        AppointmentFilter().status("No Show").between("2026-02-01", "2026-02-28")
 
-        query = '''
-            SELECT a.appointment_id, p.name, a.appointment_date,
-                   a.appointment_time, a.appointment_type, a.status, a.notes
-            FROM appointments a
+    compile() turns it into parameterised SQL. Date ranges are applied to
+    the indexed start_min column rather than the text date/time columns.
+    """
+
+    # Whitelisted sorts; type and status sort by start time within each
+    # value, matching the (type or status, start_min) indexes
+    SORTS = SortOrder(
+        "start",
+        start=(("a.start_min", "a.appointment_id"),
+               lambda r: (to_epoch_minutes(r.appointment_date, r.appointment_time),
+                          r.appointment_id)),
+        # Each patient's appointments in start order: scanning patients by
+        # name, idx_appointments_patient_start yields them already sorted
+        patient=(("p.name", "p.patient_id", "a.start_min", "a.appointment_id"),
+                 lambda r: (r.patient_name, r.patient_id,
+                            to_epoch_minutes(r.appointment_date, r.appointment_time),
+                            r.appointment_id)),
+        type=(("a.appointment_type", "a.start_min", "a.appointment_id"),
+              lambda r: (r.appointment_type,
+                         to_epoch_minutes(r.appointment_date, r.appointment_time),
+                         r.appointment_id)),
+        status=(("a.status", "a.start_min", "a.appointment_id"),
+                lambda r: (r.status, to_epoch_minutes(r.appointment_date, r.appointment_time),
+                           r.appointment_id)),
+        id=(("a.appointment_id",), lambda r: (r.appointment_id,)),
+    )
+
+    SELECT = '''
+        SELECT a.appointment_id, p.name, a.appointment_date,
+               a.appointment_time, a.appointment_type, a.status, a.notes, a.patient_id
+        FROM appointments a
+        JOIN patients p ON a.patient_id = p.patient_id
+    '''
+
+    def __init__(self):
+        self.clauses    = []
+        self.params     = []
+        self.sort_key   = "start"
+        self.descending = False
+        self.limit      = None
+        self.offset     = 0
+        self.cursor     = None
+
+    def _where(self, clause, *params):
+        self.clauses.append(clause)
+        self.params.extend(params)
+        return self
+
+    def patient_name(self, search_term):
+        if search_term:
+            self._where("p.name LIKE ?", f"%{search_term}%")
+        return self
+
+    def on_date(self, appt_date):
+        return self.between(appt_date, appt_date)
+
+    def between(self, start_date="", end_date=""):
+        """Inclusive YYYY-MM-DD bounds; either may be left empty."""
+        if start_date:
+            self._where("a.start_min >= ?", to_epoch_minutes(start_date))
+        if end_date:
+            self._where("a.start_min < ?", to_epoch_minutes(end_date) + 1440)
+        return self
+
+    def _any_of(self, column, values):
+        values = [v for v in values if v]
+        if values:
+            marks = ",".join("?" * len(values))
+            self._where(f"{column} IN ({marks})", *values)
+        return self
+
+    def status(self, *statuses):
+        return self._any_of("a.status", statuses)
+
+    def appointment_type(self, *types):
+        return self._any_of("a.appointment_type", types)
+
+    def created_by(self, staff_id):
+        if staff_id:
+            self._where("a.created_by = ?", staff_id)
+        return self
+
+    def practitioner(self, staff_id):
+        if staff_id:
+            self._where("a.practitioner_id = ?", staff_id)
+        return self
+
+    def ids(self, appointment_ids):
+        appointment_ids = list(appointment_ids)
+        marks = ",".join("?" * len(appointment_ids)) or "NULL"
+        return self._where(f"a.appointment_id IN ({marks})", *appointment_ids)
+
+    def order_by(self, key, descending=False):
+        if key not in self.SORTS:
+            raise ValueError(f"Unknown sort key: {key}")
+        self.sort_key   = key
+        self.descending = descending
+        return self
+
+    def page(self, number, size):
+        """Zero-based page number."""
+        self.limit  = size
+        self.offset = number * size
+        return self
+
+    def after(self, cursor, size):
+        """
+        The page of up to size rows following the row whose SORTS.cursor()
+        is given (the first page for None). Unlike page(), earlier rows are
+        skipped by an index seek rather than read and discarded.
+        """
+        self.cursor = cursor
+        self.limit  = size
+        self.offset = 0
+        return self
+
+    def _where_sql(self):
+        return (" WHERE " + " AND ".join(self.clauses)) if self.clauses else ""
+
+    def compile(self):
+        """Returns (sql, params) for the filtered, sorted, paged query."""
+        sql, params = self.SORTS.compile(self.SELECT, self.clauses, self.params,
+                                         self.sort_key, self.descending,
+                                         self.cursor, self.limit)
+        if self.offset:
+            sql += " OFFSET ?"
+            params.append(self.offset)
+        return sql, params
+
+    def compile_count(self):
+        """Returns (sql, params) counting every matching row, ignoring paging."""
+        sql = '''
+            SELECT COUNT(*) FROM appointments a
             JOIN patients p ON a.patient_id = p.patient_id
-            WHERE p.name LIKE ?
-        '''
-        params = [f"%{search_term}%"]
+        ''' + self._where_sql()
+        return sql, list(self.params)
+
 
-        if date_filter:
-            query += " AND a.appointment_date = ?"
-            params.append(date_filter)
+def iter_appointments(appt_filter):
+    """Runs an AppointmentFilter, yielding an AppointmentRow per match."""
+    return _iterate(*appt_filter.compile(), records.AppointmentRow, "Find appointments")
 
-        query += " ORDER BY a.appointment_date, a.appointment_time"
 
-        cursor.execute(query, params)
-        appointments = cursor.fetchall()
-        conn.close()
-        return appointments
+def find_appointments(appt_filter):
+    """Runs an AppointmentFilter and returns the matching rows."""
+    return list(iter_appointments(appt_filter))
 
+
+def count_appointments(appt_filter):
+    """Returns how many appointments match an AppointmentFilter."""
+    try:
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute(*appt_filter.compile_count())
+            count = cursor.fetchone()[0]
+            return count
     except sqlite3.Error as e:
-        print(f"Fetch appointments error: {e}")
-        return []
+        log_error("Count appointments", e)
+        return 0
+
+
+def get_all_appointments(search_term="", date_filter=""):
+    """
+    Returns all appointments joined with patient names.
+    Supports optional search by patient name and date filter.
+    """
+    return find_appointments(
+        AppointmentFilter().patient_name(search_term).on_date(date_filter)
+    )
 
 
 def get_appointment_by_id(appointment_id):
-    """Returns full details for a single appointment."""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            '''SELECT a.*, p.name FROM appointments a
-               JOIN patients p ON a.patient_id = p.patient_id
-               WHERE a.appointment_id = ?''',
-            (appointment_id,)
-        )
-        appt = cursor.fetchone()
-        conn.close()
-        return appt
+    """Returns full details for a single appointment as an AppointmentDetail."""
+    try:
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = records.factory(records.AppointmentDetail)
+            cursor.execute(
+                '''SELECT a.appointment_id, a.patient_id, a.appointment_date,
+                          a.appointment_time, a.appointment_type, a.status, a.notes,
+                          a.created_by, a.created_at, a.duration_minutes,
+                          a.practitioner_id, p.name, a.version
+                   FROM appointments a
+                   JOIN patients p ON a.patient_id = p.patient_id
+                   WHERE a.appointment_id = ?''',
+                (appointment_id,)
+            )
+            appt = cursor.fetchone()
+            return appt
     except sqlite3.Error as e:
-        print(f"Get appointment error: {e}")
+        log_error("Get appointment", e)
         return None
 
 
-def update_appointment(appointment_id, patient_id, appt_date, appt_time, appt_type, status, notes):
-    """Updates an existing appointment."""
+def update_appointment(appointment_id, patient_id, appt_date, appt_time, appt_type, status, notes,
+                       duration_minutes=None, practitioner_id=None, expected_version=None,
+                       alternatives=3):
+    """
+    Updates an existing appointment.
+    Duration and practitioner are left unchanged unless given;
+    pass practitioner_id="" to unassign the practitioner.
+    With expected_version, the update only applies if the row is still at
+    that version; otherwise ConcurrentUpdateError is raised.
+
+    Unless the appointment is being cancelled, the new time must not
+    overlap another active appointment of its practitioner. As in
+    book_appointment(), the version check, the overlap check and the
+    update run in one IMMEDIATE transaction, and a Booking is returned:
+    appointment_id is set on success; on a clash it is None, with the
+    clashing appointments and free alternatives; on any other failure
+    both lists are empty. Raises ValueError for a duration outside
+    1-MAX_DURATION minutes.
+    """
+    if duration_minutes:
+        check_duration(duration_minutes)
+    start = to_epoch_minutes(appt_date, appt_time)
+    stale = False
+    conflicts, practitioner, duration = [], None, None
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            '''UPDATE appointments
-               SET patient_id=?, appointment_date=?, appointment_time=?,
-                   appointment_type=?, status=?, notes=?
-               WHERE appointment_id=?''',
-            (patient_id, appt_date, appt_time, appt_type, status, notes, appointment_id)
-        )
-        conn.commit()
-        conn.close()
-        return True
+        with closing(get_connection()) as conn:
+            conn.isolation_level = None
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute(
+                    '''SELECT practitioner_id, duration_minutes, version FROM appointments
+                       WHERE appointment_id = ?''',
+                    (appointment_id,)
+                )
+                current = cursor.fetchone()
+                if current is None or expected_version not in (None, current[2]):
+                    cursor.execute("ROLLBACK")
+                    stale = expected_version is not None
+                    if not stale:
+                        return records.Booking(None, [], [])
+                else:
+                    practitioner = (current[0] if practitioner_id is None
+                                    else practitioner_id or None)
+                    duration = duration_minutes or current[1]
+                    if practitioner and status != "Cancelled":
+                        conflicts = _practitioner_overlaps(cursor, practitioner, start,
+                                                           start + duration,
+                                                           exclude_id=appointment_id)
+                    if not conflicts:
+                        cursor.execute(
+                            '''UPDATE appointments
+                               SET patient_id=?, appointment_date=?, appointment_time=?,
+                                   appointment_type=?, status=?, notes=?,
+                                   duration_minutes=?, practitioner_id=?,
+                                   version = version + 1
+                               WHERE appointment_id=?''',
+                            (patient_id, appt_date, appt_time, appt_type, status, notes,
+                             duration, practitioner, appointment_id)
+                        )
+                    cursor.execute("COMMIT")
+            except sqlite3.IntegrityError:
+                # The unique slot index caught a writer that bypassed the check
+                cursor.execute("ROLLBACK")
+                conflicts = _practitioner_overlaps(cursor, practitioner, start,
+                                                   start + duration, exclude_id=appointment_id)
+                if not conflicts:
+                    raise
+            except sqlite3.Error:
+                if conn.in_transaction:
+                    cursor.execute("ROLLBACK")
+                raise
     except sqlite3.Error as e:
-        print(f"Update appointment error: {e}")
-        return False
+        log_error("Update appointment", e)
+        return records.Booking(None, [], [])
+    if stale:
+        raise ConcurrentUpdateError("appointment", appointment_id,
+                                    get_appointment_by_id(appointment_id))
+    if conflicts:
+        free = []
+        if alternatives:
+            free = find_free_slots(practitioner, start, duration, alternatives)
+        return records.Booking(None, conflicts, free)
+    return records.Booking(appointment_id, [], [])
 
 
 def delete_appointment(appointment_id):
     """Deletes an appointment by ID."""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM appointments WHERE appointment_id = ?", (appointment_id,))
-        conn.commit()
-        conn.close()
-        return True
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM appointments WHERE appointment_id = ?", (appointment_id,))
+            conn.commit()
+            return True
     except sqlite3.Error as e:
-        print(f"Delete appointment error: {e}")
+        log_error("Delete appointment", e)
         return False
 
 
+def iter_appointments_by_patient(patient_id):
+    """Yields a PatientAppointment for each of a patient's appointments."""
+    return _iterate(
+        '''SELECT appointment_id, appointment_date, appointment_time,
+                  appointment_type, status
+           FROM appointments WHERE patient_id = ?
+           ORDER BY start_min''',
+        (patient_id,), records.PatientAppointment, "Get appointments by patient"
+    )
+
+
 def get_appointments_by_patient(patient_id):
     """Returns all appointments for a specific patient."""
+    return list(iter_appointments_by_patient(patient_id))
+
+
+def iter_appointments_between(start_min, end_min, status=""):
+    """
+    Yields an AppointmentRow for each appointment starting in
+    [start_min, end_min) epoch minutes, ordered by start time.
+    Optional exact status filter.
+    """
+    query = '''
+        SELECT a.appointment_id, p.name, a.appointment_date,
+               a.appointment_time, a.appointment_type, a.status, a.notes, a.patient_id
+        FROM appointments a
+        JOIN patients p ON a.patient_id = p.patient_id
+        WHERE a.start_min >= ? AND a.start_min < ?
+    '''
+    params = [start_min, end_min]
+    if status:
+        query += " AND a.status = ?"
+        params.append(status)
+    query += " ORDER BY a.start_min"
+    return _iterate(query, params, records.AppointmentRow, "Get appointments between")
+
+
+def get_appointments_between(start_min, end_min, status=""):
+    """
+    Returns appointments starting in [start_min, end_min) epoch minutes,
+    ordered by start time. Optional exact status filter.
+    """
+    return list(iter_appointments_between(start_min, end_min, status))
+
+
+def get_upcoming_appointments(days=7):
+    """Returns appointments from now until the given number of days ahead."""
+    now = now_epoch_minutes()
+    return get_appointments_between(now, now + days * 1440)
+
+
+def get_overdue_scheduled():
+    """Returns appointments still marked Scheduled whose start time has passed."""
+    return get_appointments_between(0, now_epoch_minutes(), status="Scheduled")
+
+
+def get_overlapping_appointments(start_min, end_min, exclude_id=None):
+    """
+    Returns active (not Cancelled) appointments whose time span overlaps
+    [start_min, end_min). The MAX_DURATION lower bound keeps the scan on
+    idx_appointments_start; it is exact because no appointment may last
+    longer (see check_duration()).
+    """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            '''SELECT appointment_id, appointment_date, appointment_time,
-                      appointment_type, status
-               FROM appointments WHERE patient_id = ?
-               ORDER BY appointment_date, appointment_time''',
-            (patient_id,)
-        )
-        results = cursor.fetchall()
-        conn.close()
-        return results
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = records.factory(records.OverlapRow)
+            cursor.execute(
+                '''SELECT appointment_id, patient_id, appointment_date, appointment_time,
+                          duration_minutes, appointment_type, status
+                   FROM appointments
+                   WHERE start_min > ? AND start_min < ?
+                     AND start_min + duration_minutes > ?
+                     AND status != 'Cancelled'
+                     AND appointment_id IS NOT ?
+                   ORDER BY start_min''',
+                (start_min - MAX_DURATION, end_min, start_min, exclude_id)
+            )
+            results = cursor.fetchall()
+            return results
     except sqlite3.Error as e:
-        print(f"Get appointments by patient error: {e}")
+        log_error("Get overlapping appointments", e)
         return []
 
 
@@ -540,113 +2080,168 @@ def create_invoice(patient_id, appointment_id, amount, description, created_by):
     Returns new invoice_id or None on failure.
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            '''INSERT INTO invoices
-               (patient_id, appointment_id, amount, description, created_by)
-               VALUES (?,?,?,?,?)''',
-            (patient_id, appointment_id, amount, description, created_by)
-        )
-        invoice_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return invoice_id
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''INSERT INTO invoices
+                   (patient_id, appointment_id, amount, description, created_by)
+                   VALUES (?,?,?,?,?)''',
+                (patient_id, appointment_id, amount, description, created_by)
+            )
+            invoice_id = cursor.lastrowid
+            conn.commit()
+            return invoice_id
     except sqlite3.Error as e:
-        print(f"Create invoice error: {e}")
+        log_error("Create invoice", e)
         return None
 
 
+# Invoice list sorts, each backed by an index on its leading columns
+INVOICE_SORTS = SortOrder(
+    "date",
+    id=(("i.invoice_id",), lambda r: (r.invoice_id,)),
+    patient=(("p.name", "p.patient_id", "i.invoice_id"),
+             lambda r: (r.patient_name, r.patient_id, r.invoice_id)),
+    amount=(("i.amount", "i.invoice_id"), lambda r: (r.amount, r.invoice_id)),
+    status=(("i.status", "i.created_at", "i.invoice_id"),
+            lambda r: (r.status, r.created_at, r.invoice_id)),
+    date=(("i.created_at", "i.invoice_id"), lambda r: (r.created_at, r.invoice_id)),
+)
+
+
+def iter_invoices(status_filter="", sort="date", descending=True, after=None, limit=None):
+    """
+    Yields an InvoiceRow for every invoice, newest first unless another
+    INVOICE_SORTS order is given. Optional filter by status (Paid/Unpaid).
+    after and limit page through the list as in iter_patients().
+    """
+    query = '''
+        SELECT i.invoice_id, p.name, i.amount, i.description,
+               i.status, i.created_at, i.version, i.patient_id
+        FROM invoices i
+        JOIN patients p ON i.patient_id = p.patient_id
+    '''
+    clauses, params = [], []
+    if status_filter:
+        clauses.append("i.status = ?")
+        params.append(status_filter)
+    return _iterate(
+        *INVOICE_SORTS.compile(query, clauses, params, sort, descending, after, limit),
+        records.InvoiceRow, "Fetch invoices"
+    )
+
+
 def get_all_invoices(status_filter=""):
     """
     Returns all invoices joined with patient names.
     Optional filter by status (Paid/Unpaid).
     """
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
+    return list(iter_invoices(status_filter))
 
-        query = '''
-            SELECT i.invoice_id, p.name, i.amount, i.description,
-                   i.status, i.created_at
-            FROM invoices i
-            JOIN patients p ON i.patient_id = p.patient_id
-        '''
-        params = []
-        if status_filter:
-            query += " WHERE i.status = ?"
-            params.append(status_filter)
-
-        query += " ORDER BY i.created_at DESC"
-        cursor.execute(query, params)
-        invoices = cursor.fetchall()
-        conn.close()
-        return invoices
 
+def get_invoices_by_ids(invoice_ids):
+    """Returns get_all_invoices()-shaped rows for the given invoice_ids."""
+    invoice_ids = list(invoice_ids)
+    if not invoice_ids:
+        return []
+    try:
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = records.factory(records.InvoiceRow)
+            marks = ",".join("?" * len(invoice_ids))
+            cursor.execute(
+                f'''SELECT i.invoice_id, p.name, i.amount, i.description,
+                           i.status, i.created_at, i.version, i.patient_id
+                    FROM invoices i
+                    JOIN patients p ON i.patient_id = p.patient_id
+                    WHERE i.invoice_id IN ({marks})''',
+                invoice_ids
+            )
+            invoices = cursor.fetchall()
+            return invoices
     except sqlite3.Error as e:
-        print(f"Fetch invoices error: {e}")
+        log_error("Fetch invoices by id", e)
         return []
 
 
+def iter_invoices_by_patient(patient_id):
+    """Yields a PatientInvoice for each of a patient's invoices, newest first."""
+    return _iterate(
+        '''SELECT invoice_id, amount, description, status, created_at
+           FROM invoices WHERE patient_id = ?
+           ORDER BY created_at DESC, invoice_id DESC''',
+        (patient_id,), records.PatientInvoice, "Get patient invoices"
+    )
+
+
 def get_invoices_by_patient(patient_id):
     """Returns all invoices for a specific patient."""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            '''SELECT invoice_id, amount, description, status, created_at
-               FROM invoices WHERE patient_id = ?
-               ORDER BY created_at DESC''',
-            (patient_id,)
-        )
-        results = cursor.fetchall()
-        conn.close()
-        return results
-    except sqlite3.Error as e:
-        print(f"Get patient invoices error: {e}")
-        return []
+    return list(iter_invoices_by_patient(patient_id))
 
 
-def update_invoice_status(invoice_id, new_status):
-    """Marks an invoice as Paid or Unpaid."""
+def update_invoice_status(invoice_id, new_status, expected_version=None):
+    """
+    Marks an invoice as Paid or Unpaid.
+    With expected_version, the update only applies if the invoice is still
+    at that version; otherwise ConcurrentUpdateError is raised.
+    """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE invoices SET status = ? WHERE invoice_id = ?",
-            (new_status, invoice_id)
-        )
-        conn.commit()
-        conn.close()
-        return True
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''UPDATE invoices SET status = ?, version = version + 1
+                   WHERE invoice_id = ? AND (? IS NULL OR version = ?)''',
+                (new_status, invoice_id, expected_version, expected_version)
+            )
+            updated = cursor.rowcount
+            conn.commit()
     except sqlite3.Error as e:
-        print(f"Update invoice error: {e}")
+        log_error("Update invoice", e)
         return False
+    if not updated and expected_version is not None:
+        current = get_invoices_by_ids([invoice_id])
+        raise ConcurrentUpdateError("invoice", invoice_id, current[0] if current else None)
+    return True
 
 
 def delete_invoice(invoice_id):
     """Deletes an invoice."""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM invoices WHERE invoice_id = ?", (invoice_id,))
-        conn.commit()
-        conn.close()
-        return True
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM invoices WHERE invoice_id = ?", (invoice_id,))
+            conn.commit()
+            return True
     except sqlite3.Error as e:
-        print(f"Delete invoice error: {e}")
+        log_error("Delete invoice", e)
         return False
 
 
 def get_total_outstanding():
     """Returns total amount of all unpaid invoices."""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT SUM(amount) FROM invoices WHERE status = 'Unpaid'")
-        result = cursor.fetchone()[0]
-        conn.close()
-        return result if result else 0.0
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT SUM(amount) FROM invoices WHERE status = 'Unpaid'")
+            result = cursor.fetchone()[0]
+            return result if result else 0.0
     except sqlite3.Error as e:
-        print(f"Get outstanding error: {e}")
+        log_error("Get outstanding", e)
         return 0.0
+
+
+# ─────────────────────────────────────────────────────────
+# CHANGE FEED
+# ─────────────────────────────────────────────────────────
+
+def get_latest_change_seq():
+    """Returns the newest change_log sequence number (0 if none)."""
+    try:
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log")
+            seq = cursor.fetchone()[0]
+            return seq
+    except sqlite3.Error as e:
+        log_error("Get latest change", e)
+        return 0
@@ -0,0 +1,107 @@
+"""
+datagen.py - Fixit Physio Enhanced System
+Generates a realistically sized clinic database for benchmarks and the
+query-plan checker.
+
+Volumes default to a busy multi-practitioner clinic after a few years:
+thousands of patients, ~100k appointments spread over working hours,
+mostly paid invoices. No practitioner has two active appointments
+starting at the same time. A fixed seed makes every run identical.
+"""
+
+import random
+from datetime import date, timedelta
+import database
+
+FIRST_NAMES = ["Sarah", "Michael", "Emma", "James", "Patricia", "Olivia", "Noah", "Amelia",
+               "George", "Isla", "Harry", "Ava", "Jack", "Mia", "Oliver", "Grace"]
+LAST_NAMES  = ["Johnson", "Chen", "Williams", "O'Neill", "Martinez", "Smith", "Brown",
+               "Taylor", "Wilson", "Davies", "Evans", "Thomas", "Roberts", "Khan", "Patel"]
+
+
+def generate(practitioners=12, patients=8000, appointments=100000, years=3,
+             seed=1234, end=None):
+    """
+    Fills the current database (which must be initialised) with generated
+    staff, patients, appointments and invoices. Returns the row counts.
+    """
+    rng = random.Random(seed)
+    end = end or date.today() + timedelta(days=60)
+    start = end - timedelta(days=365 * years)
+    days = [start + timedelta(days=i) for i in range((end - start).days)
+            if (start + timedelta(days=i)).weekday() < 5]
+
+    conn = database.get_connection()
+    cursor = conn.cursor()
+
+    staff = [(f"2{i:04d}", database.hash_password("password"), "Physiotherapist")
+             for i in range(practitioners)]
+    staff += [("29001", database.hash_password("password"), "Receptionist"),
+              ("29002", database.hash_password("password"), "Admin")]
+    cursor.executemany(
+        "INSERT OR IGNORE INTO users (staff_id, password_hash, role) VALUES (?,?,?)", staff
+    )
+    physio_ids = [s[0] for s in staff if s[2] == "Physiotherapist"]
+    desk_ids   = ["29001", "29002"] + physio_ids
+
+    cursor.execute("SELECT COALESCE(MAX(patient_id), 0) FROM patients")
+    first_patient = cursor.fetchone()[0] + 1
+    cursor.executemany(
+        database.INSERT_PATIENT,
+        (database.patient_values(
+            f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            f"07700 {rng.randrange(1000000):06d}",
+            f"patient{first_patient + i}@example.com",
+            f"{rng.randint(1940, 2015)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "")
+         for i in range(patients))
+    )
+    patient_ids = range(first_patient, first_patient + patients)
+
+    today = date.today().isoformat()
+    taken = set()       # (practitioner, day, time) of active appointments
+
+    def appointment():
+        while True:
+            day = rng.choice(days).isoformat()
+            appt_time = f"{rng.choice(database.HOURS)}:{rng.choice(database.MINUTES)}"
+            practitioner = rng.choice(physio_ids)
+            status = ("Scheduled" if day >= today else
+                      rng.choices(database.APPOINTMENT_STATUSES, weights=[2, 80, 10, 8])[0])
+            if status == "Cancelled" or (practitioner, day, appt_time) not in taken:
+                break
+        if status != "Cancelled":
+            taken.add((practitioner, day, appt_time))
+        return (rng.choice(patient_ids), day, appt_time,
+                rng.choice(database.APPOINTMENT_TYPES), status, "",
+                rng.choice(desk_ids), practitioner,
+                rng.choice((30, 30, 45, 60)))
+
+    cursor.execute("SELECT COALESCE(MAX(appointment_id), 0) FROM appointments")
+    first_appt = cursor.fetchone()[0] + 1
+    cursor.executemany(
+        '''INSERT INTO appointments
+           (patient_id, appointment_date, appointment_time, appointment_type, status,
+            notes, created_by, practitioner_id, duration_minutes)
+           VALUES (?,?,?,?,?,?,?,?,?)''',
+        (appointment() for _ in range(appointments))
+    )
+
+    # Roughly one invoice per completed appointment, most of them paid
+    cursor.execute(
+        '''INSERT INTO invoices
+           (patient_id, appointment_id, amount, description, status, created_by, created_at)
+           SELECT patient_id, appointment_id,
+                  CASE appointment_type WHEN 'Assessment' THEN 45 ELSE 60 END,
+                  appointment_type || ' Session',
+                  CASE WHEN appointment_id % 10 = 0 THEN 'Unpaid' ELSE 'Paid' END,
+                  created_by, appointment_date || ' ' || appointment_time || ':00'
+           FROM appointments
+           WHERE appointment_id >= ? AND status = 'Completed' ''',
+        (first_appt,)
+    )
+    invoices = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return {"practitioners": practitioners, "patients": patients,
+            "appointments": appointments, "invoices": invoices}
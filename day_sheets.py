@@ -0,0 +1,123 @@
+"""
+day_sheets.py - Fixit Physio Enhanced System
+Printable per-practitioner day sheets for the whole clinic.
+
+One ordered query fetches the day's appointments sorted by practitioner
+and start time; a single groupby pass splits them into sheets, which are
+then written out as HTML, PDF or plain text files.
+"""
+
+import html
+import os
+import sqlite3
+from itertools import groupby
+from operator import itemgetter
+import database
+import pdf_writer
+
+UNASSIGNED = "Unassigned"
+FORMATS = ("html", "pdf", "txt")
+
+
+# ─────────────────────────────────────────────────────────
+# BUILDING
+# ─────────────────────────────────────────────────────────
+
+def build_day_sheets(day):
+    """
+    Returns {practitioner: [rows]} for the given YYYY-MM-DD date.
+    Every physiotherapist gets a sheet, even with no bookings; unassigned
+    appointments are collected under UNASSIGNED.
+    Rows: (time, duration, patient, phone, type, status, notes).
+    """
+    start = database.to_epoch_minutes(day)
+    sheets = {staff_id: [] for staff_id in database.get_practitioners()}
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            '''SELECT COALESCE(a.practitioner_id, ?), a.appointment_time,
+                      a.duration_minutes, p.name, p.phone,
+                      a.appointment_type, a.status, a.notes
+               FROM appointments a
+               JOIN patients p ON a.patient_id = p.patient_id
+               WHERE a.start_min >= ? AND a.start_min < ?
+                 AND a.status != 'Cancelled'
+               ORDER BY 1, a.start_min''',
+            (UNASSIGNED, start, start + 1440)
+        )
+        for practitioner, rows in groupby(cursor, key=itemgetter(0)):
+            sheets[practitioner] = [row[1:] for row in rows]
+        conn.close()
+    except sqlite3.Error as e:
+        database.log_error("Build day sheets", e)
+    return sheets
+
+
+# ─────────────────────────────────────────────────────────
+# RENDERING
+# ─────────────────────────────────────────────────────────
+
+def render_text_lines(day, practitioner, rows):
+    lines = [
+        "FIXIT PHYSIO - DAY SHEET",
+        f"Date: {day}    Practitioner: {practitioner}",
+        "",
+        f"{'Time':<6} {'Mins':>4}  {'Patient':<24} {'Phone':<14} {'Type':<11} Status",
+        "-" * 78,
+    ]
+    for time, duration, patient, phone, appt_type, status, notes in rows:
+        lines.append(f"{time:<6} {duration:>4}  {patient[:24]:<24} {(phone or '')[:14]:<14} "
+                     f"{(appt_type or '')[:11]:<11} {status}")
+        if notes:
+            lines.append(f"{'':<12}Notes: {notes}")
+    if not rows:
+        lines.append("No appointments.")
+    lines += ["", f"Total appointments: {len(rows)}"]
+    return lines
+
+
+def render_html(day, practitioner, rows):
+    e = html.escape
+    body = "".join(
+        f"<tr><td>{e(time)}</td><td>{duration}</td><td>{e(patient)}</td>"
+        f"<td>{e(phone or '')}</td><td>{e(appt_type or '')}</td><td>{e(status or '')}</td>"
+        f"<td>{e(notes or '')}</td></tr>"
+        for time, duration, patient, phone, appt_type, status, notes in rows
+    ) or "<tr><td colspan='7'>No appointments.</td></tr>"
+    return (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'>"
+        f"<title>Day sheet {e(day)} - {e(practitioner)}</title>"
+        "<style>body{font-family:Arial} table{border-collapse:collapse;width:100%}"
+        "td,th{border:1px solid #999;padding:4px;text-align:left}</style></head><body>"
+        f"<h2>Fixit Physio - Day Sheet</h2><p>Date: {e(day)}<br>Practitioner: {e(practitioner)}</p>"
+        "<table><tr><th>Time</th><th>Mins</th><th>Patient</th><th>Phone</th>"
+        f"<th>Type</th><th>Status</th><th>Notes</th></tr>{body}</table>"
+        f"<p>Total appointments: {len(rows)}</p></body></html>"
+    )
+
+
+def write_day_sheets(day, out_dir, formats=FORMATS):
+    """
+    Writes every practitioner's sheet for the day into out_dir, one file
+    per practitioner and format. Returns the list of paths written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for practitioner, rows in build_day_sheets(day).items():
+        base = os.path.join(out_dir, f"day_sheet_{day}_{practitioner}")
+        for fmt in formats:
+            path = f"{base}.{fmt}"
+            if fmt == "html":
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(render_html(day, practitioner, rows))
+            elif fmt == "pdf":
+                with open(path, "wb") as f:
+                    f.write(pdf_writer.text_pdf(render_text_lines(day, practitioner, rows)))
+            elif fmt == "txt":
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write("\n".join(render_text_lines(day, practitioner, rows)) + "\n")
+            else:
+                raise ValueError(f"Unknown day sheet format: {fmt}")
+            written.append(path)
+    return written
@@ -0,0 +1,265 @@
+"""
+dedupe.py - Fixit Physio Enhanced System
+Duplicate-patient detection and merging.
+
+Comparing every pair of patients is quadratic, so candidates are found by
+blocking instead: each patient is filed under a few keys (normalised
+phone, normalised email, Soundex of the surname plus date of birth) and
+only patients sharing a key are compared. One pass over the table builds
+the blocks, so the work grows with the number of patients, not pairs.
+Oversized blocks (a shared switchboard number) are skipped.
+
+Candidate pairs are scored from name similarity ("S Johnson" against
+"Sarah Johnson" counts as close) plus matching phone, email and date of
+birth; a conflicting date of birth counts against. merge_patients()
+moves one record's appointments, invoices and waitlist entries onto the
+other and deletes it, in one transaction.
+"""
+
+import re
+import sqlite3
+from collections import defaultdict, namedtuple
+from difflib import SequenceMatcher
+from functools import lru_cache
+from itertools import combinations
+import database
+import records
+import audit
+
+MATCH_THRESHOLD = 0.75      # pairs scoring at least this are reported
+MAX_BLOCK       = 50        # larger blocks are too common a key to be evidence
+
+# Score weights: name similarity contributes up to NAME_WEIGHT, each
+# matching identifier adds its weight, a conflicting date of birth
+# subtracts DOB_CONFLICT
+NAME_WEIGHT  = 0.5
+PHONE_WEIGHT = 0.3
+EMAIL_WEIGHT = 0.3
+DOB_WEIGHT   = 0.25
+DOB_CONFLICT = 0.3
+
+_SOUNDEX_CODES = {ch: str(code)
+                  for code, letters in enumerate(
+                      ("", "bfpv", "cgjkqsxz", "dt", "l", "mn", "r"))
+                  for ch in letters}
+_WORDS = re.compile(r"[^\W\d_]+")
+
+# A patient's fields as compared: lower-case name parts, normalised contacts
+Profile = namedtuple("Profile", "patient_id first surname phone email dob")
+
+
+# ─────────────────────────────────────────────────────────
+# KEYS
+# ─────────────────────────────────────────────────────────
+
+@lru_cache(maxsize=65536)      # surnames repeat; most lookups hit
+def soundex(word):
+    """American Soundex code of a word ("Johnson" -> "J525"); "" if it has no letters."""
+    letters = [ch for ch in word.lower() if ch.isalpha()]
+    if not letters:
+        return ""
+    code = letters[0].upper()
+    previous = _SOUNDEX_CODES.get(letters[0], "")
+    for ch in letters[1:]:
+        digit = _SOUNDEX_CODES.get(ch, "")
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        if ch not in "hw":
+            previous = digit
+    return code.ljust(4, "0")
+
+
+def name_parts(name):
+    """(first name, surname) in lower case; "" for a missing part."""
+    words = _WORDS.findall((name or "").lower().replace("'", ""))
+    if not words:
+        return "", ""
+    if len(words) == 1:
+        return "", words[0]
+    return words[0], words[-1]
+
+
+def profile(patient):
+    """The normalised fields of a PatientRow that blocking and scoring use."""
+    first, surname = name_parts(patient.name)
+    return Profile(patient.patient_id, first, surname,
+                   database.normalize_phone(patient.phone),
+                   database.normalize_email(patient.email), patient.date_of_birth or "")
+
+
+def blocking_keys(p):
+    """The keys a Profile is filed under."""
+    keys = []
+    if p.phone:
+        keys.append(("phone", p.phone))
+    if p.email:
+        keys.append(("email", p.email))
+    if p.surname and p.dob:
+        keys.append(("name", f"{soundex(p.surname)}|{p.dob}"))
+    return keys
+
+
+# ─────────────────────────────────────────────────────────
+# SCORING
+# ─────────────────────────────────────────────────────────
+
+def _first_name_similarity(a, b):
+    if not a or not b:
+        return 0.5
+    if a == b:
+        return 1.0
+    if (len(a) == 1 or len(b) == 1) and a[0] == b[0]:
+        return 0.9      # an initial
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def _surname_similarity(a, b):
+    if a == b:
+        return 1.0
+    if soundex(a) == soundex(b):
+        return 0.8
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def score(a, b, min_score=0.0):
+    """
+    Returns (score 0-1, reasons) for two Profiles. Pairs that cannot reach
+    min_score even with identical names are returned early, unscored by name.
+    """
+    total, reasons = 0.0, []
+    if a.phone and a.phone == b.phone:
+        total += PHONE_WEIGHT
+        reasons.append("phone")
+    if a.email and a.email == b.email:
+        total += EMAIL_WEIGHT
+        reasons.append("email")
+    if a.dob and b.dob:
+        if a.dob == b.dob:
+            total += DOB_WEIGHT
+            reasons.append("dob")
+        else:
+            total -= DOB_CONFLICT
+            reasons.append("dob differs")
+    if total + NAME_WEIGHT < min_score:
+        return max(0.0, round(total, 3)), reasons
+    name_sim = (_first_name_similarity(a.first, b.first)
+                + _surname_similarity(a.surname, b.surname)) / 2
+    total += NAME_WEIGHT * name_sim
+    reasons.insert(0, f"name {name_sim:.2f}")
+    return round(max(0.0, min(1.0, total)), 3), reasons
+
+
+# ─────────────────────────────────────────────────────────
+# DETECTION
+# ─────────────────────────────────────────────────────────
+
+def candidate_pairs(profiles):
+    """
+    Blocks the profiles and returns ({(id, id): (profile, profile)},
+    skipped_blocks), each pair once with the lower id first.
+    """
+    blocks = defaultdict(list)
+    for p in profiles:
+        for key in blocking_keys(p):
+            blocks[key].append(p)
+    pairs, skipped = {}, 0
+    for members in blocks.values():
+        if len(members) > MAX_BLOCK:
+            skipped += 1
+            continue
+        for a, b in combinations(members, 2):
+            if a.patient_id > b.patient_id:
+                a, b = b, a
+            pairs[(a.patient_id, b.patient_id)] = (a, b)
+    return pairs, skipped
+
+
+def find_duplicates(min_score=MATCH_THRESHOLD):
+    """
+    Scores every candidate pair. Returns (DuplicatePair list, best first;
+    stats dict with patients, candidate pairs and skipped blocks).
+    """
+    profiles = [profile(patient) for patient in database.iter_patients()]
+    pairs, skipped = candidate_pairs(profiles)
+    found = []
+    for (patient_id, other_id), (a, b) in pairs.items():
+        value, reasons = score(a, b, min_score)
+        if value >= min_score:
+            found.append(records.DuplicatePair(patient_id, other_id, value, ", ".join(reasons)))
+    found.sort(key=lambda p: (-p.score, p.patient_id, p.other_id))
+    return found, {"patients": len(profiles), "candidates": len(pairs),
+                   "skipped_blocks": skipped, "duplicates": len(found)}
+
+
+# ─────────────────────────────────────────────────────────
+# MERGING
+# ─────────────────────────────────────────────────────────
+
+def merge_patients(survivor_id, duplicate_id, merged_by=None):
+    """
+    Moves the duplicate's appointments, invoices and waitlist entries to
+    the survivor, fills the survivor's blank phone, email and date of
+    birth from the duplicate, keeps the duplicate's notes, then deletes
+    the duplicate. All in one transaction: on failure nothing changes.
+    Returns {"appointments": n, "invoices": n, "waitlist": n}, or None.
+    """
+    if survivor_id == duplicate_id:
+        print("Merge patients error: a patient cannot be merged into itself")
+        return None
+    moved = {}
+    try:
+        conn = database.get_connection()
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute(
+                '''SELECT phone, email, date_of_birth, notes FROM patients
+                   WHERE patient_id = ?''',
+                (duplicate_id,)
+            )
+            duplicate = cursor.fetchone()
+            cursor.execute("SELECT 1 FROM patients WHERE patient_id = ?", (survivor_id,))
+            if duplicate is None or cursor.fetchone() is None:
+                raise sqlite3.IntegrityError(
+                    f"patient {survivor_id} or {duplicate_id} does not exist")
+            for table in ("appointments", "invoices", "waitlist"):
+                cursor.execute(f"UPDATE {table} SET patient_id = ? WHERE patient_id = ?",
+                               (survivor_id, duplicate_id))
+                moved[table] = cursor.rowcount
+            phone, email, dob, notes = duplicate
+            merged_note = f"Merged from patient #{duplicate_id}" + (f": {notes}" if notes else "")
+            cursor.execute(
+                '''UPDATE patients
+                   SET phone = COALESCE(NULLIF(phone, ''), ?),
+                       email = COALESCE(NULLIF(email, ''), ?),
+                       date_of_birth = COALESCE(NULLIF(date_of_birth, ''), ?),
+                       notes = TRIM(COALESCE(notes, '') || char(10) || ?, char(10)),
+                       version = version + 1
+                   WHERE patient_id = ?''',
+                (phone, email, dob, merged_note, survivor_id)
+            )
+            cursor.execute("SELECT phone, email FROM patients WHERE patient_id = ?",
+                           (survivor_id,))
+            cursor.execute(
+                '''UPDATE patients SET phone_norm = ?, phone_rev = ?, email_norm = ?
+                   WHERE patient_id = ?''',
+                database.contact_keys(*cursor.fetchone()) + (survivor_id,)
+            )
+            cursor.execute("DELETE FROM patients WHERE patient_id = ?", (duplicate_id,))
+            cursor.execute("COMMIT")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+        conn.close()
+    except sqlite3.Error as e:
+        database.log_error("Merge patients", e)
+        return None
+    audit.record(audit.UPDATE, "patient", survivor_id,
+                 f"merged patient #{duplicate_id}", staff_id=merged_by)
+    audit.record(audit.DELETE, "patient", duplicate_id,
+                 f"merged into patient #{survivor_id}", staff_id=merged_by)
+    return moved
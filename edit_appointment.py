@@ -6,30 +6,35 @@ Edit an existing appointment with date picker.
 import tkinter as tk
 from tkinter import ttk, messagebox
 import database
+import audit
+import add_appointment
+import edit_conflicts
+from database import APPOINTMENT_TYPES, APPOINTMENT_STATUSES, HOURS, MINUTES
 from date_picker import DatePicker
 
-APPOINTMENT_TYPES    = ["Assessment", "Treatment", "Follow-up", "Review", "Discharge"]
-APPOINTMENT_STATUSES = ["Scheduled", "Completed", "Cancelled", "No Show"]
-HOURS   = [f"{h:02d}" for h in range(8, 19)]
-MINUTES = ["00", "15", "30", "45"]
-
 
 class EditAppointment:
 
+    # Fields the form edits, as stored on the appointment row
+    FIELDS = ("patient_id", "appointment_date", "appointment_time",
+              "appointment_type", "status", "notes", "practitioner_id")
+
     def __init__(self, window, appointment_id, user_id, on_close=None):
         self.window         = window
         self.appointment_id = appointment_id
         self.user_id        = user_id
         self.on_close       = on_close
         self.window.title("Edit Appointment")
-        self.window.geometry("440x530")
+        self.window.geometry("440x570")
         self.window.resizable(False, False)
         self.patients  = database.get_all_patients()
+        self.practitioners = database.get_practitioners()
         self.appt_data = database.get_appointment_by_id(appointment_id)
         if not self.appt_data:
             messagebox.showerror("Error", "Appointment not found.")
             self.window.destroy()
             return
+        audit.record(audit.VIEW, "appointment", appointment_id)
         self.create_widgets()
         self.populate()
 
@@ -44,7 +49,7 @@ class EditAppointment:
         tk.Label(form, text="Patient:", anchor="w").grid(
             row=0, column=0, sticky="w", pady=8)
         self.patient_var = tk.StringVar()
-        patient_names = [f"{p[0]} - {p[1]}" for p in self.patients]
+        patient_names = [f"{p.patient_id} - {p.name}" for p in self.patients]
         self.patient_cb = ttk.Combobox(form, textvariable=self.patient_var,
                                        values=patient_names, width=28, state="readonly")
         self.patient_cb.grid(row=0, column=1, pady=8, padx=(10, 0))
@@ -84,11 +89,20 @@ class EditAppointment:
                      width=28, state="readonly").grid(
             row=4, column=1, pady=8, padx=(10, 0))
 
+        # Practitioner
+        tk.Label(form, text="Practitioner:", anchor="w").grid(
+            row=5, column=0, sticky="w", pady=8)
+        self.practitioner_var = tk.StringVar(value="Unassigned")
+        ttk.Combobox(form, textvariable=self.practitioner_var,
+                     values=self.practitioners + ["Unassigned"],
+                     width=28, state="readonly").grid(
+            row=5, column=1, pady=8, padx=(10, 0))
+
         # Notes
         tk.Label(form, text="Notes:", anchor="w").grid(
-            row=5, column=0, sticky="nw", pady=8)
+            row=6, column=0, sticky="nw", pady=8)
         self.notes_text = tk.Text(form, width=22, height=4)
-        self.notes_text.grid(row=5, column=1, pady=8, padx=(10, 0))
+        self.notes_text.grid(row=6, column=1, pady=8, padx=(10, 0))
 
         # Buttons
         btn_frame = tk.Frame(self.window)
@@ -100,52 +114,95 @@ class EditAppointment:
                   width=10, relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
 
     def populate(self):
-        # appt_data: appt_id, patient_id, date, time, type, status, notes, created_by, created_at, patient_name
-        _, patient_id, appt_date, appt_time, appt_type, status, notes, *_ = self.appt_data
+        appt = self.appt_data
 
         # Set patient dropdown
         for i, p in enumerate(self.patients):
-            if p[0] == patient_id:
+            if p.patient_id == appt.patient_id:
                 self.patient_cb.current(i)
                 break
 
         # Set date picker
-        if appt_date:
-            self.date_picker.set(appt_date)
+        if appt.appointment_date:
+            self.date_picker.set(appt.appointment_date)
 
         # Set time dropdowns
-        if appt_time and ":" in appt_time:
-            h, m = appt_time.split(":")
+        if appt.appointment_time and ":" in appt.appointment_time:
+            h, m = appt.appointment_time.split(":")
             # Snap to nearest quarter
             self.hour_var.set(h if h in HOURS else "09")
             self.min_var.set(m if m in MINUTES else "00")
 
-        self.type_var.set(appt_type or "Assessment")
-        self.status_var.set(status or "Scheduled")
-        if notes:
-            self.notes_text.insert("1.0", notes)
+        self.type_var.set(appt.appointment_type or "Assessment")
+        self.status_var.set(appt.status or "Scheduled")
+        self.practitioner_var.set(appt.practitioner_id or "Unassigned")
+        if appt.notes:
+            self.notes_text.insert("1.0", appt.notes)
+
+    def form_values(self):
+        practitioner = self.practitioner_var.get()
+        return {
+            "patient_id":       int(self.patient_var.get().split(" - ")[0]),
+            "appointment_date": self.date_picker.get(),
+            "appointment_time": f"{self.hour_var.get()}:{self.min_var.get()}",
+            "appointment_type": self.type_var.get(),
+            "status":           self.status_var.get(),
+            "notes":            self.notes_text.get("1.0", tk.END).strip(),
+            "practitioner_id":  None if practitioner == "Unassigned" else practitioner,
+        }
+
+    def row_values(self, appt):
+        values = {field: getattr(appt, field) for field in self.FIELDS}
+        values["notes"] = values["notes"] or ""
+        return values
 
     def save(self):
-        patient_str = self.patient_var.get()
-        appt_date   = self.date_picker.get()
-        appt_time   = f"{self.hour_var.get()}:{self.min_var.get()}"
-        appt_type   = self.type_var.get()
-        status      = self.status_var.get()
-        notes       = self.notes_text.get("1.0", tk.END).strip()
-
-        if not patient_str:
+        if not self.patient_var.get():
             messagebox.showerror("Error", "Please select a patient.")
             return
-
-        patient_id = int(patient_str.split(" - ")[0])
-        success = database.update_appointment(
-            self.appointment_id, patient_id, appt_date,
-            appt_time, appt_type, status, notes
-        )
-        if success:
+        self.write(self.form_values(), self.appt_data.version)
+
+    def write(self, values, version):
+        try:
+            booking = database.update_appointment(
+                self.appointment_id, values["patient_id"], values["appointment_date"],
+                values["appointment_time"], values["appointment_type"], values["status"],
+                values["notes"], practitioner_id=values["practitioner_id"] or "",
+                expected_version=version
+            )
+        except database.ConcurrentUpdateError as e:
+            self.resolve_conflict(values, e.current)
+            return
+        if booking.appointment_id is not None:
+            audit.record(audit.UPDATE, "appointment", self.appointment_id,
+                         f"status {values['status']}")
             messagebox.showinfo("Updated", "Appointment updated successfully.")
             if self.on_close:
                 self.on_close()
             self.window.destroy()
+            if values["status"] == "Cancelled" and self.appt_data.status != "Cancelled":
+                # Offer the freed slot to the waitlist
+                import view_waitlist
+                view_waitlist.offer_cancelled_slots([self.appointment_id], self.user_id)
+        elif booking.conflicts:
+            add_appointment.offer_alternative(self, values["practitioner_id"], booking)
         else:
             messagebox.showerror("Error", "Could not update appointment.")
+
+    def resolve_conflict(self, mine, current):
+        """
+        Another desk saved this appointment after the form was opened.
+        Changes to different fields are merged; if both desks changed the
+        same field, the user keeps theirs or reloads the saved version.
+        """
+        if current is None:
+            edit_conflicts.show_deleted(self.window, "appointment")
+            return
+        merged = edit_conflicts.merge_edit("appointment", self.row_values(self.appt_data),
+                                           mine, self.row_values(current))
+        self.appt_data = current
+        if merged is not None:
+            self.write(merged, current.version)
+        else:
+            self.notes_text.delete("1.0", tk.END)
+            self.populate()
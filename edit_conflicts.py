@@ -0,0 +1,39 @@
+"""
+edit_conflicts.py - Fixit Physio Enhanced System
+What an edit form does when another desk saved the same record first.
+
+The form's save raised database.ConcurrentUpdateError. merge_edit()
+three-way merges the user's values with the saved row: fields only one
+desk changed are combined silently, and for fields both desks changed
+the user keeps their values or discards them. show_deleted() covers the
+record having been deleted meanwhile.
+"""
+
+from tkinter import messagebox
+import database
+
+
+def show_deleted(window, what):
+    """Tells the user the record (e.g. "patient") is gone and closes the form."""
+    messagebox.showerror("Deleted", f"This {what} was deleted at another desk.")
+    window.destroy()
+
+
+def merge_edit(what, base, mine, theirs):
+    """
+    base is what the form loaded, mine what the user entered, theirs the
+    row as now saved (all field dicts). Returns the merged values to save,
+    or None if the user chose to discard theirs for the saved version.
+    """
+    merged, conflicts = database.merge_changes(base, mine, theirs)
+    if not conflicts:
+        return merged
+    details = "\n".join(f"  {field.replace('_', ' ')}: saved \"{theirs[field]}\", "
+                        f"yours \"{mine[field]}\"" for field in conflicts)
+    keep_mine = messagebox.askyesno(
+        "Changed at another desk",
+        f"This {what} was changed at another desk while you were editing:\n\n"
+        f"{details}\n\nYes: save your values (other changes are kept).\n"
+        f"No: discard your values and show the saved {what}."
+    )
+    return merged if keep_mine else None
@@ -0,0 +1,61 @@
+"""
+head_office.py - Fixit Physio Enhanced System
+Cross-site queries for multi-site deployments.
+
+Each query runs the normal database.py function once per site, in
+parallel worker threads, with the thread routed to that site's database
+file. Results are merged into one answer per query.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import database
+
+MAX_WORKERS = 8
+
+
+def fan_out(func, *args, **kwargs):
+    """
+    Calls func(*args, **kwargs) against every tenant database in parallel.
+    Returns {company_code: result}, in company code order.
+    """
+    tenants = sorted(database.load_tenants())
+
+    def run(company_code):
+        with database.use_tenant(company_code):
+            return func(*args, **kwargs)
+
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(tenants)) or 1) as pool:
+        results = pool.map(run, tenants)
+        return dict(zip(tenants, results))
+
+
+def outstanding_by_site():
+    """Returns ([(company_code, outstanding)], grand_total)."""
+    per_site = fan_out(database.get_total_outstanding)
+    return list(per_site.items()), sum(per_site.values())
+
+
+def appointment_counts_by_site(start_date="", end_date="", status=""):
+    """
+    Returns ([(company_code, count)], grand_total) of appointments in the
+    optional date range and status.
+    """
+    def count():
+        appt_filter = database.AppointmentFilter().between(start_date, end_date)
+        if status:
+            appt_filter.status(status)
+        return database.count_appointments(appt_filter)
+
+    per_site = fan_out(count)
+    return list(per_site.items()), sum(per_site.values())
+
+
+def search_patients_all_sites(search_term):
+    """
+    Returns (company_code, patient_id, name, phone, email) rows from every
+    site whose patient name matches, merged and sorted by name.
+    """
+    per_site = fan_out(database.search_patients, search_term)
+    merged = [(code,) + tuple(row) for code, rows in per_site.items() for row in rows]
+    merged.sort(key=lambda row: (row[2].lower(), row[0]))
+    return merged
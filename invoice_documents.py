@@ -0,0 +1,186 @@
+"""
+invoice_documents.py - Fixit Physio Enhanced System
+Renders invoices as HTML/PDF documents, singly or in large batches.
+
+Templates are parsed once at import. Batches stream invoice rows from
+one joined query and hand them to a process pool in chunks, writing each
+document straight to disk (and optionally to a local mail outbox).
+Every file is written atomically, so an interrupted batch can simply be
+run again: invoices whose documents already exist are skipped.
+"""
+
+import html
+import os
+import sqlite3
+from contextlib import closing
+from email.message import EmailMessage
+from string import Template
+import batches
+import database
+import pdf_writer
+
+FORMATS = ("html", "pdf")
+SENDER  = "accounts@fixitphysio.example"
+
+HTML_TEMPLATE = Template("""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Invoice #$invoice_id</title>
+<style>
+body{font-family:Arial;margin:40px} h1{color:#2E75B6}
+table{border-collapse:collapse;width:100%} td,th{border:1px solid #ccc;padding:6px;text-align:left}
+.total{font-size:18px;font-weight:bold} .status{color:$status_colour}
+</style></head><body>
+<h1>FIXIT PHYSIO</h1>
+<h2>Invoice #$invoice_id</h2>
+<p>Date: $invoice_date<br>Status: <span class="status">$status</span></p>
+<p><b>Bill to:</b><br>$patient_name<br>$patient_phone<br>$patient_email</p>
+<table><tr><th>Description</th><th>Appointment</th><th>Amount</th></tr>
+<tr><td>$description</td><td>$appointment</td><td>&pound;$amount</td></tr></table>
+<p class="total">Total due: &pound;$amount_due</p>
+</body></html>
+""")
+
+TEXT_TEMPLATE = Template("""FIXIT PHYSIO
+INVOICE #$invoice_id
+
+Date:    $invoice_date
+Status:  $status
+
+Bill to: $patient_name
+         $patient_phone
+         $patient_email
+
+Description: $description
+Appointment: $appointment
+Amount:      £$amount
+
+TOTAL DUE:   £$amount_due
+""")
+
+QUERY = '''
+    SELECT i.invoice_id, i.created_at, i.amount, i.description, i.status,
+           p.name, p.phone, p.email, a.appointment_date, a.appointment_type
+    FROM invoices i
+    JOIN patients p ON i.patient_id = p.patient_id
+    LEFT JOIN appointments a ON i.appointment_id = a.appointment_id
+'''
+
+
+# ─────────────────────────────────────────────────────────
+# RENDERING
+# ─────────────────────────────────────────────────────────
+
+def _fields(record, escape):
+    (invoice_id, created_at, amount, description, status,
+     name, phone, email, appt_date, appt_type) = record
+    appointment = f"{appt_type} on {appt_date}" if appt_date else "-"
+    return {
+        "invoice_id":    invoice_id,
+        "invoice_date":  (created_at or "")[:10],
+        "status":        escape(status or ""),
+        "status_colour": "#27ae60" if status == "Paid" else "#e74c3c",
+        "patient_name":  escape(name or ""),
+        "patient_phone": escape(phone or ""),
+        "patient_email": escape(email or ""),
+        "description":   escape(description or ""),
+        "appointment":   escape(appointment),
+        "amount":        f"{amount:.2f}",
+        "amount_due":    f"{0 if status == 'Paid' else amount:.2f}",
+    }
+
+
+def render_invoice_html(record):
+    return HTML_TEMPLATE.substitute(_fields(record, html.escape))
+
+
+def render_invoice_pdf(record):
+    text = TEXT_TEMPLATE.substitute(_fields(record, lambda s: s))
+    return pdf_writer.text_pdf(text.splitlines())
+
+
+def build_invoice_email(record, pdf_bytes):
+    email = EmailMessage()
+    email["From"]    = SENDER
+    email["To"]      = record[7] or ""
+    email["Subject"] = f"Fixit Physio invoice #{record[0]}"
+    email.set_content(f"Dear {record[5]},\n\nPlease find your invoice attached.\n\nFixit Physio")
+    email.add_attachment(pdf_bytes, maintype="application", subtype="pdf",
+                         filename=f"invoice_{record[0]}.pdf")
+    return email
+
+
+# ─────────────────────────────────────────────────────────
+# BATCHES
+# ─────────────────────────────────────────────────────────
+
+def _targets(invoice_id, out_dir, formats, mail_dir):
+    paths = [os.path.join(out_dir, f"invoice_{invoice_id}.{fmt}") for fmt in formats]
+    if mail_dir:
+        paths.append(os.path.join(mail_dir, f"invoice_{invoice_id}.eml"))
+    return paths
+
+
+def _render_chunk(records, out_dir, formats, mail_dir):
+    """Worker: renders and writes one chunk. Returns the number of invoices done."""
+    for record in records:
+        pdf_bytes = None
+        if "pdf" in formats or mail_dir:
+            pdf_bytes = render_invoice_pdf(record)
+        if "html" in formats:
+            batches.write_atomic(os.path.join(out_dir, f"invoice_{record[0]}.html"),
+                                 render_invoice_html(record).encode("utf-8"))
+        if "pdf" in formats:
+            batches.write_atomic(os.path.join(out_dir, f"invoice_{record[0]}.pdf"), pdf_bytes)
+        # The mail copy is written last: its presence marks the invoice done
+        if mail_dir:
+            batches.write_atomic(os.path.join(mail_dir, f"invoice_{record[0]}.eml"),
+                                 bytes(build_invoice_email(record, pdf_bytes)))
+    return len(records)
+
+
+def _iter_rows(cursor):
+    """Streams rows from a cursor without loading the whole result."""
+    while True:
+        rows = cursor.fetchmany(batches.CHUNK_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+
+def render_batch(out_dir, status_filter="", invoice_ids=None, formats=FORMATS,
+                 mail_dir=None, processes=None):
+    """
+    Renders every matching invoice into out_dir (and an .eml with the PDF
+    attached into mail_dir, if given). Already-rendered invoices are
+    skipped, so an interrupted batch resumes where it stopped.
+    Returns {"rendered": n, "skipped": n}.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    if mail_dir:
+        os.makedirs(mail_dir, exist_ok=True)
+
+    query, params = QUERY, []
+    clauses = []
+    if status_filter:
+        clauses.append("i.status = ?")
+        params.append(status_filter)
+    if invoice_ids is not None:
+        invoice_ids = list(invoice_ids)
+        clauses.append(f"i.invoice_id IN ({','.join('?' * len(invoice_ids)) or 'NULL'})")
+        params.extend(invoice_ids)
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += " ORDER BY i.invoice_id"
+
+    def is_done(record):
+        return all(os.path.exists(p) for p in _targets(record[0], out_dir, formats, mail_dir))
+
+    try:
+        with closing(database.get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            return batches.render_chunks(batches.pending_chunks(_iter_rows(cursor), is_done),
+                                         _render_chunk, out_dir, formats, mail_dir,
+                                         processes=processes)
+    except sqlite3.Error as e:
+        database.log_error("Render invoices", e)
+        return {"rendered": 0, "skipped": 0}
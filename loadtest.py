@@ -0,0 +1,282 @@
+"""
+loadtest.py - Fixit Physio Enhanced System
+Load generator simulating several reception desks using one database.
+
+Each session is a thread in one of several worker processes, replaying a
+weighted mix of patient searches, bookings, appointment edits, invoice
+status changes and dashboard loads through the real database.py functions.
+Those functions swallow errors, so a failed call is detected through
+database.last_error(); lock errors ("database is locked") are retried with
+backoff up to a limit, the way a desk would try again.
+
+The report gives throughput, latency percentiles per operation, busy
+errors, retries and the calls that still failed, so connection settings
+(busy timeout, journal mode) and retry policies can be compared:
+
+    python cli.py --db loadtest.db load-test --processes 4 --threads 3 \\
+        --seconds 30 --journal-mode wal --busy-timeout 2
+"""
+
+import contextlib
+import os
+import random
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+import database
+import datagen
+
+# Operation -> relative weight in the replayed mix
+DEFAULT_MIX = {
+    "search":         30,
+    "book":           15,
+    "edit":           15,
+    "invoice_status": 10,
+    "dashboard":      30,
+}
+
+SEARCH_TERMS = ["Chen", "Sarah", "John", "Pat", "Smith", "Em", "Khan", "O'N", "Tay", "Ja"]
+RETRY_BASE_SECONDS = 0.02
+
+
+# ─────────────────────────────────────────────────────────
+# OPERATIONS  (each takes a Session and returns nothing)
+# ─────────────────────────────────────────────────────────
+
+def op_search(session):
+    database.search_patients(session.rng.choice(SEARCH_TERMS))
+
+
+def op_book(session):
+    day = date.today() + timedelta(days=session.rng.randint(1, 60))
+    if day.weekday() >= 5:
+        day += timedelta(days=7 - day.weekday())
+    patient = session.random_patient()
+    appt_type = session.rng.choice(database.APPOINTMENT_TYPES)
+    practitioner = session.rng.choice(session.practitioners)
+    booking = database.book_appointment(
+        patient, day.isoformat(),
+        f"{session.rng.choice(database.HOURS)}:{session.rng.choice(database.MINUTES)}",
+        appt_type, "Booked by load test", session.staff_id,
+        database.DEFAULT_DURATION, practitioner, alternatives=1
+    )
+    if booking.alternatives:
+        # Slot taken: the desk books the suggested one instead
+        slot = booking.alternatives[0]
+        database.book_appointment(patient, slot.appointment_date, slot.appointment_time,
+                                  appt_type, "Booked by load test", session.staff_id,
+                                  database.DEFAULT_DURATION, practitioner, alternatives=0)
+
+
+def op_edit(session):
+    appt = database.get_appointment_by_id(session.rng.randint(1, session.max_appointment))
+    if appt is None:
+        return
+    database.update_appointment(appt.appointment_id, appt.patient_id, appt.appointment_date,
+                                appt.appointment_time, appt.appointment_type, appt.status,
+                                f"Edited by {session.staff_id}")
+
+
+def op_invoice_status(session):
+    database.update_invoice_status(session.rng.randint(1, session.max_invoice),
+                                   session.rng.choice(("Paid", "Unpaid")))
+
+
+def op_dashboard(session):
+    """What the main menu loads: outstanding total, patient and appointment counts."""
+    database.get_total_outstanding()
+    database.count_patients()
+    database.count_appointments(database.AppointmentFilter().on_date(date.today().isoformat()))
+    database.get_upcoming_appointments(1)
+
+
+OPERATIONS = {
+    "search":         op_search,
+    "book":           op_book,
+    "edit":           op_edit,
+    "invoice_status": op_invoice_status,
+    "dashboard":      op_dashboard,
+}
+
+
+# ─────────────────────────────────────────────────────────
+# SESSIONS
+# ─────────────────────────────────────────────────────────
+
+class Session:
+    """One simulated desk: a thread issuing operations until the deadline."""
+
+    def __init__(self, number, seed, bounds, settings):
+        self.rng             = random.Random(seed)
+        self.practitioners   = bounds["practitioners"]
+        self.staff_id        = self.practitioners[number % len(self.practitioners)]
+        self.min_patient     = bounds["min_patient"]
+        self.max_patient     = bounds["max_patient"]
+        self.max_appointment = bounds["max_appointment"]
+        self.max_invoice     = bounds["max_invoice"]
+        self.settings        = settings
+        self.stats = {name: {"latencies": [], "ok": 0, "failed": 0, "busy": 0, "retries": 0}
+                      for name in OPERATIONS}
+        self.busy_errors = 0
+
+    def random_patient(self):
+        return self.rng.randint(self.min_patient, self.max_patient)
+
+    def call(self, name):
+        """Runs one operation, retrying lock errors. Records latency and outcome."""
+        stats = self.stats[name]
+        started = time.perf_counter()
+        for attempt in range(self.settings["retries"] + 1):
+            database.clear_last_error()
+            OPERATIONS[name](self)
+            error = database.last_error()
+            if error is None:
+                stats["ok"] += 1
+                break
+            if not database.is_busy_error(error):
+                stats["failed"] += 1
+                break
+            if attempt == self.settings["retries"]:
+                stats["busy"] += 1
+                break
+            stats["retries"] += 1
+            time.sleep(RETRY_BASE_SECONDS * (2 ** attempt) * (0.5 + self.rng.random()))
+        stats["latencies"].append(time.perf_counter() - started)
+
+    def run(self, start_at, deadline):
+        names   = list(self.settings["mix"])
+        weights = [self.settings["mix"][n] for n in names]
+        think   = self.settings["think_ms"] / 1000.0
+        time.sleep(max(0.0, start_at - time.time()))
+        while time.time() < deadline:
+            self.call(self.rng.choices(names, weights)[0])
+            if think:
+                time.sleep(self.rng.expovariate(1 / think))
+        self.busy_errors = database.busy_error_count()
+
+
+def _bounds():
+    """Id ranges and staff the sessions draw from."""
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT MIN(patient_id), MAX(patient_id) FROM patients")
+    min_patient, max_patient = cursor.fetchone()
+    cursor.execute("SELECT COALESCE(MAX(appointment_id), 1) FROM appointments")
+    max_appointment = cursor.fetchone()[0]
+    cursor.execute("SELECT COALESCE(MAX(invoice_id), 1) FROM invoices")
+    max_invoice = cursor.fetchone()[0]
+    conn.close()
+    return {"practitioners": database.get_practitioners() or ["20001"],
+            "min_patient": min_patient or 1, "max_patient": max_patient or 1,
+            "max_appointment": max_appointment, "max_invoice": max_invoice}
+
+
+def _run_process(db_path, process_number, threads, settings, start_at, deadline):
+    """Worker process: runs its sessions on threads and returns their stats."""
+    database.BUSY_TIMEOUT = settings["busy_timeout"]
+    database.JOURNAL_MODE = settings["journal_mode"]
+    database.configure(db_path)
+    bounds = _bounds()
+    sessions = [Session(process_number * threads + i,
+                        settings["seed"] + process_number * 1000 + i, bounds, settings)
+                for i in range(threads)]
+    workers = [threading.Thread(target=s.run, args=(start_at, deadline), daemon=True)
+               for s in sessions]
+    # The database layer prints every error it swallows; under contention
+    # that is thousands of lines, and the counts are reported instead
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    return [(s.stats, s.busy_errors) for s in sessions]
+
+
+# ─────────────────────────────────────────────────────────
+# RUNNING AND REPORTING
+# ─────────────────────────────────────────────────────────
+
+def prepare(db_path, patients=8000, appointments=100000, fresh=False):
+    """Creates and fills the load-test database unless it already exists."""
+    if db_path == database.MEMORY or db_path.startswith("file:"):
+        raise ValueError("The load test needs a database file shared between processes")
+    if fresh:
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+    exists = os.path.exists(db_path)
+    database.configure(db_path)
+    database.initialize_database()
+    if not exists:
+        datagen.generate(patients=patients, appointments=appointments)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_load(db_path, processes=2, threads=4, seconds=30, mix=None, retries=3,
+             think_ms=0, busy_timeout=None, journal_mode=None, seed=1):
+    """
+    Runs processes x threads sessions against db_path for the given time.
+    Returns {"summary": {...}, "operations": [row, ...]}, each row being
+    (operation, calls, ok, busy, failed, retries, p50_ms, p95_ms, p99_ms, max_ms).
+    """
+    settings = {
+        "mix":          mix or DEFAULT_MIX,
+        "retries":      retries,
+        "think_ms":     think_ms,
+        "busy_timeout": database.BUSY_TIMEOUT if busy_timeout is None else busy_timeout,
+        "journal_mode": database.JOURNAL_MODE if journal_mode is None else journal_mode,
+        "seed":         seed,
+    }
+    if settings["journal_mode"]:
+        # Switch modes once up front; workers racing to convert the file
+        # would fail with "database is locked" before the run starts
+        conn = database.connect(db_path)
+        conn.execute(f"PRAGMA journal_mode = {settings['journal_mode']}")
+        conn.close()
+    start_at = time.time() + 1.0 + 0.2 * processes     # let every process get ready
+    deadline = start_at + seconds
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(_run_process, db_path, n, threads, settings, start_at, deadline)
+                   for n in range(processes)]
+        results = [session for future in futures for session in future.result()]
+
+    totals = {name: {"latencies": [], "ok": 0, "failed": 0, "busy": 0, "retries": 0}
+              for name in OPERATIONS}
+    busy_errors = 0
+    for stats, busy in results:
+        busy_errors += busy
+        for name, op in stats.items():
+            for key in ("ok", "failed", "busy", "retries"):
+                totals[name][key] += op[key]
+            totals[name]["latencies"].extend(op["latencies"])
+
+    rows = []
+    for name, op in totals.items():
+        latencies = sorted(op["latencies"])
+        if not latencies:
+            continue
+        rows.append((name, len(latencies), op["ok"], op["busy"], op["failed"], op["retries"],
+                     *(round(percentile(latencies, f) * 1000, 1) for f in (0.5, 0.95, 0.99)),
+                     round(latencies[-1] * 1000, 1)))
+    calls = sum(row[1] for row in rows)
+    summary = {
+        "sessions":      processes * threads,
+        "seconds":       seconds,
+        "journal_mode":  settings["journal_mode"] or "default",
+        "busy_timeout":  settings["busy_timeout"],
+        "retry_limit":   retries,
+        "calls":         calls,
+        "throughput":    round(calls / seconds, 1),
+        "busy_errors":   busy_errors,
+        "retries":       sum(row[5] for row in rows),
+        "gave_up_busy":  sum(row[3] for row in rows),
+        "failed":        sum(row[4] for row in rows),
+    }
+    return {"summary": summary, "operations": rows}
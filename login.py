@@ -6,6 +6,7 @@ Login screen with SHA256 password verification.
 import tkinter as tk
 from tkinter import messagebox
 import database
+import audit
 
 
 class LoginScreen:
@@ -70,11 +71,17 @@ class LoginScreen:
         role = database.authenticate_user(staff_id, password, company_key)
 
         if role:
+            database.set_active_tenant(company_key)
+            audit.set_user(staff_id)
+            audit.record(audit.LOGIN, "user", staff_id)
             self.current_user = staff_id
             self.current_role = role
             self.root.destroy()
             self.open_main_menu()
         else:
+            if company_key in database.load_tenants():
+                with database.use_tenant(company_key):
+                    audit.record(audit.LOGIN_FAILED, "user", staff_id, staff_id=staff_id)
             messagebox.showerror("Login Failed", "Invalid credentials. Please try again.")
             self.password_entry.delete(0, tk.END)
 
@@ -9,9 +9,11 @@ import login
 
 
 def main():
-    # Set up database and sample data
-    database.initialize_database()
-    database.add_sample_data()
+    # Set up every site's database and sample data
+    for company_code in database.load_tenants():
+        with database.use_tenant(company_code):
+            database.initialize_database()
+            database.add_sample_data()
 
     print("\n" + "=" * 50)
     print("  FIXIT PHYSIO - ENHANCED SYSTEM")
@@ -6,6 +6,11 @@ Main dashboard with sidebar navigation.
 import tkinter as tk
 from tkinter import messagebox
 import database
+import change_feed
+import audit
+import background
+import purge
+import maintenance
 
 
 class MainMenu:
@@ -18,6 +23,12 @@ class MainMenu:
         self.user_id   = user_id
         self.user_role = user_role
         self.create_widgets()
+        change_feed.get_watcher().start(self.root)
+        self.maintenance = maintenance.IdleScheduler(self.root)
+        self.maintenance.start()
+        # Resume any patient erasure an earlier session didn't finish
+        if purge.get_pending_patient_ids():
+            background.run_in_background(purge.run_purge, name="purge")
 
     def create_widgets(self):
         # ── Header ──
@@ -26,7 +37,8 @@ class MainMenu:
         header.pack_propagate(False)
         tk.Label(header, text="FIXIT PHYSIO - Clinic Management",
                  font=("Arial", 16, "bold"), bg="#2E75B6", fg="white").pack(side=tk.LEFT, padx=20, pady=15)
-        tk.Label(header, text=f"Role: {self.user_role}  |  ID: {self.user_id}",
+        tk.Label(header, text=f"Site: {database.get_active_tenant()}  |  "
+                              f"Role: {self.user_role}  |  ID: {self.user_id}",
                  font=("Arial", 10), bg="#2E75B6", fg="#cce4f7").pack(side=tk.RIGHT, padx=20)
 
         # ── Body ──
@@ -46,10 +58,14 @@ class MainMenu:
             ("Appointments",    self.open_appointments),
             ("Patients",        self.open_patients),
             ("Billing",         self.open_billing),
+            ("Waitlist",        self.open_waitlist),
         ]
 
         # Admin only
         if self.user_role == "Admin":
+            nav_buttons.append(("Reports", self.open_reports))
+            if len(database.load_tenants()) > 1:
+                nav_buttons.append(("Head Office", self.open_head_office))
             nav_buttons.append(("Staff Management", self.open_staff))
 
         for label, cmd in nav_buttons:
@@ -103,8 +119,8 @@ class MainMenu:
         stats.pack(pady=20)
 
         outstanding = database.get_total_outstanding()
-        patients    = len(database.get_all_patients())
-        today_appts = len(database.get_all_appointments())
+        patients    = database.count_patients()
+        today_appts = database.count_appointments(database.AppointmentFilter())
 
         for label, value in [
             ("Total Patients", patients),
@@ -132,6 +148,21 @@ class MainMenu:
         import billing
         billing.BillingScreen(self.content, self.user_id, self.user_role)
 
+    def open_waitlist(self):
+        self.clear_content()
+        import view_waitlist
+        view_waitlist.WaitlistScreen(self.content, self.user_id, self.user_role)
+
+    def open_reports(self):
+        self.clear_content()
+        import view_reports
+        view_reports.ReportsScreen(self.content, self.user_id, self.user_role)
+
+    def open_head_office(self):
+        self.clear_content()
+        import view_head_office
+        view_head_office.HeadOfficeScreen(self.content, self.user_id, self.user_role)
+
     def open_staff(self):
         self.clear_content()
         import staff_management
@@ -139,6 +170,11 @@ class MainMenu:
 
     def logout(self):
         if messagebox.askyesno("Logout", "Are you sure you want to logout?"):
+            change_feed.get_watcher().close()
+            self.maintenance.stop()
+            audit.record(audit.LOGOUT, "user", self.user_id)
+            audit.shutdown()
+            audit.set_user(None)
             self.root.destroy()
             import login
             root = tk.Tk()
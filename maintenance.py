@@ -0,0 +1,316 @@
+"""
+maintenance.py - Fixit Physio Enhanced System
+Keeps the database file compact and the query planner's statistics fresh.
+
+run_maintenance() runs a fixed list of tasks: PRAGMA optimize (with a
+bounded ANALYZE), incremental vacuum, a passive WAL checkpoint and a
+quick integrity check. Each task gets a time budget enforced by a
+progress handler, so a slow step is interrupted rather than holding the
+database. Every task is logged to maintenance_log with its duration and
+the file size before and after.
+
+Databases created before auto_vacuum was set to INCREMENTAL need one
+full VACUUM to switch over, which rewrites the whole file; that is an
+explicit admin step (convert_to_incremental(), "cli.py maintenance
+--convert-vacuum"), never part of a scheduled run.
+
+Maintenance should run when nobody is working: is_idle() checks the
+change feed for recent writes from any desk, and IdleScheduler (for the
+Tk app) also watches local keyboard and mouse activity.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import database
+
+TASK_BUDGET_SECONDS = 10.0
+ANALYSIS_LIMIT      = 1000     # rows sampled per index by ANALYZE
+VACUUM_PAGES        = 2000     # free pages released per incremental_vacuum
+QUICK_CHECK_ERRORS  = 10
+IDLE_MINUTES        = 10
+MIN_HOURS_BETWEEN   = 20       # scheduled runs at most about once a day
+PROGRESS_OPS        = 10000    # VM steps between deadline checks
+
+_run_lock = threading.Lock()
+
+
+# ─────────────────────────────────────────────────────────
+# HELPERS
+# ─────────────────────────────────────────────────────────
+
+def database_size(conn):
+    """Bytes used by the main database file plus its WAL, if any."""
+    path = database.current_db_path()
+    if not path.startswith("file:") and os.path.exists(path):
+        size = os.path.getsize(path)
+        if os.path.exists(path + "-wal"):
+            size += os.path.getsize(path + "-wal")
+        return size
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size  = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def _set_deadline(conn, seconds):
+    deadline = time.monotonic() + seconds
+    conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, PROGRESS_OPS)
+
+
+# ─────────────────────────────────────────────────────────
+# TASKS  (each returns (outcome, detail))
+# ─────────────────────────────────────────────────────────
+
+def task_optimize(conn):
+    """ANALYZE tables whose statistics are missing or stale, sampling rows."""
+    conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    has_stats = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+    if not has_stats:
+        conn.execute("ANALYZE")
+        return "ok", "initial ANALYZE"
+    # 0x10002: also check tables that were never analyzed
+    conn.execute("PRAGMA optimize(0x10002)")
+    return "ok", "PRAGMA optimize"
+
+
+def task_incremental_vacuum(conn):
+    """Returns free pages to the file system, a bounded number per run."""
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if mode != 2:
+        return "skipped", "auto_vacuum is not incremental (run --convert-vacuum once)"
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if not free:
+        return "skipped", "no free pages"
+    # Each step of the pragma frees one page, but execute() steps a
+    # statement without result columns only once; executescript() runs it
+    # to completion
+    conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES});")
+    left = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return "ok", f"released {free - left} of {free} free pages"
+
+
+def task_wal_checkpoint(conn):
+    """Copies the WAL back into the database without blocking readers or writers."""
+    mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    if mode != "wal":
+        return "skipped", f"journal_mode is {mode}"
+    busy, log_frames, checkpointed = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+    outcome = "ok" if not busy else "interrupted"
+    return outcome, f"{checkpointed} of {log_frames} frames checkpointed"
+
+
+def task_quick_check(conn):
+    rows = [row[0] for row in conn.execute(f"PRAGMA quick_check({QUICK_CHECK_ERRORS})")]
+    if rows == ["ok"]:
+        return "ok", "ok"
+    return "failed", "; ".join(rows)
+
+
+def task_convert_auto_vacuum(conn):
+    """One full VACUUM to switch the file to incremental auto_vacuum."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return "skipped", "auto_vacuum is already incremental"
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    return "ok", f"converted to incremental auto_vacuum, released {free} free pages"
+
+
+TASKS = [
+    ("optimize",           task_optimize),
+    ("incremental_vacuum", task_incremental_vacuum),
+    ("wal_checkpoint",     task_wal_checkpoint),
+    ("quick_check",        task_quick_check),
+]
+
+
+# ─────────────────────────────────────────────────────────
+# RUNNING
+# ─────────────────────────────────────────────────────────
+
+def run_maintenance(tasks=None, budget=TASK_BUDGET_SECONDS):
+    """
+    Runs the named tasks (default: all) and logs each one.
+    Returns a list of (task, outcome, duration_ms, size_before, size_after, detail).
+    """
+    selected = [(name, func) for name, func in TASKS if tasks is None or name in tasks]
+    return _run(selected, budget)
+
+
+def convert_to_incremental():
+    """
+    Switches the database to incremental auto_vacuum with a full VACUUM.
+    Rewrites the whole file and holds it exclusively while it runs, with
+    no time budget, so run it once while nobody is working. Logged like
+    a maintenance run; returns the same result list.
+    """
+    return _run([("convert_auto_vacuum", task_convert_auto_vacuum)], budget=None)
+
+
+def _run(selected, budget):
+    """Runs (name, func) tasks on one connection; budget None means no deadline."""
+    run_id = uuid.uuid4().hex[:12]
+    results = []
+    with _run_lock:
+        try:
+            conn = database.get_connection()
+            conn.isolation_level = None     # PRAGMAs and VACUUM manage their own transactions
+        except sqlite3.Error as e:
+            database.log_error("Maintenance", e)
+            return results
+
+        for name, func in selected:
+            size_before = database_size(conn)
+            started = time.perf_counter()
+            if budget is not None:
+                _set_deadline(conn, budget)
+            try:
+                outcome, detail = func(conn)
+            except sqlite3.OperationalError as e:
+                outcome = "interrupted" if "interrupt" in str(e) else "failed"
+                detail = str(e)
+            except sqlite3.Error as e:
+                outcome, detail = "failed", str(e)
+            finally:
+                conn.set_progress_handler(None, 0)
+            duration_ms = int((time.perf_counter() - started) * 1000)
+            size_after = database_size(conn)
+            results.append((name, outcome, duration_ms, size_before, size_after, detail))
+
+        try:
+            conn.executemany(
+                '''INSERT INTO maintenance_log
+                   (run_id, task, duration_ms, size_before, size_after, outcome, detail)
+                   VALUES (?,?,?,?,?,?,?)''',
+                [(run_id, name, ms, before, after, outcome, detail)
+                 for name, outcome, ms, before, after, detail in results]
+            )
+        except sqlite3.Error as e:
+            database.log_error("Maintenance log", e)
+        conn.close()
+    return results
+
+
+def get_maintenance_log(limit=50):
+    """Returns the most recent maintenance_log rows, newest first."""
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            '''SELECT run_id, task, started_at, duration_ms, size_before, size_after,
+                      outcome, detail
+               FROM maintenance_log ORDER BY log_id DESC LIMIT ?''',
+            (limit,)
+        )
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+    except sqlite3.Error as e:
+        database.log_error("Get maintenance log", e)
+        return []
+
+
+# ─────────────────────────────────────────────────────────
+# IDLE DETECTION
+# ─────────────────────────────────────────────────────────
+
+def minutes_since_last_write():
+    """Minutes since any desk last changed a tracked row (None if never)."""
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            '''SELECT (julianday('now') - julianday(changed_at)) * 1440
+               FROM change_log ORDER BY seq DESC LIMIT 1'''
+        )
+        row = cursor.fetchone()
+        conn.close()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        database.log_error("Idle check", e)
+        return 0.0
+
+
+def hours_since_last_run():
+    """Hours since maintenance last ran (None if never)."""
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT (julianday('now') - julianday(MAX(started_at))) * 24 FROM maintenance_log"
+        )
+        hours = cursor.fetchone()[0]
+        conn.close()
+        return hours
+    except sqlite3.Error as e:
+        database.log_error("Last maintenance check", e)
+        return 0.0
+
+
+def is_idle(idle_minutes=IDLE_MINUTES):
+    """True if no desk has written anything for idle_minutes."""
+    minutes = minutes_since_last_write()
+    return minutes is None or minutes >= idle_minutes
+
+
+def is_due(min_hours=MIN_HOURS_BETWEEN):
+    hours = hours_since_last_run()
+    return hours is None or hours >= min_hours
+
+
+def run_if_idle(idle_minutes=IDLE_MINUTES, min_hours=MIN_HOURS_BETWEEN, **kwargs):
+    """Runs maintenance only when the database is idle and a run is due."""
+    if not is_due(min_hours) or not is_idle(idle_minutes):
+        return None
+    return run_maintenance(**kwargs)
+
+
+class IdleScheduler:
+    """
+    Runs maintenance from the Tk app once the user has been inactive and
+    no other desk has written for idle_minutes, at most every min_hours.
+    The work runs on a background thread.
+    """
+
+    CHECK_MS = 60 * 1000
+
+    def __init__(self, root, idle_minutes=IDLE_MINUTES, min_hours=MIN_HOURS_BETWEEN):
+        self.root          = root
+        self.idle_minutes  = idle_minutes
+        self.min_hours     = min_hours
+        self.last_activity = time.monotonic()
+        self.after_id      = None
+        self.running       = False
+
+    def start(self):
+        for sequence in ("<Any-KeyPress>", "<Any-ButtonPress>", "<Motion>"):
+            self.root.bind_all(sequence, self.touch, add="+")
+        self.after_id = self.root.after(self.CHECK_MS, self.check)
+
+    def stop(self):
+        if self.after_id is not None:
+            try:
+                self.root.after_cancel(self.after_id)
+            except Exception:
+                pass
+        self.after_id = None
+
+    def touch(self, event=None):
+        self.last_activity = time.monotonic()
+
+    def check(self):
+        local_idle = (time.monotonic() - self.last_activity) / 60 >= self.idle_minutes
+        if local_idle and not self.running:
+            self.running = True
+
+            def worker():
+                try:
+                    run_if_idle(self.idle_minutes, self.min_hours)
+                finally:
+                    self.running = False
+
+            threading.Thread(target=worker, name="maintenance", daemon=True).start()
+        self.after_id = self.root.after(self.CHECK_MS, self.check)
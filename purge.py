@@ -0,0 +1,230 @@
+"""
+purge.py - Fixit Physio Enhanced System
+Patient erasure without locking out the other desks.
+
+Deleting a patient row cascades to every appointment and invoice in one
+write transaction. Instead, patients are queued in purge_queue and a
+worker removes their invoices, then their appointments, then the
+patient row itself, a small batch per short BEGIN IMMEDIATE transaction,
+pausing between batches so other writers get the lock. Progress is
+committed with each batch, so an interrupted purge resumes where it
+stopped.
+"""
+
+import sqlite3
+import threading
+import time
+import database
+
+BATCH_SIZE     = 200
+PAUSE_SECONDS  = 0.05       # gap between batches for other writers
+BUSY_RETRIES   = 5
+RETENTION_YEARS = 8         # adult records: 8 years after last contact
+
+_run_lock = threading.Lock()
+
+
+# ─────────────────────────────────────────────────────────
+# QUEUEING
+# ─────────────────────────────────────────────────────────
+
+def enqueue_patients(patient_ids, requested_by=None, reason="Erasure request"):
+    """
+    Queues patients for purging. Returns how many were newly queued or
+    requeued after a failed attempt (0 for patients already pending).
+    """
+    patient_ids = list(patient_ids)
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany(
+            '''INSERT OR IGNORE INTO purge_queue (patient_id, requested_by, reason)
+               VALUES (?,?,?)''',
+            [(pid, requested_by, reason) for pid in patient_ids]
+        )
+        queued = cursor.rowcount
+        # A re-requested purge that failed earlier gets another attempt
+        cursor.executemany(
+            "UPDATE purge_queue SET status = 'Pending' WHERE patient_id = ? AND status = 'Failed'",
+            [(pid,) for pid in patient_ids]
+        )
+        queued += cursor.rowcount
+        conn.commit()
+        conn.close()
+        return queued
+    except sqlite3.Error as e:
+        database.log_error("Queue purge", e)
+        return 0
+
+
+def enqueue_retention_purge(years=RETENTION_YEARS, requested_by=None):
+    """
+    Queues every patient with no appointment, invoice or record change
+    in the last `years` years and no unpaid invoices.
+    Returns the number of patients queued.
+    """
+    cutoff = f"-{int(years)} years"
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            '''INSERT OR IGNORE INTO purge_queue (patient_id, requested_by, reason)
+               SELECT p.patient_id, ?, 'Retention policy'
+               FROM patients p
+               WHERE p.created_date < datetime('now', ?)
+                 AND NOT EXISTS (SELECT 1 FROM appointments a
+                                 WHERE a.patient_id = p.patient_id
+                                   AND a.appointment_date >= date('now', ?))
+                 AND NOT EXISTS (SELECT 1 FROM invoices i
+                                 WHERE i.patient_id = p.patient_id
+                                   AND (i.status = 'Unpaid'
+                                        OR i.created_at >= datetime('now', ?)))''',
+            (requested_by, cutoff, cutoff, cutoff)
+        )
+        queued = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return queued
+    except sqlite3.Error as e:
+        database.log_error("Queue retention purge", e)
+        return 0
+
+
+def get_purge_queue(status=""):
+    """Returns purge_queue rows, oldest request first."""
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        query = '''SELECT patient_id, requested_by, reason, requested_at, status,
+                          invoices_deleted, appointments_deleted, completed_at, last_error
+                   FROM purge_queue'''
+        params = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY requested_at, patient_id"
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+    except sqlite3.Error as e:
+        database.log_error("Get purge queue", e)
+        return []
+
+
+def get_pending_patient_ids():
+    """patient_ids queued for erasure but not yet removed."""
+    return {row[0] for row in get_purge_queue("Pending")}
+
+
+# ─────────────────────────────────────────────────────────
+# PURGING
+# ─────────────────────────────────────────────────────────
+
+def _purge_step(conn, patient_id, batch_size):
+    """
+    Deletes one batch for a patient in its own short transaction.
+    Returns False once the patient row itself has been removed.
+    """
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute(
+            '''DELETE FROM invoices WHERE invoice_id IN
+               (SELECT invoice_id FROM invoices WHERE patient_id = ? LIMIT ?)''',
+            (patient_id, batch_size)
+        )
+        if cursor.rowcount:
+            cursor.execute(
+                "UPDATE purge_queue SET invoices_deleted = invoices_deleted + ? WHERE patient_id = ?",
+                (cursor.rowcount, patient_id)
+            )
+            conn.commit()
+            return True
+
+        # Reminders go with their appointments (ON DELETE CASCADE)
+        cursor.execute(
+            '''DELETE FROM appointments WHERE appointment_id IN
+               (SELECT appointment_id FROM appointments WHERE patient_id = ? LIMIT ?)''',
+            (patient_id, batch_size)
+        )
+        if cursor.rowcount:
+            cursor.execute(
+                '''UPDATE purge_queue SET appointments_deleted = appointments_deleted + ?
+                   WHERE patient_id = ?''',
+                (cursor.rowcount, patient_id)
+            )
+            conn.commit()
+            return True
+
+        cursor.execute("DELETE FROM patients WHERE patient_id = ?", (patient_id,))
+        cursor.execute(
+            '''UPDATE purge_queue SET status = 'Done', completed_at = CURRENT_TIMESTAMP,
+                      last_error = NULL
+               WHERE patient_id = ?''',
+            (patient_id,)
+        )
+        conn.commit()
+        return False
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+
+def _mark_failed(conn, patient_id, error):
+    try:
+        conn.execute(
+            "UPDATE purge_queue SET status = 'Failed', last_error = ? WHERE patient_id = ?",
+            (str(error), patient_id)
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        database.log_error("Purge bookkeeping", e)
+
+
+def run_purge(batch_size=BATCH_SIZE, pause=PAUSE_SECONDS, max_seconds=None):
+    """
+    Works through pending purges, a batch at a time. Stops when the
+    queue is empty or after max_seconds. Returns {"purged", "failed",
+    "batches"}.
+    """
+    totals = {"purged": 0, "failed": 0, "batches": 0}
+    deadline = None if max_seconds is None else time.monotonic() + max_seconds
+    with _run_lock:
+        try:
+            conn = database.get_connection()
+            # Autocommit mode: each batch opens its own BEGIN IMMEDIATE
+            conn.isolation_level = None
+        except sqlite3.Error as e:
+            database.log_error("Purge", e)
+            return totals
+
+        for patient_id in sorted(get_pending_patient_ids()):
+            busy = 0
+            while True:
+                if deadline is not None and time.monotonic() > deadline:
+                    conn.close()
+                    return totals
+                try:
+                    more = _purge_step(conn, patient_id, batch_size)
+                    busy = 0
+                except sqlite3.OperationalError as e:
+                    # Another desk holds the write lock: back off and retry
+                    busy += 1
+                    if "locked" in str(e) and busy <= BUSY_RETRIES:
+                        time.sleep(pause * 2 ** busy)
+                        continue
+                    _mark_failed(conn, patient_id, e)
+                    totals["failed"] += 1
+                    break
+                except sqlite3.Error as e:
+                    _mark_failed(conn, patient_id, e)
+                    totals["failed"] += 1
+                    break
+                totals["batches"] += 1
+                if not more:
+                    totals["purged"] += 1
+                    break
+                time.sleep(pause)
+        conn.close()
+    return totals
@@ -0,0 +1,331 @@
+"""
+querycheck.py - Fixit Physio Enhanced System
+Query-plan regression check for the database layer.
+
+Builds a generated, realistically sized database in memory, calls every
+database.py function that issues SQL, and records each statement through
+the get_connection() trace hook. Every captured statement is run through
+EXPLAIN QUERY PLAN and compared with the plans committed in
+query_plans.json. A plan that newly scans a large table, or newly needs a
+temporary B-tree to sort or group, fails the check and its plan diff is
+printed. After an intended change, refresh the baseline with --update.
+
+    python cli.py plan-check [--update]
+"""
+
+import difflib
+import json
+import os
+import re
+import database
+import datagen
+import records
+import statements
+import waitlist
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "query_plans.json")
+
+# Tables big enough that a full scan on a hot path is a regression
+LARGE_TABLES = {"patients", "appointments", "invoices", "reminders", "change_log",
+                "audit_log", "rollup_daily_appointments", "rollup_daily_revenue"}
+
+# Workload statements whose USE TEMP B-TREE FOR ORDER BY is expected: each
+# sorts only the handful of rows an exact lookup returns. The reason is
+# written into the baseline next to the plan.
+ACCEPTED_SORTS = {
+    "find_appointments:ids": "sorts the few appointments a change-feed refresh asks for by id",
+    "get_patients_by_ids":   "sorts the few patients a change-feed refresh asks for by id",
+    "lookup_email":          "an exact email matches one patient or a household; "
+                             "an index on name would mean scanning every patient",
+    "lookup_phone":          "an exact number or phone-suffix range matches a few patients, "
+                             "sorted under LIMIT",
+    "waitlist.get_waitlist": "the waitlist holds tens of Waiting entries, not a large table",
+}
+
+SKIP_PREFIXES = ("PRAGMA", "BEGIN", "COMMIT", "ROLLBACK", "CREATE", "DROP", "--", "SAVEPOINT",
+                 "RELEASE", "ANALYZE", "VACUUM", "ATTACH", "DETACH")
+
+
+# ─────────────────────────────────────────────────────────
+# WORKLOAD
+# ─────────────────────────────────────────────────────────
+
+def workload():
+    """(name, callable) pairs covering every query database.py issues."""
+    af = database.AppointmentFilter
+    today = database.now_epoch_minutes()
+    return [
+        ("authenticate_user",     lambda: database.authenticate_user("20001", "password",
+                                                                     database.DEFAULT_TENANT)),
+        ("get_all_users",         database.get_all_users),
+        ("iter_users:created",    lambda: list(database.iter_users("created", True))),
+        ("save_sort_preference",  lambda: database.save_sort_preference("20001", "patients",
+                                                                        "dob", True)),
+        ("get_sort_preference",   lambda: database.get_sort_preference("20001", "patients")),
+        ("get_practitioners",     database.get_practitioners),
+        ("add_user",              lambda: database.add_user("39999", "password", "Admin")),
+        ("change_password",       lambda: database.change_password("39999", "password2")),
+        ("delete_user",           lambda: database.delete_user("39999")),
+        ("add_patient",           lambda: database.add_patient("Plan Check", "07700 000000",
+                                                               "plan@example.com", "", "")),
+        ("get_all_patients",      database.get_all_patients),
+        ("iter_patients:keyset",  lambda: list(database.iter_patients(
+                                      "", "dob", True, ("1980-01-01", 500), 201,
+                                      hide_erasing=True))),
+        ("iter_patients:search",  lambda: list(database.iter_patients(
+                                      "Chen", "name", False, ("Chen", 500), 201,
+                                      hide_erasing=True))),
+        ("get_patients_by_ids",   lambda: database.get_patients_by_ids([10, 20, 30])),
+        ("count_patients",        lambda: database.count_patients()),
+        ("get_patient_by_id",     lambda: database.get_patient_by_id(42)),
+        ("update_patient",        lambda: database.update_patient(42, "Plan Check", "", "", "", "")),
+        ("search_patients",       lambda: database.search_patients("Chen")),
+        ("lookup_phone",          lambda: database.lookup_phone("900999")),
+        ("lookup_email",          lambda: database.lookup_email("Plan@Example.com")),
+        ("add_appointment",       lambda: database.add_appointment(42, "2026-03-02", "09:00",
+                                                                   "Treatment", "", "29001")),
+        ("book_appointment",      lambda: database.book_appointment(
+                                      42, "2026-03-03", "09:00", "Treatment", "", "29001",
+                                      practitioner_id="20003")),
+        ("find_free_slots",       lambda: database.find_free_slots("20003", today)),
+        ("get_busy_intervals",    lambda: database.get_busy_intervals(today, today + 20160)),
+        ("book_appointments",     lambda: database.book_appointments([records.PlannedSession(
+                                      42, 1, "20003", "2026-03-05", "09:00", 30,
+                                      "Treatment", None)], "29001")),
+        ("find_appointments:all", lambda: database.find_appointments(af().page(0, 200))),
+        ("find_appointments:status_range",
+         lambda: database.find_appointments(
+             af().status("No Show").between("2025-01-01", "2025-03-31").page(0, 200))),
+        ("find_appointments:practitioner",
+         lambda: database.find_appointments(af().practitioner("20003").page(0, 200))),
+        ("find_appointments:created_by",
+         lambda: database.find_appointments(af().created_by("29001").page(0, 200))),
+        ("find_appointments:ids", lambda: database.find_appointments(af().ids([5, 6, 7]))),
+        ("find_appointments:keyset",
+         lambda: database.find_appointments(
+             af().order_by("type").after(("Treatment", today, 5000), 201))),
+        ("find_appointments:status_keyset",
+         lambda: database.find_appointments(
+             af().status("Scheduled").order_by("start", True).after((today, 5000), 201))),
+        ("find_appointments:by_patient",
+         lambda: database.find_appointments(af().order_by("patient").after(("M", 0, 0, 0), 201))),
+        ("count_appointments",    lambda: database.count_appointments(
+                                      af().between("2025-01-01", "2025-12-31"))),
+        ("get_all_appointments",  lambda: database.get_all_appointments("", "2025-06-02")),
+        ("get_appointment_by_id", lambda: database.get_appointment_by_id(500)),
+        ("update_appointment",    lambda: database.update_appointment(
+                                      500, 42, "2026-03-02", "10:00", "Treatment",
+                                      "Scheduled", "")),
+        ("get_appointments_by_patient", lambda: database.get_appointments_by_patient(42)),
+        ("get_upcoming_appointments",   lambda: database.get_upcoming_appointments(7)),
+        ("get_overdue_scheduled",       database.get_overdue_scheduled),
+        ("get_overlapping_appointments",
+         lambda: database.get_overlapping_appointments(today, today + 30)),
+        ("delete_appointment",    lambda: database.delete_appointment(501)),
+        ("create_invoice",        lambda: database.create_invoice(42, None, 60, "Check", "29001")),
+        ("get_all_invoices",      lambda: database.get_all_invoices("Unpaid")),
+        ("iter_invoices:keyset",  lambda: list(database.iter_invoices(
+                                      "", "amount", False, (60.0, 500), 201))),
+        ("iter_invoices:patient", lambda: list(database.iter_invoices(
+                                      "", "patient", False, ("M", 0, 0), 201))),
+        ("iter_invoices:status",  lambda: list(database.iter_invoices(
+                                      "Unpaid", "date", True, ("2025-06-01", 500), 201))),
+        ("get_invoices_by_ids",   lambda: database.get_invoices_by_ids([1, 2, 3])),
+        ("get_invoices_by_patient", lambda: database.get_invoices_by_patient(42)),
+        ("update_invoice_status", lambda: database.update_invoice_status(1, "Paid")),
+        ("delete_invoice",        lambda: database.delete_invoice(2)),
+        ("get_total_outstanding", database.get_total_outstanding),
+        ("get_latest_change_seq", database.get_latest_change_seq),
+        ("delete_patient",        lambda: database.delete_patient(43)),
+        ("statements.aged_balances", statements.aged_balances),
+        ("statements.aged_debt",     statements.aged_debt),
+        ("statements.iter_statements",
+         lambda: sum(1 for _ in statements.iter_statements("2025-06-01", "2025-06-30"))),
+        ("waitlist.add_entry",    lambda: waitlist.add_entry(44, "Treatment", "135")),
+        ("waitlist.get_waitlist", waitlist.get_waitlist),
+        ("waitlist.propose",      lambda: waitlist.propose([records.OpenSlot(
+                                      "20003", "2026-03-04", "11:00", 30, "Treatment")])),
+        ("waitlist.set_status",   lambda: waitlist.set_status(1, waitlist.REMOVED)),
+    ]
+
+
+# ─────────────────────────────────────────────────────────
+# CAPTURE AND PLANS
+# ─────────────────────────────────────────────────────────
+
+def normalize_sql(sql):
+    """Replaces literals with ? and collapses whitespace, so runs compare equal."""
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"(?<![\w.])-?\d+(?:\.\d+)?", "?", sql)
+    sql = re.sub(r"\?(?:\s*,\s*\?)+", "?,...", sql)
+    return " ".join(sql.split())
+
+
+def build_database(appointments=100000, patients=8000):
+    """Switches to a fresh in-memory database filled with generated data."""
+    database.configure(database.MEMORY)
+    database.initialize_database()
+    datagen.generate(patients=patients, appointments=appointments)
+    conn = database.get_connection()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def capture():
+    """Runs the workload and returns {name: [sql, ...]} in issue order.
+
+    The trace reports statements with their bound values filled in, so each
+    is planned as SQLite saw it and normalised afterwards.
+    """
+    captured = {}
+    current = []
+
+    def trace(sql):
+        current.append(sql)
+
+    database.set_trace_callback(trace)
+    try:
+        for name, func in workload():
+            current.clear()
+            func()
+            captured[name] = [sql for sql in current
+                              if not sql.lstrip().upper().startswith(SKIP_PREFIXES)]
+    finally:
+        database.set_trace_callback(None)
+    return captured
+
+
+def explain(conn, sql):
+    """EXPLAIN QUERY PLAN as indented lines, one per plan node."""
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in conn.execute("EXPLAIN QUERY PLAN " + sql):
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return lines
+
+
+def _aliases(sql):
+    """Maps table aliases (and names) used in FROM/JOIN clauses to tables."""
+    aliases = {}
+    for table, alias in re.findall(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?",
+                                   sql, re.IGNORECASE):
+        aliases[table.lower()] = table.lower()
+        if alias and alias.upper() not in ("WHERE", "ON", "SET", "JOIN", "LEFT", "INNER",
+                                           "ORDER", "GROUP", "LIMIT", "VALUES", "SELECT"):
+            aliases[alias.lower()] = table.lower()
+    return aliases
+
+
+def problems(sql, plan):
+    """Plan lines that scan a large table or build a temp B-tree."""
+    aliases = _aliases(sql)
+    found = []
+    for line in plan:
+        detail = line.strip()
+        match = re.match(r"SCAN (\w+)", detail)
+        if match and aliases.get(match.group(1).lower()) in LARGE_TABLES:
+            found.append(detail)
+        elif "TEMP B-TREE" in detail:
+            found.append(detail)
+    return found
+
+
+def collect_plans(captured):
+    conn = database.get_connection()
+    plans = {}
+    for name, statements in captured.items():
+        entries, seen = [], set()
+        for sql in statements:
+            normalized = normalize_sql(sql)
+            if normalized in seen:
+                continue
+            seen.add(normalized)
+            try:
+                plan = explain(conn, sql)
+            except Exception as e:
+                plan = [f"EXPLAIN failed: {e}"]
+            entry = {"sql": normalized, "plan": plan}
+            if name in ACCEPTED_SORTS and "USE TEMP B-TREE FOR ORDER BY" in plan:
+                entry["accepted"] = ACCEPTED_SORTS[name]
+            entries.append(entry)
+        plans[name] = entries
+    conn.close()
+    return plans
+
+
+# ─────────────────────────────────────────────────────────
+# COMPARISON
+# ─────────────────────────────────────────────────────────
+
+def load_baseline(path=BASELINE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(plans, path=BASELINE_FILE):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(plans, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(plans, baseline):
+    """
+    Returns (failures, report_lines). A failure is a statement whose plan
+    has a large-table scan or temp B-tree its baseline plan didn't have.
+    A statement whose SQL was edited is compared with the baseline
+    statement it replaced (matched by position within the function).
+    """
+    failures = 0
+    report = []
+    for name, entries in plans.items():
+        old_entries = {e["sql"]: e["plan"] for e in baseline.get(name, [])}
+        current = {e["sql"] for e in entries}
+        replaced = [e for e in baseline.get(name, []) if e["sql"] not in current]
+        for entry in entries:
+            sql, plan = entry["sql"], entry["plan"]
+            old_sql = sql
+            if sql not in old_entries and replaced:
+                old_sql = replaced.pop(0)["sql"]
+            old_plan = old_entries.get(old_sql)
+            if old_plan == plan and old_sql == sql:
+                continue
+            new_problems = [p for p in problems(sql, plan)
+                            if p not in problems(old_sql, old_plan or [])]
+            if new_problems:
+                failures += 1
+                status = "FAIL"
+            else:
+                status = "NEW" if old_plan is None else "CHANGED"
+            report.append(f"{status}  {name}")
+            if old_sql != sql and old_plan is not None:
+                report.append(f"      was: {old_sql}")
+            report.append(f"      {sql}")
+            for line in difflib.unified_diff(old_plan or [], plan, "baseline", "current",
+                                             lineterm="", n=5):
+                report.append("      " + line)
+            for problem in new_problems:
+                report.append(f"      !! {problem}")
+        for entry in replaced:
+            report.append(f"GONE  {name}")
+            report.append(f"      {entry['sql']}")
+    return failures, report
+
+
+def run_check(update=False, baseline_path=None, appointments=100000, patients=8000):
+    """
+    Builds the generated database, captures and explains every statement
+    and compares with the baseline (or rewrites it when update=True).
+    Returns (failures, report_lines, statement_count).
+    """
+    baseline_path = baseline_path or BASELINE_FILE
+    build_database(appointments, patients)
+    plans = collect_plans(capture())
+    count = sum(len(entries) for entries in plans.values())
+    if update:
+        save_baseline(plans, baseline_path)
+        return 0, [f"Baseline written to {baseline_path}"], count
+    failures, report = compare(plans, load_baseline(baseline_path))
+    return failures, report, count
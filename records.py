@@ -0,0 +1,103 @@
+"""
+records.py - Fixit Physio Enhanced System
+Typed row records returned by the database layer.
+
+Each record is a namedtuple: fields can be read by name (appt.status)
+while rows still unpack and index like the plain tuples they replace.
+Namedtuples carry no per-instance __dict__, so a record costs the same
+memory as a tuple. factory() turns a record type into a sqlite3 row
+factory, so rows are built once, straight from the cursor.
+"""
+
+from collections import namedtuple
+
+# ── Users ──
+UserRow = namedtuple("UserRow", "id staff_id role created_date")
+
+# ── Patients ──
+PatientRow    = namedtuple("PatientRow", "patient_id name phone email date_of_birth")
+PatientMatch  = namedtuple("PatientMatch", "patient_id name phone email")
+PatientDetail = namedtuple("PatientDetail",
+                           "patient_id name phone email date_of_birth notes created_date version")
+DuplicatePair = namedtuple("DuplicatePair", "patient_id other_id score reasons")
+
+# ── Appointments ──
+AppointmentRow = namedtuple(
+    "AppointmentRow",
+    "appointment_id patient_name appointment_date appointment_time "
+    "appointment_type status notes patient_id"
+)
+AppointmentDetail = namedtuple(
+    "AppointmentDetail",
+    "appointment_id patient_id appointment_date appointment_time appointment_type "
+    "status notes created_by created_at duration_minutes practitioner_id patient_name "
+    "version"
+)
+PatientAppointment = namedtuple(
+    "PatientAppointment",
+    "appointment_id appointment_date appointment_time appointment_type status"
+)
+OverlapRow = namedtuple(
+    "OverlapRow",
+    "appointment_id patient_id appointment_date appointment_time "
+    "duration_minutes appointment_type status"
+)
+Booking  = namedtuple("Booking", "appointment_id conflicts alternatives")
+FreeSlot = namedtuple("FreeSlot", "appointment_date appointment_time")
+
+# ── Waitlist ──
+WaitlistRow = namedtuple(
+    "WaitlistRow",
+    "waitlist_id patient_id patient_name appointment_type practitioner_id preferred_days "
+    "earliest_time latest_time duration_minutes priority added_at notes"
+)
+OpenSlot = namedtuple(
+    "OpenSlot",
+    "practitioner_id appointment_date appointment_time duration_minutes appointment_type"
+)
+
+# ── Treatment plans (auto_scheduler) ──
+TreatmentPlan = namedtuple(
+    "TreatmentPlan",
+    "patient_id appointment_type sessions spacing_days start_date preferred_days "
+    "earliest_time latest_time practitioner_id duration_minutes"
+)
+PlannedSession = namedtuple(
+    "PlannedSession",
+    "patient_id session practitioner_id appointment_date appointment_time "
+    "duration_minutes appointment_type appointment_id"
+)
+UnplacedSession = namedtuple("UnplacedSession",
+                             "patient_id session appointment_type target_date reason")
+
+# ── Invoices ──
+InvoiceRow = namedtuple("InvoiceRow",
+                        "invoice_id patient_name amount description status created_at version "
+                        "patient_id")
+PatientInvoice = namedtuple("PatientInvoice",
+                            "invoice_id amount description status created_at")
+
+# ── Statements and aged debt ──
+AgedBalance = namedtuple(
+    "AgedBalance",
+    "patient_id name phone email current days_31_60 days_61_90 over_90 balance"
+)
+AgedDebt      = namedtuple("AgedDebt", "current days_31_60 days_61_90 over_90 balance debtors")
+StatementLine = namedtuple("StatementLine",
+                           "invoice_id invoice_date description amount status age_days")
+Statement     = namedtuple("Statement",
+                           "patient_id name phone email lines charges balance buckets")
+
+# ── Audit ──
+AuditRow = namedtuple("AuditRow",
+                      "audit_id logged_at staff_id action entity entity_id detail")
+
+
+def factory(record):
+    """Returns a sqlite3 row factory building the given record type."""
+    make = record._make
+
+    def row_factory(cursor, row):
+        return make(row)
+
+    return row_factory
@@ -0,0 +1,293 @@
+"""
+reminders.py - Fixit Physio Enhanced System
+Email/SMS appointment reminders sent 24-48 hours ahead.
+
+queue_due_reminders() selects every Scheduled appointment in the window
+with one range query on the indexed start time and stores a row per
+channel in the reminders table, so the queue survives restarts.
+dispatch_reminders() claims pending rows in batches and sends them
+through pluggable transports on a bounded, rate-limited worker pool
+with retries. Only the dispatcher thread touches the database.
+"""
+
+import os
+import smtplib
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.message import EmailMessage
+import database
+
+WINDOW_START_HOURS = 24
+WINDOW_END_HOURS   = 48
+
+MAX_WORKERS    = 8
+RATE_PER_SEC   = 20          # messages per second across all workers
+MAX_ATTEMPTS   = 3
+RETRY_BACKOFF  = 0.5         # seconds, doubled after each failed attempt
+CLAIM_BATCH    = 500
+
+OUTBOX_DIR = os.environ.get("FIXIT_OUTBOX", "outbox")
+SENDER     = "reminders@fixitphysio.example"
+
+
+# ─────────────────────────────────────────────────────────
+# TRANSPORTS
+# ─────────────────────────────────────────────────────────
+
+class Transport:
+    """Sends one message; raises an exception if delivery failed."""
+
+    def send(self, message):
+        raise NotImplementedError
+
+
+class FileTransport(Transport):
+    """Local stand-in: writes each message to a file in an outbox folder."""
+
+    def __init__(self, outbox_dir=OUTBOX_DIR):
+        self.outbox_dir = outbox_dir
+        os.makedirs(outbox_dir, exist_ok=True)
+
+    def send(self, message):
+        if message["channel"] == "email":
+            path = os.path.join(self.outbox_dir, f"reminder_{message['reminder_id']}.eml")
+            with open(path, "wb") as f:
+                f.write(bytes(build_email(message)))
+        else:
+            path = os.path.join(self.outbox_dir, f"reminder_{message['reminder_id']}.sms.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"To: {message['recipient']}\n\n{message['body']}\n")
+
+
+class SmtpTransport(Transport):
+    """Sends email through an SMTP server (a local relay by default)."""
+
+    def __init__(self, host="localhost", port=25):
+        self.host = host
+        self.port = port
+
+    def send(self, message):
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.send_message(build_email(message))
+
+
+def default_transports():
+    """SMTP for email if FIXIT_SMTP_HOST is set, otherwise the file outbox."""
+    outbox = FileTransport()
+    smtp_host = os.environ.get("FIXIT_SMTP_HOST")
+    email = SmtpTransport(smtp_host) if smtp_host else outbox
+    return {"email": email, "sms": outbox}
+
+
+def build_email(message):
+    email = EmailMessage()
+    email["From"]    = SENDER
+    email["To"]      = message["recipient"]
+    email["Subject"] = message["subject"]
+    email.set_content(message["body"])
+    return email
+
+
+# ─────────────────────────────────────────────────────────
+# RATE LIMITING
+# ─────────────────────────────────────────────────────────
+
+class RateLimiter:
+    """Thread-safe token bucket: acquire() blocks until a send is allowed."""
+
+    def __init__(self, rate_per_sec, burst=None):
+        self.rate   = float(rate_per_sec)
+        self.burst  = burst or max(1, int(rate_per_sec))
+        self.tokens = float(self.burst)
+        self.last   = time.monotonic()
+        self.lock   = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# ─────────────────────────────────────────────────────────
+# QUEUEING
+# ─────────────────────────────────────────────────────────
+
+def queue_due_reminders(now_min=None):
+    """
+    Queues an email and an SMS reminder for every Scheduled appointment
+    starting 24-48 hours from now, skipping ones already queued.
+    Returns the number of reminders added.
+    """
+    now_min = database.now_epoch_minutes() if now_min is None else now_min
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            '''INSERT OR IGNORE INTO reminders (appointment_id, channel, recipient)
+               SELECT a.appointment_id, c.channel,
+                      TRIM(CASE c.channel WHEN 'email' THEN p.email ELSE p.phone END)
+               FROM appointments a
+               JOIN patients p ON a.patient_id = p.patient_id
+               JOIN (SELECT 'email' AS channel UNION ALL SELECT 'sms') c
+               WHERE a.status = 'Scheduled'
+                 AND a.start_min >= ? AND a.start_min < ?
+                 AND COALESCE(TRIM(CASE c.channel WHEN 'email' THEN p.email
+                                                  ELSE p.phone END), '') != ''
+            ''',
+            (now_min + WINDOW_START_HOURS * 60, now_min + WINDOW_END_HOURS * 60)
+        )
+        added = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return added
+    except sqlite3.Error as e:
+        database.log_error("Queue reminders", e)
+        return 0
+
+
+def _claim_batch(cursor):
+    """Marks a batch of pending reminders as Sending and returns their messages."""
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute(
+        '''SELECT r.reminder_id, r.channel, r.recipient, r.attempts,
+                  a.status, a.appointment_date, a.appointment_time,
+                  a.appointment_type, p.name
+           FROM reminders r
+           JOIN appointments a ON r.appointment_id = a.appointment_id
+           JOIN patients p ON a.patient_id = p.patient_id
+           WHERE r.status = 'Pending'
+           ORDER BY r.reminder_id
+           LIMIT ?''',
+        (CLAIM_BATCH,)
+    )
+    rows = cursor.fetchall()
+    cursor.executemany(
+        "UPDATE reminders SET status = 'Sending' WHERE reminder_id = ?",
+        [(row[0],) for row in rows]
+    )
+    cursor.connection.commit()
+
+    messages, skipped = [], []
+    for rid, channel, recipient, attempts, appt_status, appt_date, appt_time, appt_type, name in rows:
+        if appt_status != "Scheduled":
+            skipped.append(rid)
+            continue
+        messages.append({
+            "reminder_id": rid,
+            "channel":     channel,
+            "recipient":   recipient,
+            "attempts":    attempts,
+            "subject":     f"Appointment reminder: {appt_date} at {appt_time}",
+            "body":        (f"Hi {name}, this is a reminder of your {appt_type} appointment "
+                            f"at Fixit Physio on {appt_date} at {appt_time}. "
+                            f"Please call us if you need to rearrange."),
+        })
+    return messages, skipped
+
+
+# ─────────────────────────────────────────────────────────
+# DISPATCH
+# ─────────────────────────────────────────────────────────
+
+def _deliver(message, transport, limiter):
+    """Worker: send with retries. Returns (reminder_id, attempts, error or None)."""
+    attempts = message["attempts"]
+    delay = RETRY_BACKOFF
+    error = None
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            time.sleep(delay)
+            delay *= 2
+        limiter.acquire()
+        attempts += 1
+        try:
+            transport.send(message)
+            return message["reminder_id"], attempts, None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    return message["reminder_id"], attempts, error
+
+
+def _record_results(cursor, results):
+    sent   = [(attempts, rid) for rid, attempts, error in results if error is None]
+    failed = [(attempts, error, rid) for rid, attempts, error in results if error is not None]
+    cursor.executemany(
+        '''UPDATE reminders SET status = 'Sent', attempts = ?, last_error = NULL,
+                  sent_at = CURRENT_TIMESTAMP
+           WHERE reminder_id = ?''',
+        sent
+    )
+    cursor.executemany(
+        "UPDATE reminders SET status = 'Failed', attempts = ?, last_error = ? WHERE reminder_id = ?",
+        failed
+    )
+    cursor.connection.commit()
+    return len(sent), len(failed)
+
+
+def reset_stale_claims():
+    """Returns reminders left in Sending by an interrupted run to Pending."""
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("UPDATE reminders SET status = 'Pending' WHERE status = 'Sending'")
+        count = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return count
+    except sqlite3.Error as e:
+        database.log_error("Reset reminder claims", e)
+        return 0
+
+
+def dispatch_reminders(transports=None, max_workers=MAX_WORKERS, rate_per_sec=RATE_PER_SEC):
+    """
+    Sends every pending reminder. Returns {"sent", "failed", "skipped"} counts.
+    transports maps channel ("email"/"sms") to a Transport.
+    """
+    transports = transports or default_transports()
+    limiter = RateLimiter(rate_per_sec)
+    totals = {"sent": 0, "failed": 0, "skipped": 0}
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while True:
+                messages, skipped = _claim_batch(cursor)
+                if skipped:
+                    cursor.executemany(
+                        "UPDATE reminders SET status = 'Skipped' WHERE reminder_id = ?",
+                        [(rid,) for rid in skipped]
+                    )
+                    conn.commit()
+                    totals["skipped"] += len(skipped)
+                if not messages and not skipped:
+                    break
+                futures = [pool.submit(_deliver, m, transports[m["channel"]], limiter)
+                           for m in messages]
+                results = [f.result() for f in as_completed(futures)]
+                sent, failed = _record_results(cursor, results)
+                totals["sent"]   += sent
+                totals["failed"] += failed
+        conn.close()
+    except sqlite3.Error as e:
+        database.log_error("Dispatch reminders", e)
+    return totals
+
+
+def run_reminders(transports=None):
+    """Resets stale claims, queues due reminders and dispatches them."""
+    reset_stale_claims()
+    queued = queue_due_reminders()
+    totals = dispatch_reminders(transports)
+    totals["queued"] = queued
+    return totals
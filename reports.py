@@ -0,0 +1,196 @@
+"""
+reports.py - Fixit Physio Enhanced System
+Revenue and utilisation reporting backed by daily rollup tables.
+
+Triggers in database.py record every day touched by an appointment or
+invoice change in rollup_dirty_days. refresh_rollups() recomputes only
+those days, so report queries never have to scan the raw tables.
+"""
+
+import sqlite3
+import database
+
+
+# ─────────────────────────────────────────────────────────
+# ROLLUP MAINTENANCE
+# ─────────────────────────────────────────────────────────
+
+def _refresh_appointment_days(cursor):
+    cursor.execute('''
+        DELETE FROM rollup_daily_appointments
+        WHERE day IN (SELECT day FROM rollup_dirty_days WHERE kind = 'appointments')
+    ''')
+    cursor.execute('''
+        INSERT INTO rollup_daily_appointments
+            (day, appointment_type, created_by,
+             booked, scheduled, completed, cancelled, no_show, booked_slots)
+        SELECT a.appointment_date,
+               COALESCE(a.appointment_type, 'General'),
+               COALESCE(a.created_by, ''),
+               COUNT(*),
+               SUM(a.status = 'Scheduled'),
+               SUM(a.status = 'Completed'),
+               SUM(a.status = 'Cancelled'),
+               SUM(a.status = 'No Show'),
+               SUM(CASE WHEN a.status IS NOT 'Cancelled'
+                        THEN (a.duration_minutes + ?1 - 1) / ?1 ELSE 0 END)
+        FROM rollup_dirty_days d
+        JOIN appointments a ON a.appointment_date = d.day
+        WHERE d.kind = 'appointments'
+        GROUP BY 1, 2, 3
+    ''', (database.SLOT_MINUTES,))
+
+
+def _refresh_revenue_days(cursor):
+    cursor.execute('''
+        DELETE FROM rollup_daily_revenue
+        WHERE day IN (SELECT day FROM rollup_dirty_days WHERE kind = 'revenue')
+    ''')
+    # Invoices are bucketed by the date part of created_at; the range join
+    # lets the planner use idx_invoices_created_at for each dirty day.
+    cursor.execute('''
+        INSERT INTO rollup_daily_revenue
+            (day, appointment_type, created_by, invoice_count, invoiced, paid)
+        SELECT d.day,
+               COALESCE(a.appointment_type, 'Unlinked'),
+               COALESCE(i.created_by, ''),
+               COUNT(*),
+               SUM(i.amount),
+               SUM(CASE WHEN i.status = 'Paid' THEN i.amount ELSE 0 END)
+        FROM rollup_dirty_days d
+        JOIN invoices i ON i.created_at >= d.day
+                       AND i.created_at < date(d.day, '+1 day')
+        LEFT JOIN appointments a ON a.appointment_id = i.appointment_id
+        WHERE d.kind = 'revenue'
+        GROUP BY 1, 2, 3
+    ''')
+
+
+def refresh_rollups():
+    """
+    Brings the rollup tables up to date.
+    The first run on an existing database marks every day dirty; after
+    that only days touched since the previous run are recomputed.
+    Returns the number of days refreshed, or None on failure.
+    """
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+
+        cursor.execute("SELECT value FROM report_meta WHERE key = 'rollups_built'")
+        if cursor.fetchone() is None:
+            cursor.execute('''
+                INSERT OR IGNORE INTO rollup_dirty_days
+                SELECT DISTINCT 'appointments', appointment_date FROM appointments
+            ''')
+            cursor.execute('''
+                INSERT OR IGNORE INTO rollup_dirty_days
+                SELECT DISTINCT 'revenue', date(created_at) FROM invoices
+            ''')
+            cursor.execute(
+                "INSERT INTO report_meta (key, value) VALUES ('rollups_built', CURRENT_TIMESTAMP)"
+            )
+
+        cursor.execute("SELECT COUNT(*) FROM rollup_dirty_days")
+        dirty = cursor.fetchone()[0]
+        if dirty:
+            _refresh_appointment_days(cursor)
+            _refresh_revenue_days(cursor)
+            cursor.execute("DELETE FROM rollup_dirty_days")
+
+        conn.commit()
+        conn.close()
+        return dirty
+    except sqlite3.Error as e:
+        database.log_error("Refresh rollups", e)
+        return None
+
+
+# ─────────────────────────────────────────────────────────
+# REPORT QUERIES (read from the rollups only)
+# ─────────────────────────────────────────────────────────
+
+def _run_report(query, params=()):
+    refresh_rollups()
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+    except sqlite3.Error as e:
+        database.log_error("Report", e)
+        return []
+
+
+def revenue_by_month():
+    """Returns (month, invoice_count, invoiced, paid, outstanding) rows."""
+    return _run_report('''
+        SELECT substr(day, 1, 7) AS month, SUM(invoice_count),
+               SUM(invoiced), SUM(paid), SUM(invoiced) - SUM(paid)
+        FROM rollup_daily_revenue
+        GROUP BY month ORDER BY month
+    ''')
+
+
+def revenue_by_type():
+    """Returns (appointment_type, invoice_count, invoiced, paid, outstanding) rows."""
+    return _run_report('''
+        SELECT appointment_type, SUM(invoice_count),
+               SUM(invoiced), SUM(paid), SUM(invoiced) - SUM(paid)
+        FROM rollup_daily_revenue
+        GROUP BY appointment_type ORDER BY SUM(invoiced) DESC
+    ''')
+
+
+def revenue_by_staff():
+    """Returns (created_by, invoice_count, invoiced, paid, outstanding) rows."""
+    return _run_report('''
+        SELECT created_by, SUM(invoice_count),
+               SUM(invoiced), SUM(paid), SUM(invoiced) - SUM(paid)
+        FROM rollup_daily_revenue
+        GROUP BY created_by ORDER BY SUM(invoiced) DESC
+    ''')
+
+
+def utilisation_by_month():
+    """
+    Returns (month, booked, capacity, utilisation, no_show_rate) rows.
+    booked is the quarter-hour slots held by appointments (a 45-minute
+    treatment holds three; cancelled ones hold none) and capacity every
+    slot for each physiotherapist on each day the clinic had bookings.
+    The no-show rate is no-shows over completed plus no-shows.
+    """
+    rows = _run_report('''
+        SELECT substr(day, 1, 7) AS month,
+               COUNT(DISTINCT day),
+               SUM(booked_slots),
+               SUM(completed),
+               SUM(no_show)
+        FROM rollup_daily_appointments
+        GROUP BY month ORDER BY month
+    ''')
+    physios = _count_physiotherapists()
+    results = []
+    for month, open_days, used, completed, no_show in rows:
+        capacity = open_days * database.SLOTS_PER_DAY * physios
+        utilisation = used / capacity if capacity else 0.0
+        attended = completed + no_show
+        no_show_rate = no_show / attended if attended else 0.0
+        results.append((month, used, capacity, utilisation, no_show_rate))
+    return results
+
+
+def _count_physiotherapists():
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM users WHERE role = 'Physiotherapist'")
+        count = cursor.fetchone()[0]
+        conn.close()
+        return max(count, 1)
+    except sqlite3.Error as e:
+        database.log_error("Count physiotherapists", e)
+        return 1
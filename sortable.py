@@ -0,0 +1,114 @@
+"""
+sortable.py - Fixit Physio Enhanced System
+Clickable Treeview column sorting, done by the database.
+
+SortableHeadings ties a list's column headings to the sort keys of a
+database.SortOrder: clicking a heading sorts by it, clicking it again
+reverses the order, and an arrow marks the sorted column. The choice is
+saved per staff member and screen, so a list opens as it was left.
+
+KeysetPager keeps the position in a list paged by keyset: the cursor
+each visited page starts after, so the next page is an index seek past
+the last row shown rather than an OFFSET.
+"""
+
+import database
+
+ARROWS = {False: " ▲", True: " ▼"}
+
+
+class SortableHeadings:
+
+    def __init__(self, tree, headings, order, screen, staff_id, on_change, descending=False):
+        """
+        headings maps column -> sort key of order (a SortOrder); columns
+        left out stay unsortable. on_change() is called after each new
+        sort. descending is the direction of the default sort.
+        """
+        self.tree      = tree
+        self.headings  = headings
+        self.order     = order
+        self.screen    = screen
+        self.staff_id  = staff_id
+        self.on_change = on_change
+        saved = database.get_sort_preference(staff_id, screen)
+        if saved and saved[0] in order:
+            self.key, self.descending = saved
+        else:
+            self.key, self.descending = order.default, descending
+        for column in headings:
+            tree.heading(column, command=lambda c=column: self.click(c))
+        self.show()
+
+    def click(self, column):
+        key = self.headings[column]
+        self.descending = key == self.key and not self.descending
+        self.key = key
+        database.save_sort_preference(self.staff_id, self.screen, self.key, self.descending)
+        self.show()
+        self.on_change()
+
+    def show(self):
+        """Marks the first heading of the sorted column with the direction."""
+        marked = False
+        for column, key in self.headings.items():
+            arrow = ""
+            if key == self.key and not marked:
+                arrow, marked = ARROWS[self.descending], True
+            self.tree.heading(column, text=column + arrow)
+
+    def cursor(self, row):
+        """The keyset cursor of a row in the current sort."""
+        return self.order.cursor(self.key, row)
+
+
+class KeysetPager:
+    """
+    Position in a keyset-paged list. Queries fetch `limit` rows (one more
+    than a page) after the cursor `after`; take() keeps a page of them and
+    notes whether another page follows.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.reset()
+
+    def reset(self):
+        """Back to the first page, as after a new filter or sort."""
+        self.starts   = [None]
+        self.last     = None
+        self.has_next = False
+
+    @property
+    def number(self):
+        """Zero-based page number."""
+        return len(self.starts) - 1
+
+    @property
+    def after(self):
+        return self.starts[-1]
+
+    @property
+    def limit(self):
+        return self.size + 1
+
+    def take(self, rows):
+        """The current page's rows out of a query run with after and limit."""
+        rows = list(rows)
+        self.has_next = len(rows) > self.size
+        rows = rows[:self.size]
+        self.last = rows[-1] if rows else None
+        return rows
+
+    def turn(self, step, cursor):
+        """
+        Moves one page forward (step > 0) or back. cursor(row) gives the
+        keyset cursor of a row. Returns False if there is no such page.
+        """
+        if step > 0 and self.has_next:
+            self.starts.append(cursor(self.last))
+            return True
+        if step < 0 and self.number > 0:
+            self.starts.pop()
+            return True
+        return False
@@ -6,9 +6,15 @@ Admin-only screen to view, add and remove staff accounts.
 import tkinter as tk
 from tkinter import ttk, messagebox
 import database
+import audit
+import change_feed
+import sortable
 
 ROLES = ["Receptionist", "Physiotherapist", "Admin"]
 
+# Sortable columns -> database.USER_SORTS keys
+HEADINGS = {"ID": "id", "Staff ID": "staff_id", "Role": "role", "Created": "created"}
+
 
 class StaffManagement:
 
@@ -17,6 +23,7 @@ class StaffManagement:
         self.user_id = user_id
         self.create_widgets()
         self.refresh()
+        change_feed.subscribe("users", lambda changes: self.refresh(), owner=self.tree)
 
     def create_widgets(self):
         top = tk.Frame(self.parent, bg="#f0f0f0")
@@ -40,6 +47,8 @@ class StaffManagement:
             self.tree.heading(col, text=col)
             self.tree.column(col, width=w)
         self.tree.pack(fill=tk.BOTH, expand=True)
+        self.sorting = sortable.SortableHeadings(self.tree, HEADINGS, database.USER_SORTS,
+                                                 "staff", self.user_id, self.refresh)
 
         bf = tk.Frame(self.parent, bg="#f0f0f0")
         bf.pack(fill=tk.X, padx=15, pady=8)
@@ -51,7 +60,7 @@ class StaffManagement:
     def refresh(self):
         for row in self.tree.get_children():
             self.tree.delete(row)
-        for user in database.get_all_users():
+        for user in database.iter_users(self.sorting.key, self.sorting.descending):
             self.tree.insert("", tk.END, values=user)
 
     def get_selected_staff_id(self):
@@ -70,6 +79,7 @@ class StaffManagement:
             return
         if messagebox.askyesno("Confirm", f"Delete staff member {sid}?"):
             if database.delete_user(sid):
+                audit.record(audit.DELETE, "user", sid)
                 messagebox.showinfo("Deleted", "Staff account removed.")
                 self.refresh()
             else:
@@ -101,6 +111,7 @@ class StaffManagement:
                 messagebox.showerror("Error", "Password must be at least 6 characters.")
                 return
             if database.change_password(sid, pw1.get()):
+                audit.record(audit.UPDATE, "user", sid, "password reset")
                 messagebox.showinfo("Done", "Password updated successfully.")
                 win.destroy()
             else:
@@ -146,6 +157,7 @@ class StaffManagement:
                 messagebox.showerror("Error", "Password must be at least 6 characters.")
                 return
             if database.add_user(sid, pw, role):
+                audit.record(audit.CREATE, "user", sid, role)
                 messagebox.showinfo("Added", f"Staff {sid} added as {role}.")
                 self.refresh()
                 win.destroy()
@@ -0,0 +1,289 @@
+"""
+statements.py - Fixit Physio Enhanced System
+Patient account statements and the aged-debtors report.
+
+Everything is computed set-based: aged_balances() is one grouped query
+over the unpaid invoices, giving every patient's balance split into
+ageing buckets (0-30, 31-60, 61-90 and over 90 days since the invoice
+date); aged_debt() totals the same buckets in one row for the billing
+screen. Statements stream the relevant invoice lines of all patients
+from a single query ordered by patient, so a statement run never issues
+a query per patient.
+
+There is no payments table: an invoice is either Unpaid (owed in full)
+or Paid, so a balance is the sum of a patient's unpaid invoices. Nor is
+there a record of when an invoice was paid, so an as_of date only moves
+the cut-off for invoice dates and the day ages are counted from; paid
+or unpaid is always the invoice's current status. A past as_of is
+therefore not a historical balance: invoices paid since then are left
+out.
+Statement documents are rendered like invoice documents: in chunks,
+through a process pool for large runs, written atomically and skipped
+when already present.
+"""
+
+import html
+import os
+import sqlite3
+from contextlib import closing
+from datetime import date
+from itertools import groupby
+from string import Template
+import batches
+import database
+import records
+import pdf_writer
+
+BUCKET_DAYS  = (30, 60, 90)     # upper bounds of the first three buckets
+BUCKET_NAMES = ("0-30 days", "31-60 days", "61-90 days", "Over 90 days")
+
+FORMATS = ("html", "pdf")
+
+# Invoice age in whole days at the as-of date (?1)
+AGE_SQL = "CAST(julianday(?1) - julianday(date(i.created_at)) AS INTEGER)"
+
+_D1, _D2, _D3 = BUCKET_DAYS
+BUCKET_SUMS = f'''
+    SUM(CASE WHEN age <= {_D1} THEN amount ELSE 0.0 END) AS b0,
+    SUM(CASE WHEN age > {_D1} AND age <= {_D2} THEN amount ELSE 0.0 END) AS b1,
+    SUM(CASE WHEN age > {_D2} AND age <= {_D3} THEN amount ELSE 0.0 END) AS b2,
+    SUM(CASE WHEN age > {_D3} THEN amount ELSE 0.0 END) AS b3,
+    SUM(amount) AS balance
+'''
+
+UNPAID_AS_OF = f'''
+    SELECT i.patient_id, i.amount, {AGE_SQL} AS age
+    FROM invoices i
+    WHERE i.status = 'Unpaid' AND i.created_at < date(?1, '+1 day')
+'''
+
+
+def bucket_of(age_days):
+    """Index into BUCKET_NAMES for an invoice this many days old."""
+    for index, limit in enumerate(BUCKET_DAYS):
+        if age_days <= limit:
+            return index
+    return len(BUCKET_DAYS)
+
+
+# ─────────────────────────────────────────────────────────
+# AGED DEBT
+# ─────────────────────────────────────────────────────────
+
+def aged_balances(as_of=None):
+    """
+    Every patient owing money at as_of ('YYYY-MM-DD', default today), as
+    AgedBalance rows, largest balance first. One grouped query.
+    """
+    as_of = as_of or date.today().isoformat()
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = records.factory(records.AgedBalance)
+        cursor.execute(
+            f'''SELECT u.patient_id, p.name, p.phone, p.email, {BUCKET_SUMS}
+                FROM ({UNPAID_AS_OF}) u
+                JOIN patients p ON u.patient_id = p.patient_id
+                GROUP BY u.patient_id''',
+            (as_of,)
+        )
+        rows = cursor.fetchall()
+        conn.close()
+        # Sorted here: ordering by an aggregate would need a temp B-tree
+        rows.sort(key=lambda row: (-row.balance, row.name))
+        return rows
+    except sqlite3.Error as e:
+        database.log_error("Aged balances", e)
+        return []
+
+
+def aged_debt(as_of=None):
+    """Clinic-wide aged-debt totals at as_of as an AgedDebt (zeros on error)."""
+    as_of = as_of or date.today().isoformat()
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            f'''SELECT SUM(b0), SUM(b1), SUM(b2), SUM(b3), SUM(balance), COUNT(*)
+                FROM (SELECT {BUCKET_SUMS} FROM ({UNPAID_AS_OF}) GROUP BY patient_id)''',
+            (as_of,)
+        )
+        row = cursor.fetchone()
+        conn.close()
+        return records.AgedDebt(*(value or 0 for value in row))
+    except sqlite3.Error as e:
+        database.log_error("Aged debt", e)
+        return records.AgedDebt(0.0, 0.0, 0.0, 0.0, 0.0, 0)
+
+
+# ─────────────────────────────────────────────────────────
+# STATEMENTS
+# ─────────────────────────────────────────────────────────
+
+STATEMENT_LINES = f'''
+    SELECT i.patient_id, p.name, p.phone, p.email,
+           i.invoice_id, date(i.created_at), i.description, i.amount, i.status, {AGE_SQL}
+    FROM invoices i
+    CROSS JOIN patients p ON i.patient_id = p.patient_id
+    WHERE i.created_at < date(?1, '+1 day')
+      AND (i.status = 'Unpaid' OR i.created_at >= ?2)
+'''
+
+
+def _statement(rows, period_start):
+    """Builds one Statement from a patient's consecutive line rows."""
+    patient_id, name, phone, email = rows[0][:4]
+    lines = [records.StatementLine(*row[4:]) for row in rows]
+    buckets = [0.0] * len(BUCKET_NAMES)
+    for line in lines:
+        if line.status == "Unpaid":
+            buckets[bucket_of(line.age_days)] += line.amount
+    charges = sum(line.amount for line in lines if line.invoice_date >= period_start)
+    return records.Statement(patient_id, name, phone, email, lines,
+                             charges, sum(buckets), tuple(buckets))
+
+
+def iter_statements(period_start, as_of=None, patient_ids=None):
+    """
+    Yields a Statement per patient with an unpaid invoice at as_of or an
+    invoice dated from period_start to as_of, from one query. Each
+    statement lists those invoices; charges is the period's invoiced
+    total, balance what is still unpaid. Status is the current one (see
+    the module docstring): as_of only dates the ageing.
+    """
+    as_of = as_of or date.today().isoformat()
+    query, params = STATEMENT_LINES, [as_of, period_start]
+    if patient_ids is not None:
+        patient_ids = list(patient_ids)
+        query += f" AND i.patient_id IN ({','.join('?' * len(patient_ids)) or 'NULL'})"
+        params.extend(patient_ids)
+    # Invoice ids follow creation order, so this walks idx_invoices_patient
+    # (the CROSS JOIN keeps invoices the outer loop, whatever the statistics)
+    query += " ORDER BY i.patient_id, i.invoice_id"
+    # closing(): a caller that stops iterating early still closes it
+    try:
+        with closing(database.get_connection()) as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            fetches = iter(lambda: cursor.fetchmany(database.ITER_BATCH), [])
+            rows = (row for fetched in fetches for row in fetched)
+            for _, patient_rows in groupby(rows, key=lambda row: row[0]):
+                yield _statement(list(patient_rows), period_start)
+    except sqlite3.Error as e:
+        database.log_error("Statements", e)
+
+
+# ─────────────────────────────────────────────────────────
+# RENDERING
+# ─────────────────────────────────────────────────────────
+
+HTML_TEMPLATE = Template("""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Statement - $patient_name</title>
+<style>
+body{font-family:Arial;margin:40px} h1{color:#2E75B6}
+table{border-collapse:collapse;width:100%;margin-bottom:20px}
+td,th{border:1px solid #ccc;padding:6px;text-align:left} .total{font-size:18px;font-weight:bold}
+</style></head><body>
+<h1>FIXIT PHYSIO</h1>
+<h2>Account statement</h2>
+<p>Statement date: $as_of<br>Period: $period_start to $as_of</p>
+<p><b>Account:</b><br>$patient_name<br>$patient_phone<br>$patient_email</p>
+<table><tr><th>Invoice</th><th>Date</th><th>Description</th><th>Status</th><th>Amount</th></tr>
+$line_rows</table>
+<p>Charges this period: &pound;$charges</p>
+<table><tr>$bucket_heads<th>Balance due</th></tr><tr>$bucket_cells<td>&pound;$balance</td></tr></table>
+<p class="total">Balance due: &pound;$balance</p>
+</body></html>
+""")
+
+TEXT_TEMPLATE = Template("""FIXIT PHYSIO
+ACCOUNT STATEMENT
+
+Statement date: $as_of
+Period:         $period_start to $as_of
+
+Account: $patient_name
+         $patient_phone
+         $patient_email
+
+Invoice  Date        Status  Amount      Description
+$line_rows
+
+Charges this period: £$charges
+
+$bucket_text
+
+BALANCE DUE: £$balance
+""")
+
+
+def _fields(statement, period_start, as_of, escape):
+    return {
+        "as_of":         as_of,
+        "period_start":  period_start,
+        "patient_name":  escape(statement.name or ""),
+        "patient_phone": escape(statement.phone or ""),
+        "patient_email": escape(statement.email or ""),
+        "charges":       f"{statement.charges:.2f}",
+        "balance":       f"{statement.balance:.2f}",
+    }
+
+
+def render_statement_html(statement, period_start, as_of):
+    fields = _fields(statement, period_start, as_of, html.escape)
+    fields["line_rows"] = "\n".join(
+        f"<tr><td>#{line.invoice_id}</td><td>{line.invoice_date}</td>"
+        f"<td>{html.escape(line.description or '')}</td><td>{line.status}</td>"
+        f"<td>&pound;{line.amount:.2f}</td></tr>"
+        for line in statement.lines)
+    fields["bucket_heads"] = "".join(f"<th>{name}</th>" for name in BUCKET_NAMES)
+    fields["bucket_cells"] = "".join(f"<td>&pound;{value:.2f}</td>"
+                                     for value in statement.buckets)
+    return HTML_TEMPLATE.substitute(fields)
+
+
+def render_statement_pdf(statement, period_start, as_of):
+    fields = _fields(statement, period_start, as_of, lambda s: s)
+    fields["line_rows"] = "\n".join(
+        f"#{line.invoice_id:<7} {line.invoice_date}  {line.status:<6}  "
+        f"£{line.amount:>9.2f}  {line.description or ''}"
+        for line in statement.lines)
+    fields["bucket_text"] = "\n".join(f"{name:<14} £{value:.2f}"
+                                      for name, value in zip(BUCKET_NAMES, statement.buckets))
+    text = TEXT_TEMPLATE.substitute(fields)
+    return pdf_writer.text_pdf(text.splitlines())
+
+
+def _path(out_dir, statement, as_of, fmt):
+    return os.path.join(out_dir, f"statement_{statement.patient_id}_{as_of}.{fmt}")
+
+
+def _render_chunk(statements, out_dir, period_start, as_of, formats):
+    """Worker: renders and writes one chunk. Returns the number of statements done."""
+    for statement in statements:
+        if "html" in formats:
+            batches.write_atomic(_path(out_dir, statement, as_of, "html"),
+                                 render_statement_html(statement, period_start, as_of).encode("utf-8"))
+        if "pdf" in formats:
+            batches.write_atomic(_path(out_dir, statement, as_of, "pdf"),
+                                 render_statement_pdf(statement, period_start, as_of))
+    return len(statements)
+
+
+def render_statements(out_dir, period_start, as_of=None, formats=FORMATS,
+                      processes=None, min_balance=0.0):
+    """
+    Renders a statement for every patient with a balance over min_balance
+    or charges in the period. Statements already on disk are skipped, so
+    an interrupted run resumes. Returns {"rendered": n, "skipped": n}.
+    """
+    as_of = as_of or date.today().isoformat()
+    os.makedirs(out_dir, exist_ok=True)
+    due = (statement for statement in iter_statements(period_start, as_of)
+           if statement.balance > min_balance or statement.charges)
+
+    def is_done(statement):
+        return all(os.path.exists(_path(out_dir, statement, as_of, fmt)) for fmt in formats)
+
+    return batches.render_chunks(batches.pending_chunks(due, is_done), _render_chunk,
+                                 out_dir, period_start, as_of, formats, processes=processes)
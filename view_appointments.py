@@ -4,8 +4,38 @@ View, search, edit and delete appointments.
 """
 
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
+from datetime import date, datetime
 import database
+import audit
+import background
+import change_feed
+import sortable
+
+PAGE_SIZE = 200
+
+# Sortable columns -> database.AppointmentFilter.SORTS keys
+HEADINGS = {"ID": "id", "Patient": "patient", "Date": "start", "Time": "start",
+            "Type": "type", "Status": "status"}
+
+# The same orders over a row's tree values, for placing live updates.
+# Past the shown columns the values carry notes (v[6]) and patient_id (v[7])
+TREE_ORDER = {
+    "id":      lambda v: int(v[0]),
+    "patient": lambda v: (str(v[1]), int(v[7]), str(v[2]), str(v[3]), int(v[0])),
+    "start":   lambda v: (str(v[2]), str(v[3]), int(v[0])),
+    "type":    lambda v: (str(v[4]), str(v[2]), str(v[3]), int(v[0])),
+    "status":  lambda v: (str(v[5]), str(v[2]), str(v[3]), int(v[0])),
+}
+
+
+def valid_date(text):
+    """True if text is a complete YYYY-MM-DD date."""
+    try:
+        datetime.strptime(text, "%Y-%m-%d")
+        return True
+    except ValueError:
+        return False
 
 
 class ViewAppointments:
@@ -14,8 +44,10 @@ class ViewAppointments:
         self.parent    = parent
         self.user_id   = user_id
         self.user_role = user_role
+        self.pager     = sortable.KeysetPager(PAGE_SIZE)
         self.create_widgets()
         self.refresh()
+        change_feed.subscribe("appointments", self.on_appointments_changed, owner=self.tree)
 
     def create_widgets(self):
         # ── Title bar ──
@@ -32,15 +64,40 @@ class ViewAppointments:
         search_frame.pack(fill=tk.X, padx=15, pady=5)
         tk.Label(search_frame, text="Search patient:", bg="#f0f0f0").pack(side=tk.LEFT)
         self.search_var = tk.StringVar()
-        self.search_var.trace("w", lambda *a: self.refresh())
+        self.search_var.trace("w", lambda *a: self.apply_filters())
         tk.Entry(search_frame, textvariable=self.search_var, width=25).pack(side=tk.LEFT, padx=5)
         tk.Label(search_frame, text="  Filter by date (YYYY-MM-DD):", bg="#f0f0f0").pack(side=tk.LEFT)
         self.date_var = tk.StringVar()
-        self.date_var.trace("w", lambda *a: self.refresh())
+        self.date_var.trace("w", lambda *a: self.apply_filters())
         tk.Entry(search_frame, textvariable=self.date_var, width=12).pack(side=tk.LEFT, padx=5)
         tk.Button(search_frame, text="Clear", command=self.clear_filters,
                   bg="#aaaaaa", fg="white", relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
 
+        # ── Filter bar ──
+        filter_frame = tk.Frame(self.parent, bg="#f0f0f0")
+        filter_frame.pack(fill=tk.X, padx=15, pady=(0, 5))
+        tk.Label(filter_frame, text="Status:", bg="#f0f0f0").pack(side=tk.LEFT)
+        self.status_var = tk.StringVar(value="All")
+        ttk.Combobox(filter_frame, textvariable=self.status_var,
+                     values=["All"] + database.APPOINTMENT_STATUSES,
+                     width=10, state="readonly").pack(side=tk.LEFT, padx=5)
+        tk.Label(filter_frame, text="Type:", bg="#f0f0f0").pack(side=tk.LEFT)
+        self.type_var = tk.StringVar(value="All")
+        ttk.Combobox(filter_frame, textvariable=self.type_var,
+                     values=["All"] + database.APPOINTMENT_TYPES,
+                     width=10, state="readonly").pack(side=tk.LEFT, padx=5)
+        tk.Label(filter_frame, text="Staff ID:", bg="#f0f0f0").pack(side=tk.LEFT)
+        self.staff_var = tk.StringVar()
+        tk.Entry(filter_frame, textvariable=self.staff_var, width=7).pack(side=tk.LEFT, padx=5)
+        tk.Label(filter_frame, text="From:", bg="#f0f0f0").pack(side=tk.LEFT)
+        self.from_var = tk.StringVar()
+        tk.Entry(filter_frame, textvariable=self.from_var, width=11).pack(side=tk.LEFT, padx=5)
+        tk.Label(filter_frame, text="To:", bg="#f0f0f0").pack(side=tk.LEFT)
+        self.to_var = tk.StringVar()
+        tk.Entry(filter_frame, textvariable=self.to_var, width=11).pack(side=tk.LEFT, padx=5)
+        for var in (self.status_var, self.type_var, self.staff_var, self.from_var, self.to_var):
+            var.trace("w", lambda *a: self.apply_filters())
+
         # ── Table ──
         table_frame = tk.Frame(self.parent)
         table_frame.pack(fill=tk.BOTH, expand=True, padx=15, pady=5)
@@ -59,6 +116,10 @@ class ViewAppointments:
             self.tree.column(col, width=w)
 
         self.tree.pack(fill=tk.BOTH, expand=True)
+        self.sorting = sortable.SortableHeadings(self.tree, HEADINGS,
+                                                 database.AppointmentFilter.SORTS,
+                                                 "appointments", self.user_id,
+                                                 self.apply_filters)
 
         # ── Buttons ──
         btn_frame = tk.Frame(self.parent, bg="#f0f0f0")
@@ -70,18 +131,106 @@ class ViewAppointments:
                   bg="#e74c3c", fg="white", width=14, relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
         tk.Button(btn_frame, text="Refresh", command=self.refresh,
                   bg="#27ae60", fg="white", width=10, relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+        tk.Button(btn_frame, text="Day Sheets", command=self.print_day_sheets,
+                  bg="#2E75B6", fg="white", width=10, relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+        self.reminder_btn = tk.Button(btn_frame, text="Send Reminders",
+                                      command=self.send_reminders, bg="#8e44ad", fg="white",
+                                      width=14, relief=tk.FLAT)
+        self.reminder_btn.pack(side=tk.LEFT, padx=5)
+
+        tk.Button(btn_frame, text="Next ▶", command=lambda: self.change_page(1),
+                  width=8, relief=tk.FLAT).pack(side=tk.RIGHT, padx=5)
+        self.page_label = tk.Label(btn_frame, text="", bg="#f0f0f0")
+        self.page_label.pack(side=tk.RIGHT, padx=5)
+        tk.Button(btn_frame, text="◀ Prev", command=lambda: self.change_page(-1),
+                  width=8, relief=tk.FLAT).pack(side=tk.RIGHT, padx=5)
+
+    def build_filter(self):
+        """Builds an AppointmentFilter from the search and filter controls."""
+        f = database.AppointmentFilter()
+        f.patient_name(self.search_var.get())
+        if valid_date(self.date_var.get()):
+            f.on_date(self.date_var.get())
+        if self.status_var.get() != "All":
+            f.status(self.status_var.get())
+        if self.type_var.get() != "All":
+            f.appointment_type(self.type_var.get())
+        f.created_by(self.staff_var.get().strip())
+        f.between(self.from_var.get() if valid_date(self.from_var.get()) else "",
+                  self.to_var.get() if valid_date(self.to_var.get()) else "")
+        return f
+
+    def apply_filters(self):
+        # Skip the traces fired while the widgets are still being built
+        if not hasattr(self, "page_label"):
+            return
+        self.pager.reset()
+        self.refresh()
+
+    def change_page(self, step):
+        if self.pager.turn(step, self.sorting.cursor):
+            self.refresh()
 
     def refresh(self):
         for row in self.tree.get_children():
             self.tree.delete(row)
-        search = self.search_var.get() if hasattr(self, "search_var") else ""
-        date   = self.date_var.get()   if hasattr(self, "date_var")   else ""
-        for appt in database.get_all_appointments(search, date):
-            self.tree.insert("", tk.END, values=appt, tags=(appt[0],))
+        appt_filter = self.build_filter()
+        total = database.count_appointments(appt_filter)
+        appt_filter.order_by(self.sorting.key, self.sorting.descending)
+        appt_filter.after(self.pager.after, self.pager.limit)
+        for appt in self.pager.take(database.iter_appointments(appt_filter)):
+            self.tree.insert("", tk.END, iid=str(appt.appointment_id), values=appt,
+                             tags=(appt.appointment_id,))
+        pages = max((total - 1) // PAGE_SIZE + 1, 1)
+        self.page_label.config(text=f"Page {self.pager.number + 1} of {pages}  ({total} total)")
+
+    def on_appointments_changed(self, changes):
+        """Updates only the appointments changed at other workstations."""
+        if changes is None:
+            self.refresh()
+            return
+        rows = database.find_appointments(self.build_filter().ids(changes))
+        change_feed.apply_to_tree(self.tree, changes, rows,
+                                  sort_key=TREE_ORDER[self.sorting.key],
+                                  reverse=self.sorting.descending,
+                                  first_page=self.pager.number == 0,
+                                  last_page=not self.pager.has_next)
 
     def clear_filters(self):
         self.search_var.set("")
         self.date_var.set("")
+        self.status_var.set("All")
+        self.type_var.set("All")
+        self.staff_var.set("")
+        self.from_var.set("")
+        self.to_var.set("")
+
+    def print_day_sheets(self):
+        """Writes every practitioner's sheet for the filtered date (or today)."""
+        day = self.date_var.get()
+        if not valid_date(day):
+            day = date.today().strftime("%Y-%m-%d")
+        out_dir = filedialog.askdirectory(title=f"Save day sheets for {day}")
+        if not out_dir:
+            return
+        import day_sheets
+        written = day_sheets.write_day_sheets(day, out_dir)
+        messagebox.showinfo("Day Sheets", f"{len(written)} files written for {day}.")
+
+    def send_reminders(self):
+        """Queues and sends 24-48h reminders on a background thread."""
+        import reminders
+        self.reminder_btn.config(state=tk.DISABLED, text="Sending...")
+
+        def done(totals):
+            self.reminder_btn.config(state=tk.NORMAL, text="Send Reminders")
+            messagebox.showinfo(
+                "Reminders",
+                f"Queued {totals['queued']}, sent {totals['sent']}, "
+                f"failed {totals['failed']}, skipped {totals['skipped']}.")
+
+        background.run_for_screen(self.parent, reminders.run_reminders,
+                                  on_done=done, name="reminders")
 
     def open_add(self):
         import add_appointment
@@ -110,6 +259,7 @@ class ViewAppointments:
         if messagebox.askyesno("Confirm Delete",
                                f"Delete appointment for {pat_name}?"):
             if database.delete_appointment(appt_id):
+                audit.record(audit.DELETE, "appointment", appt_id, pat_name)
                 messagebox.showinfo("Deleted", "Appointment removed.")
                 self.refresh()
             else:
@@ -0,0 +1,83 @@
+"""
+view_head_office.py - Fixit Physio Enhanced System
+Head-office overview across every configured site.
+"""
+
+import tkinter as tk
+from tkinter import ttk
+import head_office
+
+
+class HeadOfficeScreen:
+
+    def __init__(self, parent, user_id, user_role):
+        self.parent    = parent
+        self.user_id   = user_id
+        self.user_role = user_role
+        self.create_widgets()
+        self.refresh()
+
+    def create_widgets(self):
+        # Title bar
+        top = tk.Frame(self.parent, bg="#f0f0f0")
+        top.pack(fill=tk.X, padx=15, pady=(15, 5))
+        tk.Label(top, text="Head Office - All Sites", font=("Arial", 16, "bold"),
+                 bg="#f0f0f0").pack(side=tk.LEFT)
+        tk.Button(top, text="Refresh", bg="#27ae60", fg="white",
+                  command=self.refresh, font=("Arial", 10, "bold"),
+                  relief=tk.FLAT, padx=10).pack(side=tk.RIGHT)
+
+        # Per-site totals
+        tf = tk.Frame(self.parent)
+        tf.pack(fill=tk.X, padx=15, pady=5)
+        cols = ("Site", "Outstanding (£)", "Appointments")
+        self.site_tree = ttk.Treeview(tf, columns=cols, show="headings", height=5)
+        for col, w in zip(cols, [120, 150, 120]):
+            self.site_tree.heading(col, text=col)
+            self.site_tree.column(col, width=w)
+        self.site_tree.pack(fill=tk.X)
+        self.total_label = tk.Label(self.parent, text="", font=("Arial", 11, "bold"),
+                                    bg="#f0f0f0")
+        self.total_label.pack(anchor="e", padx=15)
+
+        # Patient search across sites
+        sf = tk.Frame(self.parent, bg="#f0f0f0")
+        sf.pack(fill=tk.X, padx=15, pady=5)
+        tk.Label(sf, text="Search patients (all sites):", bg="#f0f0f0").pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        entry = tk.Entry(sf, textvariable=self.search_var, width=25)
+        entry.pack(side=tk.LEFT, padx=5)
+        entry.bind("<Return>", lambda e: self.search())
+        tk.Button(sf, text="Search", command=self.search,
+                  bg="#2E75B6", fg="white", relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+
+        pf = tk.Frame(self.parent)
+        pf.pack(fill=tk.BOTH, expand=True, padx=15, pady=5)
+        sb = tk.Scrollbar(pf)
+        sb.pack(side=tk.RIGHT, fill=tk.Y)
+        cols = ("Site", "ID", "Name", "Phone", "Email")
+        self.patient_tree = ttk.Treeview(pf, columns=cols, show="headings",
+                                         yscrollcommand=sb.set)
+        sb.config(command=self.patient_tree.yview)
+        for col, w in zip(cols, [60, 40, 160, 110, 180]):
+            self.patient_tree.heading(col, text=col)
+            self.patient_tree.column(col, width=w)
+        self.patient_tree.pack(fill=tk.BOTH, expand=True)
+
+    def refresh(self):
+        self.site_tree.delete(*self.site_tree.get_children())
+        outstanding, total_outstanding = head_office.outstanding_by_site()
+        counts, total_count = head_office.appointment_counts_by_site()
+        counts = dict(counts)
+        for site, amount in outstanding:
+            self.site_tree.insert("", tk.END, values=(site, f"£{amount:.2f}", counts.get(site, 0)))
+        self.total_label.config(
+            text=f"All sites: £{total_outstanding:.2f} outstanding, {total_count} appointments")
+
+    def search(self):
+        self.patient_tree.delete(*self.patient_tree.get_children())
+        term = self.search_var.get().strip()
+        if not term:
+            return
+        for row in head_office.search_patients_all_sites(term):
+            self.patient_tree.insert("", tk.END, values=row)
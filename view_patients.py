@@ -6,6 +6,26 @@ View, add, edit and delete patients.
 import tkinter as tk
 from tkinter import ttk, messagebox
 import database
+import audit
+import background
+import edit_conflicts
+import purge
+import change_feed
+import sortable
+
+PAGE_SIZE = 200
+
+# Sortable columns -> database.PATIENT_SORTS keys
+HEADINGS = {"ID": "id", "Name": "name", "Phone": "phone", "Email": "email", "DOB": "dob"}
+
+# The same orders over a row's tree values, for placing live updates
+TREE_ORDER = {
+    "id":    lambda v: int(v[0]),
+    "name":  lambda v: (str(v[1]), int(v[0])),
+    "phone": lambda v: (str(v[2]), int(v[0])),
+    "email": lambda v: (str(v[3]), int(v[0])),
+    "dob":   lambda v: (str(v[4]), int(v[0])),
+}
 
 
 class ViewPatients:
@@ -14,8 +34,10 @@ class ViewPatients:
         self.parent    = parent
         self.user_id   = user_id
         self.user_role = user_role
+        self.pager     = sortable.KeysetPager(PAGE_SIZE)
         self.create_widgets()
         self.refresh()
+        change_feed.subscribe("patients", self.on_patients_changed, owner=self.tree)
 
     def create_widgets(self):
         # Title bar
@@ -30,9 +52,9 @@ class ViewPatients:
         # Search
         sf = tk.Frame(self.parent, bg="#f0f0f0")
         sf.pack(fill=tk.X, padx=15, pady=5)
-        tk.Label(sf, text="Search:", bg="#f0f0f0").pack(side=tk.LEFT)
+        tk.Label(sf, text="Search name, phone or email:", bg="#f0f0f0").pack(side=tk.LEFT)
         self.search_var = tk.StringVar()
-        self.search_var.trace("w", lambda *a: self.refresh())
+        self.search_var.trace("w", lambda *a: self.first_page())
         tk.Entry(sf, textvariable=self.search_var, width=30).pack(side=tk.LEFT, padx=5)
 
         # Table
@@ -51,6 +73,8 @@ class ViewPatients:
             self.tree.heading(col, text=col)
             self.tree.column(col, width=w)
         self.tree.pack(fill=tk.BOTH, expand=True)
+        self.sorting = sortable.SortableHeadings(self.tree, HEADINGS, database.PATIENT_SORTS,
+                                                 "patients", self.user_id, self.first_page)
 
         # Buttons
         bf = tk.Frame(self.parent, bg="#f0f0f0")
@@ -62,17 +86,64 @@ class ViewPatients:
         tk.Button(bf, text="Delete", command=self.delete_selected,
                   bg="#e74c3c", fg="white", width=10, relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
 
+        tk.Button(bf, text="Next ▶", command=lambda: self.change_page(1),
+                  width=8, relief=tk.FLAT).pack(side=tk.RIGHT, padx=5)
+        self.page_label = tk.Label(bf, text="", bg="#f0f0f0")
+        self.page_label.pack(side=tk.RIGHT, padx=5)
+        tk.Button(bf, text="◀ Prev", command=lambda: self.change_page(-1),
+                  width=8, relief=tk.FLAT).pack(side=tk.RIGHT, padx=5)
+
+    def first_page(self):
+        # Skip the traces fired while the widgets are still being built
+        if not hasattr(self, "page_label"):
+            return
+        self.pager.reset()
+        self.refresh()
+
+    def change_page(self, step):
+        if self.pager.turn(step, self.sorting.cursor):
+            self.refresh()
+
     def refresh(self):
         for row in self.tree.get_children():
             self.tree.delete(row)
-        term = self.search_var.get() if hasattr(self, "search_var") else ""
-        if term:
-            patients = database.search_patients(term)
-            for p in patients:
-                self.tree.insert("", tk.END, values=p)
+        term = self.search_var.get()
+        if term and database.search_kind(term) != "name":
+            # Phone numbers and email addresses go to the indexed contact
+            # lookup, which finds a handful of rows: one page
+            self.pager.reset()
+            erasing = purge.get_pending_patient_ids()
+            patients = [p for p in database.find_patients(term) if p.patient_id not in erasing]
         else:
-            for p in database.get_all_patients():
-                self.tree.insert("", tk.END, values=p)
+            # Patients queued for erasure are left out by the query, so
+            # pages stay full and the cursor is the last row shown
+            patients = self.pager.take(database.iter_patients(
+                term, self.sorting.key, self.sorting.descending,
+                self.pager.after, self.pager.limit, hide_erasing=True))
+        for p in patients:
+            self.tree.insert("", tk.END, iid=str(p.patient_id), values=p)
+        self.page_label.config(text=f"Page {self.pager.number + 1}")
+
+    def on_patients_changed(self, changes):
+        """Updates only the patients changed at other workstations."""
+        if changes is None:
+            self.refresh()
+            return
+        rows = database.get_patients_by_ids(changes)
+        term = self.search_var.get().lower()
+        if term and database.search_kind(term) != "name":
+            # A contact lookup lists a handful of rows: just run it again
+            self.refresh()
+            return
+        # Match iter_patients(): name filter, patients queued for erasure hidden
+        erasing = purge.get_pending_patient_ids()
+        rows = [row for row in rows
+                if row.patient_id not in erasing and (not term or term in row.name.lower())]
+        change_feed.apply_to_tree(self.tree, changes, rows,
+                                  sort_key=TREE_ORDER[self.sorting.key],
+                                  reverse=self.sorting.descending,
+                                  first_page=self.pager.number == 0,
+                                  last_page=not self.pager.has_next)
 
     def get_selected_id(self):
         sel = self.tree.selection()
@@ -98,6 +169,7 @@ class ViewPatients:
         if not pid:
             return
         appts = database.get_appointments_by_patient(pid)
+        audit.record(audit.VIEW, "patient", pid, "appointment history")
         win = tk.Toplevel()
         win.title("Patient Appointments")
         win.geometry("500x300")
@@ -116,11 +188,25 @@ class ViewPatients:
         if not pid:
             return
         name = self.tree.item(self.tree.selection()[0])["values"][1]
+        if pid in purge.get_pending_patient_ids():
+            # Make sure the worker is running (e.g. after an interrupted session)
+            background.run_in_background(purge.run_purge, name="purge")
+            messagebox.showinfo("Already deleting",
+                                f"{name} is already queued for deletion and is being removed.")
+            return
         if messagebox.askyesno("Delete Patient",
                                f"Delete {name} and all their appointments?\nThis cannot be undone."):
-            if database.delete_patient(pid):
-                messagebox.showinfo("Deleted", f"{name} has been removed.")
+            # Erased in the background in small batches, so other desks
+            # aren't locked out while a long history is removed
+            if purge.enqueue_patients([pid], requested_by=self.user_id):
+                audit.record(audit.DELETE, "patient", pid, name)
+                background.run_in_background(purge.run_purge, name="purge")
+                messagebox.showinfo("Deleted", f"{name} is being removed.")
                 self.refresh()
+            elif pid in purge.get_pending_patient_ids():
+                # Queued from another desk since the check above
+                messagebox.showinfo("Already deleting",
+                                    f"{name} is already queued for deletion and is being removed.")
             else:
                 messagebox.showerror("Error", "Could not delete patient.")
 
@@ -128,11 +214,20 @@ class ViewPatients:
 class PatientForm:
     """Shared form for adding and editing patients."""
 
+    # Outcomes of update_existing()
+    SAVED     = "saved"
+    FAILED    = "failed"      # the database update failed
+    ABANDONED = "abandoned"   # deleted at another desk, or the saved details reloaded
+
+    # Fields the form edits, in entry order
+    FIELDS = ("name", "phone", "email", "date_of_birth", "notes")
+
     def __init__(self, window, user_id, patient_id=None, on_close=None):
         self.window     = window
         self.user_id    = user_id
         self.patient_id = patient_id
         self.on_close   = on_close
+        self.data       = None
         self.window.title("Edit Patient" if patient_id else "Add Patient")
         self.window.geometry("400x400")
         self.window.resizable(False, False)
@@ -170,32 +265,77 @@ class PatientForm:
         data = database.get_patient_by_id(self.patient_id)
         if not data:
             return
-        # data: patient_id, name, phone, email, dob, notes, created_date
-        vals = [data[1], data[2], data[3], data[4], data[5]]
-        for widget, val in zip(self.entries, vals):
+        audit.record(audit.VIEW, "patient", self.patient_id)
+        self.data = data
+        self.fill(self.row_values(data))
+
+    def fill(self, values):
+        for widget, field in zip(self.entries, self.FIELDS):
             if isinstance(widget, tk.Text):
-                widget.insert("1.0", val or "")
+                widget.delete("1.0", tk.END)
+                widget.insert("1.0", values[field])
             else:
-                widget.insert(0, val or "")
+                widget.delete(0, tk.END)
+                widget.insert(0, values[field])
+
+    def row_values(self, data):
+        return {field: getattr(data, field) or "" for field in self.FIELDS}
+
+    def form_values(self):
+        values = {field: widget.get().strip() for field, widget in zip(self.FIELDS, self.entries)
+                  if not isinstance(widget, tk.Text)}
+        values["notes"] = self.entries[4].get("1.0", tk.END).strip()
+        return values
+
+    def update_existing(self, values, version):
+        """
+        Saves an edit made from row version `version`. If another desk saved
+        the patient meanwhile, non-overlapping changes are merged; for
+        fields both desks changed, the user keeps theirs or reloads.
+        Returns SAVED, FAILED if the database update failed, or ABANDONED
+        if the patient was deleted or the saved details were reloaded.
+        """
+        try:
+            if database.update_patient(self.patient_id, values["name"], values["phone"],
+                                       values["email"], values["date_of_birth"],
+                                       values["notes"], expected_version=version):
+                return self.SAVED
+            return self.FAILED
+        except database.ConcurrentUpdateError as e:
+            current = e.current
+        if current is None:
+            edit_conflicts.show_deleted(self.window, "patient")
+            return self.ABANDONED
+        base, theirs = self.row_values(self.data), self.row_values(current)
+        merged = edit_conflicts.merge_edit("patient", base, values, theirs)
+        self.data = current
+        if merged is None:
+            self.fill(theirs)
+            return self.ABANDONED
+        return self.update_existing(merged, current.version)
 
     def save(self):
-        name  = self.entries[0].get().strip()
-        phone = self.entries[1].get().strip()
-        email = self.entries[2].get().strip()
-        dob   = self.entries[3].get().strip()
-        notes = self.entries[4].get("1.0", tk.END).strip()
+        values = self.form_values()
+        name, phone, email, dob, notes = (values[field] for field in self.FIELDS)
 
         if not name:
             messagebox.showerror("Error", "Patient name is required.")
             return
 
         if self.patient_id:
-            success = database.update_patient(self.patient_id, name, phone, email, dob, notes)
+            outcome = self.update_existing(values, self.data.version if self.data else None)
+            if outcome == self.ABANDONED:
+                return
+            success = outcome == self.SAVED
             msg = "Patient updated successfully."
+            if success:
+                audit.record(audit.UPDATE, "patient", self.patient_id)
         else:
             result = database.add_patient(name, phone, email, dob, notes)
             success = result is not None
             msg = "Patient added successfully."
+            if success:
+                audit.record(audit.CREATE, "patient", result)
 
         if success:
             messagebox.showinfo("Saved", msg)
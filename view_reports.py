@@ -0,0 +1,100 @@
+"""
+view_reports.py - Fixit Physio Enhanced System
+Management reports: revenue and booking utilisation.
+"""
+
+import os
+import tkinter as tk
+from tkinter import ttk, filedialog, messagebox
+import reports
+
+MONEY_COLS = ("Invoices", "Invoiced (£)", "Paid (£)", "Outstanding (£)")
+
+# report name -> (column headings, query function)
+REPORTS = {
+    "Revenue by Month":     (("Month",) + MONEY_COLS, reports.revenue_by_month),
+    "Revenue by Type":      (("Type",) + MONEY_COLS, reports.revenue_by_type),
+    "Revenue by Staff":     (("Staff ID",) + MONEY_COLS, reports.revenue_by_staff),
+    "Utilisation by Month": (("Month", "Booked", "Capacity", "Utilisation", "No-show Rate"),
+                             reports.utilisation_by_month),
+}
+
+
+class ReportsScreen:
+
+    def __init__(self, parent, user_id, user_role):
+        self.parent    = parent
+        self.user_id   = user_id
+        self.user_role = user_role
+        self.create_widgets()
+        self.refresh()
+
+    def create_widgets(self):
+        # Title bar
+        top = tk.Frame(self.parent, bg="#f0f0f0")
+        top.pack(fill=tk.X, padx=15, pady=(15, 5))
+        tk.Label(top, text="Reports", font=("Arial", 16, "bold"),
+                 bg="#f0f0f0").pack(side=tk.LEFT)
+        tk.Button(top, text="Refresh", bg="#27ae60", fg="white",
+                  command=self.refresh, font=("Arial", 10, "bold"),
+                  relief=tk.FLAT, padx=10).pack(side=tk.RIGHT)
+        tk.Button(top, text="Export Heat Map", bg="#2E75B6", fg="white",
+                  command=self.export_heat_map, font=("Arial", 10, "bold"),
+                  relief=tk.FLAT, padx=10).pack(side=tk.RIGHT, padx=5)
+
+        # Report chooser
+        rf = tk.Frame(self.parent, bg="#f0f0f0")
+        rf.pack(fill=tk.X, padx=15, pady=5)
+        tk.Label(rf, text="Report:", bg="#f0f0f0").pack(side=tk.LEFT)
+        self.report_var = tk.StringVar(value="Revenue by Month")
+        cb = ttk.Combobox(rf, textvariable=self.report_var, values=list(REPORTS),
+                          width=24, state="readonly")
+        cb.pack(side=tk.LEFT, padx=5)
+        cb.bind("<<ComboboxSelected>>", lambda e: self.refresh())
+
+        # Table
+        tf = tk.Frame(self.parent)
+        tf.pack(fill=tk.BOTH, expand=True, padx=15, pady=5)
+        sb = tk.Scrollbar(tf)
+        sb.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree = ttk.Treeview(tf, show="headings", yscrollcommand=sb.set)
+        sb.config(command=self.tree.yview)
+        self.tree.pack(fill=tk.BOTH, expand=True)
+
+    def refresh(self):
+        cols, query = REPORTS[self.report_var.get()]
+        self.tree.delete(*self.tree.get_children())
+        self.tree["columns"] = cols
+        for col in cols:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=110)
+
+        for row in query():
+            self.tree.insert("", tk.END, values=self.format_row(row))
+
+    def format_row(self, row):
+        if self.report_var.get() == "Utilisation by Month":
+            month, booked, capacity, utilisation, no_show_rate = row
+            return (month, booked, capacity, f"{utilisation:.0%}", f"{no_show_rate:.0%}")
+        key, count, invoiced, paid, outstanding = row
+        return (key or "-", count, f"£{invoiced:.2f}", f"£{paid:.2f}", f"£{outstanding:.2f}")
+
+    def export_heat_map(self):
+        try:
+            import analytics
+        except ImportError:
+            messagebox.showerror("Unavailable", "Heat maps need NumPy installed.")
+            return
+        path = filedialog.asksaveasfilename(
+            title="Save heat map", defaultextension=".html",
+            initialfile="utilisation_heat_map.html",
+            filetypes=[("HTML", "*.html")])
+        if not path:
+            return
+        columns = analytics.load_appointment_columns()
+        base, ext = os.path.splitext(path)
+        analytics.export_html(analytics.occupancy_matrix(columns), path,
+                              title="Average bookings per slot")
+        analytics.export_html(analytics.no_show_matrix(columns), f"{base}_no_show{ext}",
+                              title="No-show rate per slot", percent=True)
+        messagebox.showinfo("Exported", f"Heat maps saved to:\n{path}\n{base}_no_show{ext}")
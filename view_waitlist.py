@@ -0,0 +1,315 @@
+"""
+view_waitlist.py - Fixit Physio Enhanced System
+Waitlist screen, and the dialog offering a freed slot to waitlisted patients.
+"""
+
+import tkinter as tk
+from tkinter import ttk, messagebox
+import database
+import audit
+import waitlist
+from database import APPOINTMENT_TYPES, HOURS
+
+DAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri"]
+
+
+def describe_days(preferred_days):
+    return " ".join(DAY_NAMES[int(d) - 1] for d in sorted(preferred_days) if "1" <= d <= "5")
+
+
+class WaitlistScreen:
+
+    def __init__(self, parent, user_id, user_role):
+        self.parent    = parent
+        self.user_id   = user_id
+        self.user_role = user_role
+        self.entries   = {}
+        self.create_widgets()
+        self.refresh()
+
+    def create_widgets(self):
+        top = tk.Frame(self.parent, bg="#f0f0f0")
+        top.pack(fill=tk.X, padx=15, pady=(15, 5))
+        tk.Label(top, text="Waitlist", font=("Arial", 16, "bold"),
+                 bg="#f0f0f0").pack(side=tk.LEFT)
+        tk.Button(top, text="+ Add to Waitlist", bg="#16a085", fg="white",
+                  command=self.open_add, font=("Arial", 10, "bold"),
+                  relief=tk.FLAT, padx=10).pack(side=tk.RIGHT)
+
+        tf = tk.Frame(self.parent)
+        tf.pack(fill=tk.BOTH, expand=True, padx=15, pady=5)
+        sb = tk.Scrollbar(tf)
+        sb.pack(side=tk.RIGHT, fill=tk.Y)
+        cols = ("ID", "Patient", "Type", "Days", "Times", "Practitioner", "Priority", "Added")
+        self.tree = ttk.Treeview(tf, columns=cols, show="headings", yscrollcommand=sb.set)
+        sb.config(command=self.tree.yview)
+        for col, w in zip(cols, [40, 140, 90, 120, 90, 90, 60, 90]):
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=w)
+        self.tree.pack(fill=tk.BOTH, expand=True)
+
+        bf = tk.Frame(self.parent, bg="#f0f0f0")
+        bf.pack(fill=tk.X, padx=15, pady=8)
+        tk.Button(bf, text="Find Slots", command=self.find_slots,
+                  bg="#2E75B6", fg="white", width=12, relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+        tk.Button(bf, text="Remove", command=self.remove_selected,
+                  bg="#e74c3c", fg="white", width=10, relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+
+    def refresh(self):
+        for row in self.tree.get_children():
+            self.tree.delete(row)
+        self.entries = {}
+        for entry in waitlist.get_waitlist():
+            self.entries[entry.waitlist_id] = entry
+            self.tree.insert("", tk.END, iid=str(entry.waitlist_id), values=(
+                entry.waitlist_id, entry.patient_name, entry.appointment_type,
+                describe_days(entry.preferred_days),
+                f"{entry.earliest_time}-{entry.latest_time}",
+                entry.practitioner_id or "Any", entry.priority, entry.added_at[:10]
+            ))
+
+    def selected_entry(self):
+        sel = self.tree.selection()
+        if not sel:
+            messagebox.showwarning("Nothing selected", "Please select a waitlist entry.")
+            return None
+        return self.entries.get(int(sel[0]))
+
+    def open_add(self):
+        win = tk.Toplevel()
+        win.grab_set()
+        WaitlistForm(win, self.user_id, on_close=self.refresh)
+
+    def remove_selected(self):
+        entry = self.selected_entry()
+        if entry and messagebox.askyesno("Confirm", f"Remove {entry.patient_name} from the waitlist?"):
+            if waitlist.remove_entry(entry.waitlist_id):
+                self.refresh()
+
+    def find_slots(self):
+        """Offers the entry's patient the next free slots that suit them."""
+        entry = self.selected_entry()
+        if not entry:
+            return
+        slots = waitlist.slots_for_entry(entry)
+        if not slots:
+            messagebox.showinfo("No slots", "No suitable free slots in the next four weeks.")
+            return
+        win = tk.Toplevel()
+        win.grab_set()
+        EntrySlotsDialog(win, entry, slots, self.user_id, on_close=self.refresh)
+
+
+class WaitlistForm:
+    """Adds a patient to the waitlist."""
+
+    def __init__(self, window, user_id, on_close=None):
+        self.window   = window
+        self.user_id  = user_id
+        self.on_close = on_close
+        self.window.title("Add to Waitlist")
+        self.window.geometry("420x420")
+        self.window.resizable(False, False)
+        self.patients      = database.get_all_patients()
+        self.practitioners = database.get_practitioners()
+        self.create_widgets()
+
+    def create_widgets(self):
+        tk.Label(self.window, text="Add to Waitlist", font=("Arial", 14, "bold")).pack(pady=15)
+        form = tk.Frame(self.window, padx=30)
+        form.pack(fill=tk.BOTH)
+
+        tk.Label(form, text="Patient:", anchor="w").grid(row=0, column=0, sticky="w", pady=6)
+        self.patient_var = tk.StringVar()
+        ttk.Combobox(form, textvariable=self.patient_var, state="readonly", width=26,
+                     values=[f"{p.patient_id} - {p.name}" for p in self.patients]).grid(
+            row=0, column=1, pady=6, padx=(10, 0))
+
+        tk.Label(form, text="Type:", anchor="w").grid(row=1, column=0, sticky="w", pady=6)
+        self.type_var = tk.StringVar(value="Treatment")
+        ttk.Combobox(form, textvariable=self.type_var, values=APPOINTMENT_TYPES,
+                     state="readonly", width=26).grid(row=1, column=1, pady=6, padx=(10, 0))
+
+        tk.Label(form, text="Days:", anchor="w").grid(row=2, column=0, sticky="w", pady=6)
+        days_frame = tk.Frame(form)
+        days_frame.grid(row=2, column=1, pady=6, padx=(10, 0), sticky="w")
+        self.day_vars = []
+        for name in DAY_NAMES:
+            var = tk.BooleanVar(value=True)
+            tk.Checkbutton(days_frame, text=name, variable=var).pack(side=tk.LEFT)
+            self.day_vars.append(var)
+
+        tk.Label(form, text="Between:", anchor="w").grid(row=3, column=0, sticky="w", pady=6)
+        times = tk.Frame(form)
+        times.grid(row=3, column=1, pady=6, padx=(10, 0), sticky="w")
+        hours = [f"{h}:00" for h in HOURS] + ["19:00"]
+        self.earliest_var = tk.StringVar(value=hours[0])
+        self.latest_var   = tk.StringVar(value=hours[-1])
+        ttk.Combobox(times, textvariable=self.earliest_var, values=hours[:-1],
+                     width=6, state="readonly").pack(side=tk.LEFT)
+        tk.Label(times, text=" and ").pack(side=tk.LEFT)
+        ttk.Combobox(times, textvariable=self.latest_var, values=hours[1:],
+                     width=6, state="readonly").pack(side=tk.LEFT)
+
+        tk.Label(form, text="Practitioner:", anchor="w").grid(row=4, column=0, sticky="w", pady=6)
+        self.practitioner_var = tk.StringVar(value="Any")
+        ttk.Combobox(form, textvariable=self.practitioner_var, state="readonly", width=26,
+                     values=["Any"] + self.practitioners).grid(row=4, column=1, pady=6, padx=(10, 0))
+
+        tk.Label(form, text="Priority:", anchor="w").grid(row=5, column=0, sticky="w", pady=6)
+        self.priority_var = tk.StringVar(value="Normal")
+        ttk.Combobox(form, textvariable=self.priority_var, state="readonly", width=26,
+                     values=["Normal", "High", "Urgent"]).grid(row=5, column=1, pady=6, padx=(10, 0))
+
+        tk.Label(form, text="Notes:", anchor="w").grid(row=6, column=0, sticky="w", pady=6)
+        self.notes_entry = tk.Entry(form, width=28)
+        self.notes_entry.grid(row=6, column=1, pady=6, padx=(10, 0))
+
+        bf = tk.Frame(self.window)
+        bf.pack(pady=12)
+        tk.Button(bf, text="Add", command=self.save, bg="#16a085", fg="white", width=12,
+                  font=("Arial", 10, "bold"), relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+        tk.Button(bf, text="Cancel", command=self.window.destroy,
+                  width=10, relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+
+    def save(self):
+        if not self.patient_var.get():
+            messagebox.showerror("Error", "Please select a patient.")
+            return
+        days = "".join(str(i + 1) for i, var in enumerate(self.day_vars) if var.get())
+        if not days:
+            messagebox.showerror("Error", "Please choose at least one day.")
+            return
+        earliest, latest = self.earliest_var.get(), self.latest_var.get()
+        if earliest >= latest:
+            messagebox.showerror("Error", "The time window is empty.")
+            return
+        patient_id = int(self.patient_var.get().split(" - ")[0])
+        practitioner = self.practitioner_var.get()
+        waitlist_id = waitlist.add_entry(
+            patient_id, self.type_var.get(), days, earliest, latest,
+            practitioner_id=None if practitioner == "Any" else practitioner,
+            priority=["Normal", "High", "Urgent"].index(self.priority_var.get()),
+            notes=self.notes_entry.get().strip(), added_by=self.user_id
+        )
+        if waitlist_id is None:
+            messagebox.showerror("Error", "Could not add to the waitlist.")
+            return
+        audit.record(audit.CREATE, "patient", patient_id, f"waitlist #{waitlist_id}")
+        if self.on_close:
+            self.on_close()
+        self.window.destroy()
+
+
+class SlotOfferDialog:
+    """
+    Shown after a cancellation: lists the best waitlisted patients for
+    the freed slot and books the chosen one into it.
+    """
+
+    def __init__(self, window, slot, candidates, user_id, on_close=None):
+        self.window     = window
+        self.slot       = slot
+        self.candidates = candidates
+        self.user_id    = user_id
+        self.on_close   = on_close
+        self.window.title("Offer Slot to Waitlist")
+        self.window.geometry("460x300")
+        self.create_widgets()
+
+    def create_widgets(self):
+        slot = self.slot
+        tk.Label(self.window, text="Slot freed", font=("Arial", 14, "bold")).pack(pady=(15, 2))
+        tk.Label(self.window, text=f"{slot.appointment_date} at {slot.appointment_time} "
+                                   f"with {slot.practitioner_id} ({slot.duration_minutes} min)",
+                 fg="gray").pack()
+        cols = ("Patient", "Type", "Priority", "Waiting since")
+        self.tree = ttk.Treeview(self.window, columns=cols, show="headings", height=5)
+        for col, w in zip(cols, [150, 100, 70, 110]):
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=w)
+        for i, entry in enumerate(self.candidates):
+            self.tree.insert("", tk.END, iid=str(i), values=(
+                entry.patient_name, entry.appointment_type, entry.priority, entry.added_at[:10]))
+        if self.candidates:
+            self.tree.selection_set("0")
+        self.tree.pack(fill=tk.BOTH, expand=True, padx=15, pady=10)
+
+        bf = tk.Frame(self.window)
+        bf.pack(pady=8)
+        tk.Button(bf, text="Book Selected", command=self.book, bg="#27ae60", fg="white",
+                  width=14, relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+        tk.Button(bf, text="Leave Empty", command=self.window.destroy,
+                  width=12, relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+
+    def book(self):
+        sel = self.tree.selection()
+        if sel:
+            self.fill(self.candidates[int(sel[0])], self.slot)
+
+    def fill(self, entry, slot):
+        booking = waitlist.fill_slot(entry, slot, self.user_id)
+        if booking is None:
+            messagebox.showerror("Not booked", f"{entry.patient_name} is no longer "
+                                               f"on the waitlist.")
+            return
+        if booking.appointment_id is None:
+            messagebox.showerror("Not booked", "The slot is no longer free." if booking.conflicts
+                                 else "Could not book the appointment.")
+            return
+        audit.record(audit.CREATE, "appointment", booking.appointment_id,
+                     f"waitlist #{entry.waitlist_id}")
+        messagebox.showinfo("Booked", f"{entry.patient_name} booked for "
+                                      f"{slot.appointment_date} at {slot.appointment_time}.")
+        if self.on_close:
+            self.on_close()
+        self.window.destroy()
+
+
+class EntrySlotsDialog(SlotOfferDialog):
+    """The reverse view: free slots for one waitlisted patient."""
+
+    def __init__(self, window, entry, slots, user_id, on_close=None):
+        self.entry = entry
+        self.slots = slots
+        super().__init__(window, None, [], user_id, on_close)
+        self.window.title("Free Slots")
+
+    def create_widgets(self):
+        tk.Label(self.window, text=f"Free slots for {self.entry.patient_name}",
+                 font=("Arial", 14, "bold")).pack(pady=15)
+        cols = ("Date", "Time", "Practitioner")
+        self.tree = ttk.Treeview(self.window, columns=cols, show="headings", height=5)
+        for col, w in zip(cols, [120, 80, 120]):
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=w)
+        for i, slot in enumerate(self.slots):
+            self.tree.insert("", tk.END, iid=str(i), values=(
+                slot.appointment_date, slot.appointment_time, slot.practitioner_id))
+        self.tree.selection_set("0")
+        self.tree.pack(fill=tk.BOTH, expand=True, padx=15, pady=5)
+        bf = tk.Frame(self.window)
+        bf.pack(pady=8)
+        tk.Button(bf, text="Book Selected", command=self.book, bg="#27ae60", fg="white",
+                  width=14, relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+        tk.Button(bf, text="Close", command=self.window.destroy,
+                  width=10, relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+
+    def book(self):
+        sel = self.tree.selection()
+        if sel:
+            self.fill(self.entry, self.slots[int(sel[0])])
+
+
+def offer_cancelled_slots(appointment_ids, user_id, on_close=None):
+    """
+    After appointments are cancelled, opens an offer dialog for each freed
+    slot that waitlisted patients fit. Returns how many were opened.
+    """
+    opened = 0
+    for slot, candidates in waitlist.on_cancelled(appointment_ids):
+        if candidates:
+            win = tk.Toplevel()
+            SlotOfferDialog(win, slot, candidates, user_id, on_close)
+            opened += 1
+    return opened
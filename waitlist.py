@@ -0,0 +1,274 @@
+"""
+waitlist.py - Fixit Physio Enhanced System
+Waitlist of patients wanting an earlier appointment, and the matcher that
+offers them slots freed by cancellations.
+
+Each entry records the appointment type, preferred weekdays (digits 1-5,
+Monday = 1), a time window and optionally a practitioner. propose()
+takes a batch of open slots, reads the waiting entries whose time window
+could fit any of them in one indexed query, buckets them by weekday, and
+ranks the candidates for each slot with a heap: higher priority first,
+then a matching appointment type, then whoever has waited longest. In a
+burst of cancellations each slot's first choice is a different patient.
+"""
+
+import heapq
+import sqlite3
+from collections import defaultdict
+from datetime import datetime
+import database
+import records
+
+WAITING = "Waiting"
+BOOKED  = "Booked"
+REMOVED = "Removed"
+
+PROPOSALS_PER_SLOT = 3
+
+
+# ─────────────────────────────────────────────────────────
+# ENTRIES
+# ─────────────────────────────────────────────────────────
+
+def add_entry(patient_id, appointment_type, preferred_days="12345", earliest_time="08:00",
+              latest_time="19:00", practitioner_id=None, duration_minutes=None,
+              priority=0, notes="", added_by=None):
+    """
+    Adds a patient to the waitlist. Returns the new waitlist_id or None.
+    Raises ValueError for a duration outside 1-MAX_DURATION minutes.
+    """
+    if duration_minutes:
+        database.check_duration(duration_minutes)
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            '''INSERT INTO waitlist
+               (patient_id, appointment_type, preferred_days, earliest_time, latest_time,
+                practitioner_id, duration_minutes, priority, notes, added_by)
+               VALUES (?,?,?,?,?,?,?,?,?,?)''',
+            (patient_id, appointment_type, preferred_days, earliest_time, latest_time,
+             practitioner_id or None, duration_minutes or database.DEFAULT_DURATION,
+             priority, notes, added_by)
+        )
+        waitlist_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        return waitlist_id
+    except sqlite3.Error as e:
+        database.log_error("Add waitlist entry", e)
+        return None
+
+
+def set_status(waitlist_id, status, appointment_id=None):
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE waitlist SET status = ?, appointment_id = ? WHERE waitlist_id = ?",
+            (status, appointment_id, waitlist_id)
+        )
+        conn.commit()
+        conn.close()
+        return True
+    except sqlite3.Error as e:
+        database.log_error("Update waitlist", e)
+        return False
+
+
+def remove_entry(waitlist_id):
+    return set_status(waitlist_id, REMOVED)
+
+
+ENTRY_COLUMNS = '''
+    w.waitlist_id, w.patient_id, p.name, w.appointment_type, w.practitioner_id,
+    w.preferred_days, w.earliest_time, w.latest_time, w.duration_minutes,
+    w.priority, w.added_at, w.notes
+'''
+
+
+def get_waitlist(status=WAITING):
+    """Returns entries with the given status as WaitlistRow, highest priority first."""
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = records.factory(records.WaitlistRow)
+        cursor.execute(
+            f'''SELECT {ENTRY_COLUMNS}
+                FROM waitlist w JOIN patients p ON w.patient_id = p.patient_id
+                WHERE w.status = ?
+                ORDER BY w.priority DESC, w.added_at, w.waitlist_id''',
+            (status,)
+        )
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+    except sqlite3.Error as e:
+        database.log_error("Fetch waitlist", e)
+        return []
+
+
+# ─────────────────────────────────────────────────────────
+# MATCHING
+# ─────────────────────────────────────────────────────────
+
+def slot_from_appointment(appt):
+    """The slot an AppointmentDetail held, as an OpenSlot."""
+    return records.OpenSlot(appt.practitioner_id, appt.appointment_date, appt.appointment_time,
+                            appt.duration_minutes, appt.appointment_type)
+
+
+def _end_time(slot):
+    start = datetime.strptime(slot.appointment_time, "%H:%M")
+    minutes = start.hour * 60 + start.minute + slot.duration_minutes
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _weekday(slot):
+    return str(datetime.strptime(slot.appointment_date, "%Y-%m-%d").isoweekday())
+
+
+def _fits(entry, slot, slot_end):
+    return (entry.earliest_time <= slot.appointment_time
+            and entry.latest_time >= slot_end
+            and entry.duration_minutes <= slot.duration_minutes
+            and (entry.practitioner_id is None or entry.practitioner_id == slot.practitioner_id))
+
+
+def _rank(entry, slot):
+    """Heap key: priority, then matching type, then longest wait."""
+    return (-entry.priority, entry.appointment_type != slot.appointment_type,
+            entry.added_at, entry.waitlist_id)
+
+
+def _candidates(slots):
+    """Waiting entries whose window could hold any of the slots, by weekday digit."""
+    earliest = min(slot.appointment_time for slot in slots)
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = records.factory(records.WaitlistRow)
+        cursor.execute(
+            f'''SELECT {ENTRY_COLUMNS}
+                FROM waitlist w JOIN patients p ON w.patient_id = p.patient_id
+                WHERE w.status = 'Waiting' AND w.earliest_time <= ?''',
+            (max(slot.appointment_time for slot in slots),)
+        )
+        entries = [e for e in cursor.fetchall() if e.latest_time > earliest]
+        conn.close()
+    except sqlite3.Error as e:
+        database.log_error("Waitlist match", e)
+        return {}
+    by_day = defaultdict(list)
+    for entry in entries:
+        for day in set(entry.preferred_days):
+            by_day[day].append(entry)
+    return by_day
+
+
+def propose(slots, per_slot=PROPOSALS_PER_SLOT):
+    """
+    Ranks waitlisted patients for each open slot.
+    Returns [(slot, [WaitlistRow, ...]), ...] in slot start order. No
+    patient is first choice for two slots, so a burst can be filled by
+    taking every first choice: a patient already first choice for an
+    earlier slot is only listed after the others, and a slot only such
+    patients fit gets an empty list, as does a slot nobody fits.
+    """
+    slots = sorted(slots, key=lambda s: (s.appointment_date, s.appointment_time))
+    if not slots:
+        return []
+    by_day = _candidates(slots)
+    first_choices = set()
+    proposals = []
+    for slot in slots:
+        slot_end = _end_time(slot)
+        fitting = (e for e in by_day.get(_weekday(slot), ()) if _fits(e, slot, slot_end))
+        ranked = heapq.nsmallest(per_slot + len(first_choices), fitting,
+                                 key=lambda e: _rank(e, slot))
+        ranked.sort(key=lambda e: e.patient_id in first_choices)
+        ranked = ranked[:per_slot]
+        if ranked and ranked[0].patient_id in first_choices:
+            ranked = []
+        elif ranked:
+            first_choices.add(ranked[0].patient_id)
+        proposals.append((slot, ranked))
+    return proposals
+
+
+def on_cancelled(appointment_ids, per_slot=PROPOSALS_PER_SLOT):
+    """
+    Proposals for the slots of just-cancelled appointments. Past slots
+    and slots without a practitioner are skipped.
+    """
+    now = database.now_epoch_minutes()
+    slots = []
+    for appointment_id in appointment_ids:
+        appt = database.get_appointment_by_id(appointment_id)
+        if (appt and appt.practitioner_id
+                and database.to_epoch_minutes(appt.appointment_date,
+                                              appt.appointment_time) > now):
+            slots.append(slot_from_appointment(appt))
+    return propose(slots, per_slot)
+
+
+def _claim(waitlist_id):
+    """Marks a Waiting entry Booked; False if it was no longer Waiting."""
+    try:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE waitlist SET status = ? WHERE waitlist_id = ? AND status = ?",
+            (BOOKED, waitlist_id, WAITING)
+        )
+        conn.commit()
+        conn.close()
+        return cursor.rowcount == 1
+    except sqlite3.Error as e:
+        database.log_error("Claim waitlist entry", e)
+        return False
+
+
+def fill_slot(entry, slot, created_by):
+    """
+    Books a waitlisted patient into an open slot (with the practitioner's
+    overlap check) and marks the entry Booked. Returns the Booking, or
+    None if the entry is no longer Waiting (e.g. booked from another
+    dialog). The entry is claimed first, so it is never booked twice.
+    """
+    if not _claim(entry.waitlist_id):
+        return None
+    booking = None
+    try:
+        booking = database.book_appointment(
+            entry.patient_id, slot.appointment_date, slot.appointment_time,
+            entry.appointment_type, f"From waitlist #{entry.waitlist_id}", created_by,
+            entry.duration_minutes, slot.practitioner_id, alternatives=0
+        )
+    finally:
+        if booking is not None and booking.appointment_id is not None:
+            set_status(entry.waitlist_id, BOOKED, booking.appointment_id)
+        else:
+            set_status(entry.waitlist_id, WAITING)    # release the claim
+    return booking
+
+
+def slots_for_entry(entry, count=5, days=28, practitioners=None):
+    """
+    Free slots suiting a waitlist entry in the next `days` days, searching
+    its practitioner (or every practitioner). Returns OpenSlot records by
+    start time.
+    """
+    candidates = practitioners or ([entry.practitioner_id] if entry.practitioner_id
+                                   else database.get_practitioners())
+    found = []
+    start = database.now_epoch_minutes()
+    for practitioner in candidates:
+        for free in database.find_free_slots(practitioner, start, entry.duration_minutes,
+                                             count=database.SLOTS_PER_DAY * days, days=days):
+            slot = records.OpenSlot(practitioner, free.appointment_date, free.appointment_time,
+                                    entry.duration_minutes, entry.appointment_type)
+            if _weekday(slot) in entry.preferred_days and _fits(entry, slot, _end_time(slot)):
+                found.append(slot)
+    found.sort(key=lambda s: (s.appointment_date, s.appointment_time))
+    return found[:count]